@@ -1,31 +1,54 @@
+import base64
+import gzip
+import hashlib
 import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
-from flask import Flask, redirect, url_for, render_template, abort, request, jsonify, send_file
+from flask import Flask, redirect, url_for, render_template, abort, request, jsonify, send_file, make_response
 from wtforms.validators import NumberRange
 
 import backend
+import catalog
 import comparesort
+import encoding
 import labels
+import migrations
+import model
 import ranking
 import sampling
 import sessions
+import slicecache
 import thumbnails
 from forms import CreateCategoricalSessionForm, CreateComparisonSessionForm, ComparisonNumberRange, \
     CreateCategoricalSliceSessionForm, ImportSessionForm, CreateSortSessionForm
+from encoding import ImageFormat, SliceEncoding
 from model import db, LabelSession
-from sessions import LabelSessionType
+from sessions import LabelSessionType, SortStrategy
 
 application = Flask(__name__)
 
 DB_DIR_PATH = 'db'
 DB_FILE_NAME = 'label_database.db'
 
-application.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(DB_DIR_PATH, DB_FILE_NAME)
+application.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI',
+                                                                'sqlite:///' + os.path.join(DB_DIR_PATH, DB_FILE_NAME))
 application.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# The engine is created when this module is imported (to create and upgrade the tables), so its options and the SQLite
+# pragmas are import-time settings: changing them in application.config afterwards has no effect
+if model.is_sqlite_uri(application.config['SQLALCHEMY_DATABASE_URI']):
+    application.config['SQLALCHEMY_ENGINE_OPTIONS'] = model.SQLITE_ENGINE_OPTIONS
+application.config['SQLITE_PRAGMAS'] = model.SQLITE_PRAGMAS
 db.init_app(application)
 
+# Volume cache settings can be set in the environment, or in application.config before the first request
+application.config['VOLUME_CACHE_MAX_BYTES'] = int(os.environ.get('VOLUME_CACHE_MAX_BYTES',
+                                                                  backend.VOLUME_CACHE_MAX_BYTES))
+application.config['VOLUME_CACHE_DTYPE'] = os.environ.get('VOLUME_CACHE_DTYPE', backend.VOLUME_DTYPE)
+
 if not os.path.exists('db'):
     os.mkdir('db')
 
@@ -33,7 +56,78 @@ if not os.path.exists(backend.DATASETS_PATH):
     os.makedirs(backend.DATASETS_PATH, exist_ok=True)
 
 with application.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        model.set_sqlite_pragmas(db.engine, application.config['SQLITE_PRAGMAS'])
     db.create_all()
+    migrations.upgrade_database(db.engine)
+
+application.config['THUMB_CACHE_MAX_AGE'] = 60 * 60  # Seconds browsers may reuse a slice without revalidating
+
+# Default encoding of /thumb slices (can be overridden per request with the format, quality and compress_level args)
+application.config['THUMB_FORMAT'] = ImageFormat.PNG.name
+application.config['THUMB_QUALITY'] = encoding.DEFAULT_QUALITY
+application.config['THUMB_COMPRESS_LEVEL'] = encoding.DEFAULT_COMPRESS_LEVEL
+
+application.config['RENDERED_CACHE_MAX_BYTES'] = slicecache.RENDERED_CACHE_MAX_BYTES
+application.config['RENDERED_DISK_CACHE_PATH'] = slicecache.RENDERED_DISK_CACHE_PATH
+application.config['RENDERED_DISK_CACHE_MAX_BYTES'] = slicecache.RENDERED_DISK_CACHE_MAX_BYTES
+slice_cache: Optional[slicecache.TieredSliceCache] = None  # Created from the config before the first request
+
+# Opt-in client-side slicing in the viewer (the volume is downloaded once as uint8, see the /volume route). Slices
+# are windowed from the quantized volume, so they can differ slightly from the slices rendered by the server.
+# The viewer page can also turn it on with ?local=1.
+application.config['VIEWER_LOCAL_SLICING'] = False
+application.config['VIEWER_VOLUME_DOWNSAMPLE'] = 1
+application.config['VOLUME_GZIP_LEVEL'] = 1
+
+# Pyramid level of the viewer's side views when they are rendered by the server (see backend.PYRAMID_MAX_LEVEL)
+application.config['VIEWER_PREVIEW_LEVEL'] = 1
+
+application.config['THUMB_BATCH_WORKERS'] = 4
+application.config['THUMB_JOB_WORKERS'] = thumbnails.THUMB_JOB_WORKERS
+thumb_batch_executor: Optional[ThreadPoolExecutor] = None  # Created from the config before the first request
+
+application.config['SORT_LEASE_SECONDS'] = comparesort.SORT_LEASE_SECONDS
+
+LABELER_ID_COOKIE = 'labeler_id'
+LABELER_ID_MAX_AGE = 365 * 24 * 60 * 60
+
+# Indexes are built in the background once the app starts serving requests (not when this module is imported)
+application.config['STATS_INDEX_BACKGROUND_BUILD'] = True
+application.config['CATALOG_BACKGROUND_SCAN'] = True
+
+
+def build_indexes():
+    # Stats are built first, so the catalog can take each image's max value from the stats index
+    if application.config['STATS_INDEX_BACKGROUND_BUILD']:
+        backend.build_stats_indexes()
+    if application.config['CATALOG_BACKGROUND_SCAN']:
+        with application.app_context():
+            catalog.scan_datasets(db.session)
+
+
+@application.before_first_request
+def apply_config():
+    """
+    Applies the config values which are read by other modules, once the config can no longer change.
+    """
+    global slice_cache, thumb_batch_executor
+
+    backend.volume_cache.max_bytes = application.config['VOLUME_CACHE_MAX_BYTES']
+    backend.volume_dtype = application.config['VOLUME_CACHE_DTYPE']
+    thumbnails.THUMB_JOB_WORKERS = application.config['THUMB_JOB_WORKERS']
+    comparesort.SORT_LEASE_SECONDS = application.config['SORT_LEASE_SECONDS']
+
+    slice_cache = slicecache.create_slice_cache(application.config['RENDERED_CACHE_MAX_BYTES'],
+                                                application.config['RENDERED_DISK_CACHE_PATH'],
+                                                application.config['RENDERED_DISK_CACHE_MAX_BYTES'])
+    thumb_batch_executor = ThreadPoolExecutor(max_workers=application.config['THUMB_BATCH_WORKERS'])
+
+
+@application.before_first_request
+def start_background_indexing():
+    if application.config['STATS_INDEX_BACKGROUND_BUILD'] or application.config['CATALOG_BACKGROUND_SCAN']:
+        threading.Thread(target=build_indexes, daemon=True).start()
 
 
 @application.route('/')
@@ -46,26 +140,250 @@ def thumbnail(dataset_name: str, image_name: str):
     dataset = backend.get_dataset(dataset_name)
     d_img = backend.get_image(dataset, image_name)
 
-    slice_index = request.args.get('slice_index', default=0, type=int)
     slice_type_name = request.args.get('slice_type', default='AXIAL', type=str)
+    if slice_type_name not in backend.SliceType.__members__:
+        abort(400)
+    slice_type = backend.SliceType[slice_type_name]
+
+    slice_index = get_int_arg('slice_index')
+    if slice_index is None:
+        slice_index = 0
+    check_slice_index(d_img, slice_type, slice_index)
 
     intensity_min = request.args.get('min', default=0, type=int)
     intensity_max = request.args.get('max', default=0, type=int)
 
+    level = get_slice_level(d_img, slice_type, get_int_arg('size'), get_int_arg('level'))
+    slice_encoding = get_request_encoding()
+
+    etag = slice_etag(d_img, slice_index, slice_type, intensity_min, intensity_max, level, slice_encoding)
+    if request.if_none_match.contains(etag):
+        return cacheable_response(application.response_class(status=304), etag)
+
+    slice_bytes = render_slice(d_img, slice_index, slice_type, intensity_min, intensity_max, level, slice_encoding,
+                               etag)
+
+    response = send_file(BytesIO(slice_bytes),
+                         mimetype=encoding.FORMAT_MIMETYPES[slice_encoding.image_format],
+                         add_etags=False)
+    if slice_encoding.image_format == ImageFormat.RAW:
+        width, height = backend.get_slice_size(d_img, slice_type, level)
+        response.headers['X-Slice-Width'] = str(width)
+        response.headers['X-Slice-Height'] = str(height)
+    return cacheable_response(response, etag)
+
+
+def get_request_encoding() -> SliceEncoding:
+    """
+    Gets the slice encoding of a request, aborting with 400 if the format or a setting is invalid. Only the setting
+    which applies to the format is kept (quality for JPEG and WebP, compress_level for PNG), so the other one doesn't
+    change the slice's ETag or cache key.
+    """
+    format_name = request.args.get('format', default=application.config['THUMB_FORMAT'], type=str).upper()
+    if format_name not in ImageFormat.__members__:
+        abort(400)
+    image_format = ImageFormat[format_name]
+
+    quality = get_int_arg('quality')
+    compress_level = get_int_arg('compress_level')
+    if quality is not None and not encoding.QUALITY_RANGE[0] <= quality <= encoding.QUALITY_RANGE[1]:
+        abort(400)
+    if compress_level is not None and \
+            not encoding.COMPRESS_LEVEL_RANGE[0] <= compress_level <= encoding.COMPRESS_LEVEL_RANGE[1]:
+        abort(400)
+
+    if image_format == ImageFormat.PNG:
+        return SliceEncoding(image_format, compress_level=compress_level if compress_level is not None
+                             else application.config['THUMB_COMPRESS_LEVEL'])
+    if image_format in (ImageFormat.JPEG, ImageFormat.WEBP):
+        return SliceEncoding(image_format, quality=quality if quality is not None
+                             else application.config['THUMB_QUALITY'])
+    return SliceEncoding(image_format)
+
+
+def get_int_arg(key: str) -> Optional[int]:
+    """
+    Gets an optional integer query arg, aborting with 400 if it is given but isn't an integer.
+    """
+    value = request.args.get(key, type=int)
+    if value is None and key in request.args:
+        abort(400)
+    return value
+
+
+def get_slice_level(d_img: backend.DataImage, slice_type: backend.SliceType,
+                    size: Optional[int], level: Optional[int]) -> int:
+    """
+    Gets the pyramid level of a slice request, either given directly (level) or as the smallest size the larger side
+    of the slice should have (size). Full resolution (level 0) is used if neither is given.
+    """
+    if size is not None:
+        return backend.get_pyramid_level(d_img, slice_type, size)
+    return min(max(level or 0, 0), backend.PYRAMID_MAX_LEVEL)
+
+
+def slice_etag(d_img: backend.DataImage, slice_index: int, slice_type: backend.SliceType,
+               intensity_min: int, intensity_max: int, level: int, slice_encoding: SliceEncoding) -> str:
+    return content_etag(d_img.dataset.name, d_img.name, backend.get_image_version(d_img),
+                        slice_type.name, slice_index, intensity_min, intensity_max, level,
+                        slice_encoding.image_format.name, slice_encoding.quality, slice_encoding.compress_level)
+
+
+def content_etag(*key_parts) -> str:
+    return hashlib.sha1('/'.join(str(p) for p in key_parts).encode('utf-8')).hexdigest()
+
+
+def render_slice(d_img: backend.DataImage, slice_index: int, slice_type: backend.SliceType,
+                 intensity_min: int, intensity_max: int, level: int, slice_encoding: SliceEncoding,
+                 etag: str) -> bytes:
+    slice_bytes = slice_cache.get(etag)
+    if slice_bytes is None:
+        slice_image = backend.get_slice(d_img, slice_index, slice_type, intensity_min, intensity_max, level=level)
+        slice_bytes = encoding.encode_image(slice_image, slice_encoding)
+        slice_cache.put(etag, slice_bytes)
+    return slice_bytes
+
+
+SliceRequest = Tuple[backend.DataImage, int, backend.SliceType, int, int, int]
+
+
+def get_json_int(slice_json: dict, key: str, default: Optional[int]) -> Optional[int]:
+    value = slice_json.get(key)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        abort(400)
+
+
+def get_image_info(d_img: backend.DataImage) -> Tuple[Tuple[int, int, int], int]:
+    """
+    Gets info for an image being opened (see backend.get_image_info), refreshing its catalog row if the file was
+    modified in place.
+    """
+    catalog.sync_image(db.session, d_img)
+    return backend.get_image_info(d_img)
+
+
+def check_slice_index(d_img: backend.DataImage, slice_type: backend.SliceType, slice_index: int):
+    if not 0 <= slice_index < backend.get_canonical_shape(d_img.path)[slice_type.value]:
+        abort(400)
+
+
+def get_batch_slice_request(slice_json: dict) -> SliceRequest:
+    """
+    Gets one slice of a /thumbs request, aborting with 400 if its image doesn't exist or the slice is out of bounds.
+    """
+    if not isinstance(slice_json, dict):
+        abort(400)
+    dataset = backend.get_dataset(str(slice_json.get('dataset', '')))
+    if dataset is None:
+        abort(400)
+    image_name = str(slice_json.get('image', ''))
+    if image_name not in backend.get_dataset_index(dataset).image_indices:
+        abort(400)
+    d_img = backend.get_image(dataset, image_name)
+
+    slice_type_name = str(slice_json.get('slice_type', 'AXIAL'))
+    if slice_type_name not in backend.SliceType.__members__:
+        abort(400)
     slice_type = backend.SliceType[slice_type_name]
 
-    slice_image = backend.get_slice(d_img, slice_index, slice_type, intensity_min, intensity_max)
+    slice_index = get_json_int(slice_json, 'slice_index', 0)
+    check_slice_index(d_img, slice_type, slice_index)
+
+    return (d_img, slice_index, slice_type, get_json_int(slice_json, 'min', 0), get_json_int(slice_json, 'max', 0),
+            get_slice_level(d_img, slice_type, get_json_int(slice_json, 'size', None),
+                            get_json_int(slice_json, 'level', None)))
+
+
+@application.route('/thumbs', methods=['POST'])
+def thumbnails_batch():
+    """
+    Renders many slices in one request. The JSON body contains a list of slices, each with the same fields as the
+    /thumb route (dataset, image, slice_index, slice_type, min, max and optionally level or size). Slices are returned
+    in the same order, encoded as base64, and the encoding is selected with the same query args as /thumb.
+
+    A slice may also include the ETag of a copy the client already has. If it still matches, the slice is returned
+    as not_modified without its data (like a 304 from /thumb), since POST responses can't be cached by the browser.
+    """
+    slice_encoding = get_request_encoding()
+
+    slices_json = request.json.get('slices') if request.is_json else None
+    if not isinstance(slices_json, list):
+        abort(400)
+    slice_requests: List[SliceRequest] = [get_batch_slice_request(slice_json) for slice_json in slices_json]
+    etags = [slice_etag(*slice_request, slice_encoding) for slice_request in slice_requests]
+
+    # Render slices from the same volume together, so each volume is only looked up (or loaded) by one worker
+    slice_indices_by_image: Dict[backend.DataImage, List[int]] = {}
+    for i, slice_request in enumerate(slice_requests):
+        if slices_json[i].get('etag') != etags[i]:
+            slice_indices_by_image.setdefault(slice_request[0], []).append(i)
+
+    def render_image_slices(indices: List[int]) -> List[Tuple[int, bytes]]:
+        return [(i, render_slice(*slice_requests[i], slice_encoding, etags[i])) for i in indices]
+
+    futures = [thumb_batch_executor.submit(render_image_slices, indices)
+               for indices in slice_indices_by_image.values()]
+
+    results_json = [{'etag': etag, 'not_modified': True} for etag in etags]
+    for future in futures:
+        for i, slice_bytes in future.result():
+            results_json[i] = {
+                'etag': etags[i],
+                'not_modified': False,
+                'data': base64.b64encode(slice_bytes).decode('ascii')
+            }
+
+    return jsonify({
+        'mimetype': encoding.FORMAT_MIMETYPES[slice_encoding.image_format],
+        'slices': results_json
+    })
+
+
+@application.route('/volume/<string:dataset_name>/<string:image_name>')
+def volume(dataset_name: str, image_name: str):
+    """
+    Streams an image's volume as uint8 voxels in C order (Sagittal, Coronal, Axial), gzip-compressed when the client
+    accepts it. The shape and the intensity mapped to 255 are sent in the X-Volume-Shape and X-Volume-Max headers.
+    """
+    dataset = backend.get_dataset(dataset_name)
+    d_img = backend.get_image(dataset, image_name)
+
+    downsample = max(1, request.args.get('downsample', default=1, type=int))
+    use_gzip = 'gzip' in request.accept_encodings
+
+    etag = content_etag(dataset.name, d_img.name, backend.get_image_version(d_img), downsample, use_gzip)
+    if request.if_none_match.contains(etag):
+        return cacheable_response(application.response_class(status=304), etag)
+
+    volume_data, max_value = backend.get_volume_uint8(d_img, downsample)
+
+    volume_bytes = volume_data.tobytes()
+    if use_gzip:
+        volume_bytes = gzip.compress(volume_bytes, compresslevel=application.config['VOLUME_GZIP_LEVEL'], mtime=0)
+
+    response = send_file(BytesIO(volume_bytes), mimetype='application/octet-stream', add_etags=False)
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['X-Volume-Shape'] = ','.join(str(dim) for dim in volume_data.shape)
+    response.headers['X-Volume-Max'] = str(max_value)
+    return cacheable_response(response, etag)
 
-    img_io = BytesIO()
-    slice_image.save(img_io, 'PNG')
-    img_io.seek(0)
 
-    return send_file(img_io, mimetype='image/png')
+def cacheable_response(response, etag: str):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = application.config['THUMB_CACHE_MAX_AGE']
+    return response
 
 
 @application.route('/export-labels/<int:session_id>')
 def export_labels(session_id: int):
-    label_session = sessions.get_session_by_id(db.session, session_id)
+    label_session = sessions.get_session_by_id(db.session, session_id, load_labels=True)
     if label_session is None:
         abort(400)
 
@@ -97,10 +415,18 @@ def generate_thumbnails(session_id: int):
     label_session = sessions.get_session_by_id(db.session, session_id)
     if label_session is None:
         abort(400)
-    thumbnails.create_thumbnails(label_session)
+    thumbnails.start_thumbnail_job(label_session)
     return redirect(url_for('slice_rankings', session_id=session_id))
 
 
+@application.route('/api/thumbnail-job/<int:session_id>')
+def api_thumbnail_job(session_id: int):
+    job = thumbnails.get_thumbnail_job(session_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.to_json())
+
+
 @application.route('/datasets')
 def dataset_list():
     datasets = [(d, backend.get_images(d), sessions.get_sessions(db.session, d))
@@ -133,11 +459,7 @@ def session_overview(session_id: int):
     label_session = sessions.get_session_by_id(db.session, session_id)
     dataset = backend.get_dataset(label_session.dataset)
 
-    resume_point = None
-    for session_element in label_session.elements:
-        if len(session_element.labels) == 0:
-            resume_point = session_element.element_index
-            break
+    resume_point = labels.get_resume_point(db.session, label_session)
 
     if label_session.session_type == LabelSessionType.CATEGORICAL_IMAGE.name:
         images = backend.get_images(dataset)
@@ -161,6 +483,7 @@ def session_overview(session_id: int):
         labels_complete = comparesort.add_next_comparison(db.session, label_session)[0]
         return render_template('session_overview_sort.html',
                                label_session=label_session,
+                               sort_strategy=comparesort.get_sort_strategy(label_session),
                                dataset=dataset,
                                resume_point=resume_point,
                                labels_complete=labels_complete,
@@ -174,8 +497,13 @@ def session_overview(session_id: int):
 def slice_rankings(session_id: int):
     label_session = sessions.get_session_by_id(db.session, session_id)
 
+    method_name = request.args.get('method', default=ranking.RankingMethod.SCORE.name, type=str)
+    if method_name not in ranking.RankingMethod.__members__:
+        abort(400)
+    method = ranking.RankingMethod[method_name]
+
     if label_session.session_type == LabelSessionType.COMPARISON_SLICE.name:
-        ranked_slices = ranking.rank_slices(label_session)
+        ranked_slices = ranking.rank_slices(label_session, method)
     elif label_session.session_type == LabelSessionType.SORT_SLICE.name:
         complete, _, sorted_slices = comparesort.add_next_comparison(db.session, label_session)
         if not complete:
@@ -190,8 +518,11 @@ def slice_rankings(session_id: int):
     return render_template('slice_rankings.html',
                            label_session=label_session,
                            ranked_slices=ranked_slices,
+                           ranking_method=method,
+                           ranking_methods=list(ranking.RankingMethod),
                            thumbs_data=thumbs_data,
-                           num_thumbs_missing=num_thumbs_missing)
+                           num_thumbs_missing=num_thumbs_missing,
+                           thumbnail_job=thumbnails.get_thumbnail_job(session_id))
 
 
 @application.route('/import-session/<string:dataset_name>', methods=['GET', 'POST'])
@@ -283,8 +614,7 @@ def create_comparison_session(dataset_name: str):
     current_sessions = sessions.get_sessions(db.session, dataset)
     label_session_count = len(current_sessions)
 
-    images = backend.get_images(dataset)
-    total_image_count = len(images)
+    total_image_count = catalog.get_image_count(db.session, dataset)
 
     form = CreateComparisonSessionForm(meta={'csrf': False})
 
@@ -306,7 +636,8 @@ def create_comparison_session(dataset_name: str):
             slice_type = backend.SliceType[form.slice_type.data]
             if form.comparisons.data == 'create':
                 slices = sampling.sample_slices(dataset, slice_type, form.image_count.data, form.slice_count.data,
-                                                form.min_slice_percent.data, form.max_slice_percent.data)
+                                                form.min_slice_percent.data, form.max_slice_percent.data,
+                                                catalog.get_volume_widths(db.session, dataset, slice_type))
                 if form.comparison_count.data is None:
                     comparisons = sampling.all_comparisons(slices)
                 else:
@@ -343,8 +674,7 @@ def create_sort_session(dataset_name: str):
     current_sessions = sessions.get_sessions(db.session, dataset)
     label_session_count = len(current_sessions)
 
-    images = backend.get_images(dataset)
-    total_image_count = len(images)
+    total_image_count = catalog.get_image_count(db.session, dataset)
 
     form = CreateSortSessionForm(meta={'csrf': False})
 
@@ -365,12 +695,14 @@ def create_sort_session(dataset_name: str):
             if form.slices_from.data == 'create':
                 slice_type = backend.SliceType[form.slice_type.data]
                 slices = sampling.sample_slices(dataset, slice_type, form.image_count.data, form.slice_count.data,
-                                                form.min_slice_percent.data, form.max_slice_percent.data)
+                                                form.min_slice_percent.data, form.max_slice_percent.data,
+                                                catalog.get_volume_widths(db.session, dataset, slice_type))
             else:
                 from_session = sessions.get_session_by_id(db.session, int(form.slices_from.data))
                 slices = sampling.get_slices_from_session(from_session)
 
-            sessions.create_sort_slice_session(db.session, form.session_name.data, form.prompt.data, dataset, slices)
+            sessions.create_sort_slice_session(db.session, form.session_name.data, form.prompt.data, dataset, slices,
+                                               SortStrategy[form.sort_strategy.data])
             return redirect(url_for('dataset_overview', dataset_name=dataset.name))
     return render_template('create_sort_session.html',
                            dataset=dataset,
@@ -395,7 +727,7 @@ def viewer():
     if image is None:
         abort(400)
 
-    slice_counts, max_value = backend.get_image_info(image)
+    slice_counts, max_value = get_image_info(image)
 
     return render_template('viewer.html',
                            viewer_mode='viewer',
@@ -404,7 +736,11 @@ def viewer():
                            image_count=0,
                            image_index=0,
                            slice_counts=slice_counts,
-                           image_max=max_value)
+                           image_max=max_value,
+                           local_slicing=request.args.get('local', default=application.config['VIEWER_LOCAL_SLICING'],
+                                                          type=lambda v: v.lower() in ('1', 'true')),
+                           volume_downsample=application.config['VIEWER_VOLUME_DOWNSAMPLE'],
+                           preview_level=application.config['VIEWER_PREVIEW_LEVEL'])
 
 
 @application.route('/label')
@@ -428,9 +764,9 @@ def label():
     if image is None:
         abort(400)
 
-    slice_counts, max_value = backend.get_image_info(image)
+    slice_counts, max_value = get_image_info(image)
 
-    image_label_value = element.current_label_value()
+    image_label_value = element.current_label_value
 
     return render_template('viewer.html',
                            viewer_mode='label',
@@ -442,6 +778,9 @@ def label():
                            slice_counts=slice_counts,
                            image_max=max_value,
                            image_label_value=image_label_value,
+                           local_slicing=application.config['VIEWER_LOCAL_SLICING'],
+                           volume_downsample=application.config['VIEWER_VOLUME_DOWNSAMPLE'],
+                           preview_level=application.config['VIEWER_PREVIEW_LEVEL'],
                            previous_index=max(0, element_index - 1),
                            next_index=min(label_session.element_count - 1, element_index + 1))
 
@@ -469,9 +808,9 @@ def label_categorical_slice():
 
     im_slice = backend.ImageSlice(element.image_1_name, element.slice_1_index, backend.SliceType[element.slice_1_type])
 
-    _, max_value = backend.get_image_info(image)
+    _, max_value = get_image_info(image)
 
-    slice_label_value = element.current_label_value()
+    slice_label_value = element.current_label_value
     return render_template('label_categorical_slice.html',
                            label_session=label_session,
                            dataset=dataset,
@@ -508,10 +847,10 @@ def label_compare():
     image_1 = backend.get_image(dataset, slice_1.image_name)
     image_2 = backend.get_image(dataset, slice_2.image_name)
 
-    _, image_1_max = backend.get_image_info(image_1)
-    _, image_2_max = backend.get_image_info(image_2)
+    _, image_1_max = get_image_info(image_1)
+    _, image_2_max = get_image_info(image_2)
 
-    current_label_value = element.current_label_value()
+    current_label_value = element.current_label_value
 
     return render_template('label_compare.html',
                            label_session=label_session,
@@ -544,7 +883,10 @@ def label_sort_compare():
     if dataset is None:
         abort(404)
 
-    complete, comparison_el, _ = comparesort.add_next_comparison(db.session, label_session)
+    # Labelers are told apart by a cookie, so parallel sort sessions can give each of them a different comparison
+    labeler_id = request.cookies.get(LABELER_ID_COOKIE) or uuid.uuid4().hex
+
+    complete, comparison_el, _ = comparesort.add_next_comparison(db.session, label_session, labeler_id)
     if complete:
         return redirect(url_for('session_overview', session_id=label_session.id))
 
@@ -554,22 +896,24 @@ def label_sort_compare():
     image_1 = backend.get_image(dataset, slice_1.image_name)
     image_2 = backend.get_image(dataset, slice_2.image_name)
 
-    _, image_1_max = backend.get_image_info(image_1)
-    _, image_2_max = backend.get_image_info(image_2)
+    _, image_1_max = get_image_info(image_1)
+    _, image_2_max = get_image_info(image_2)
 
     current_label_value = None
 
-    return render_template('label_compare.html',
-                           label_session=label_session,
-                           prompt=label_session.prompt,
-                           dataset=dataset,
-                           element_id=comparison_el.id,
-                           slice_1=slice_1,
-                           slice_2=slice_2,
-                           image_1_max=image_1_max,
-                           image_2_max=image_2_max,
-                           current_label_value=current_label_value,
-                           sort_mode=True)
+    response = make_response(render_template('label_compare.html',
+                                             label_session=label_session,
+                                             prompt=label_session.prompt,
+                                             dataset=dataset,
+                                             element_id=comparison_el.id,
+                                             slice_1=slice_1,
+                                             slice_2=slice_2,
+                                             image_1_max=image_1_max,
+                                             image_2_max=image_2_max,
+                                             current_label_value=current_label_value,
+                                             sort_mode=True))
+    response.set_cookie(LABELER_ID_COOKIE, labeler_id, max_age=LABELER_ID_MAX_AGE)
+    return response
 
 
 @application.route('/api/set-label-value', methods=['POST'])
@@ -578,7 +922,16 @@ def api_set_label():
 
     element = labels.get_element_by_id(db.session, request.json['element_id'])
     labels.set_label(db.session, element, request.json['label_value'], request.json['ms'])
+    comparesort.release_comparison_lease(db.session, element)
 
     return jsonify({
         'Success': True
     })
+
+
+@application.route('/api/cache-stats')
+def api_cache_stats():
+    return jsonify({
+        'volumes': backend.volume_cache.stats()._asdict(),
+        'rendered_slices': {name: st._asdict() for name, st in slice_cache.tier_stats().items()}
+    })
@@ -1,19 +1,39 @@
 import os
+import threading
+import time
 from enum import Enum
-from typing import List, Tuple, NamedTuple, Optional
+from typing import List, Tuple, NamedTuple, Optional, Dict, Iterable, Set
 
 import nibabel
 import numpy as np
+from nibabel.filebasedimages import ImageFileError
 from PIL import Image
 
+import stats
+from cache import LRUCache
+from stats import StatsIndex, VolumeStats
+
 DATASETS_PATH = os.path.join('data', 'datasets')
+STATS_PATH = os.path.join('data', 'stats')
+PREPARED_PATH = os.path.join('data', 'prepared')
+
+PREPARED_EXTENSION = '.npy'
 
 ALLOWED_IMAGE_EXTENSIONS = [  # TODO: Add more
     'nii.gz',
     'nii'
 ]
 
-THUMB_CACHE_SIZE = 4
+VOLUME_CACHE_MAX_BYTES = 1024 ** 3  # 1 GiB
+
+# dtype volumes are stored in by the volume cache. None keeps the dtype of the image data on disk (after applying
+# the header's scaling); a float dtype such as 'float32' or an integer dtype such as 'int16' converts the volume.
+# Use 'float64' to match nibabel's get_fdata().
+VOLUME_DTYPE: Optional[str] = None
+
+# Number of downsampled copies kept per volume for previews. Level n halves each dimension n times, so level 1 is
+# 1/2 and level 2 is 1/4 resolution. Levels are built lazily from the level above and kept in the volume cache.
+PYRAMID_MAX_LEVEL = 2
 
 
 class SliceType(Enum):
@@ -33,6 +53,12 @@ class DataImage(NamedTuple):
     path: str
 
 
+class VolumeHeader(NamedTuple):
+    shape: Tuple[int, ...]  # Shape of the image data on disk
+    orientations: Tuple[int, ...]  # Canonical axis (SliceType value) of each of the first three axes on disk
+    axis_codes: str  # Anatomical direction of each axis on disk, e.g. RAS
+
+
 class ImageSlice(NamedTuple):
     image_name: str
     slice_index: int
@@ -57,14 +83,61 @@ def is_image_path(path: str) -> bool:
     return os.path.isdir(path) or os.path.basename(path).split(os.extsep, 1)[1] in ALLOWED_IMAGE_EXTENSIONS
 
 
-def get_images(dataset: Dataset) -> List[DataImage]:
-    paths = [os.path.join(dataset.path, n) for n in os.listdir(dataset.path)]
-    paths = [p for p in paths if is_image_path(p)]
+class DatasetIndex(NamedTuple):
+    mtime_ns: int  # mtime of the dataset directory when it was scanned
+    scan_time_ns: int
+    images: List[DataImage]  # Sorted by name
+    image_indices: Dict[str, int]
+    other_names: Set[str]  # Files in the directory which aren't images
+
+
+# Directories modified this recently before a scan are scanned again, as files added within the filesystem's mtime
+# resolution (which can be coarse on network storage) wouldn't change the directory's mtime
+DATASET_INDEX_MTIME_RESOLUTION_NS = 2 * 10 ** 9
+
+dataset_indexes: Dict[str, DatasetIndex] = {}
+dataset_indexes_lock = threading.Lock()
+
+
+def get_dataset_index(dataset: Dataset) -> DatasetIndex:
+    """
+    Gets the index of a dataset's images, which is cached until the dataset directory's mtime changes. When it does,
+    only names which weren't in the directory before are checked.
+    """
+    mtime_ns = os.stat(dataset.path).st_mtime_ns
+    with dataset_indexes_lock:
+        index = dataset_indexes.get(dataset.path)
+    if index is not None and index.mtime_ns == mtime_ns \
+            and index.scan_time_ns - mtime_ns >= DATASET_INDEX_MTIME_RESOLUTION_NS:
+        return index
+
+    scan_time_ns = time.time_ns()
+    image_names = set()
+    other_names = set()
+    for name in os.listdir(dataset.path):
+        if index is not None and (name in index.image_indices or name in index.other_names):
+            known_image = name in index.image_indices
+        else:
+            known_image = is_image_path(os.path.join(dataset.path, name))
+        (image_names if known_image else other_names).add(name)
+
+    images = [DataImage(dataset, n, os.path.join(dataset.path, n)) for n in sorted(image_names)]
+    index = DatasetIndex(mtime_ns, scan_time_ns, images, {im.name: i for i, im in enumerate(images)}, other_names)
 
-    return [DataImage(dataset, os.path.basename(p), p) for p in sorted(paths)]
+    with dataset_indexes_lock:
+        dataset_indexes[dataset.path] = index
+    return index
+
+
+def get_images(dataset: Dataset) -> List[DataImage]:
+    return list(get_dataset_index(dataset).images)
 
 
 def get_image(dataset: Dataset, image_name: str) -> DataImage:
+    index = get_dataset_index(dataset)
+    if image_name in index.image_indices:
+        return index.images[index.image_indices[image_name]]
+
     image_path = os.path.join(dataset.path, image_name)
     assert os.path.exists(image_path), 'Image {} does not exist'.format(image_path)
     return DataImage(dataset, image_name, image_path)
@@ -78,45 +151,242 @@ def get_image_by_index(dataset: Dataset, image_index: int) -> Tuple[Optional[Dat
     :param image_index: The index of the image.
     :return: A tuple containing the image (or None if the index is out of bounds) and the length of the dataset.
     """
-    images = get_images(dataset)
+    images = get_dataset_index(dataset).images
     if 0 <= image_index < len(images):
         return images[image_index], len(images)
     else:
         return None, len(images)
 
 
+def get_image_version(d_img: DataImage) -> str:
+    """
+    Gets a string which changes whenever an image file is modified (used to validate cached data for the image).
+    """
+    st = os.stat(d_img.path)
+    return '{}-{}'.format(st.st_mtime_ns, st.st_size)
+
+
+# Headers by image path, along with the mtime (in ns) and size of the file they were read from
+volume_headers: Dict[str, Tuple[int, int, VolumeHeader]] = {}
+volume_headers_lock = threading.Lock()
+
+
+def get_volume_header(image_path: str) -> VolumeHeader:
+    """
+    Gets the shape and orientation of an image without loading its data. Headers are cached until the file changes.
+    """
+    st = os.stat(image_path)
+    with volume_headers_lock:
+        cached = volume_headers.get(image_path)
+    if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+
+    vol = nibabel.load(image_path)
+    header = VolumeHeader(tuple(int(dim) for dim in vol.header.get_data_shape()),
+                          tuple(int(v[0]) for v in nibabel.io_orientation(vol.affine)),
+                          ''.join(code or '?' for code in nibabel.aff2axcodes(vol.affine)))
+
+    with volume_headers_lock:
+        volume_headers[image_path] = (st.st_mtime_ns, st.st_size, header)
+    return header
+
+
+def get_canonical_shape(image_path: str) -> Tuple[int, int, int]:
+    """
+    Gets the shape of an image's volume as loaded for slicing (Sagittal, Coronal, Axial), without loading its data.
+    """
+    header = get_volume_header(image_path)
+    return tuple(header.shape[header.orientations.index(axis)] for axis in range(3))
+
+
 def slice_name(image_slice: ImageSlice) -> str:
     return '{}_{}_{}'.format(image_slice.image_name, image_slice.slice_type.name, image_slice.slice_index)
 
 
-thumb_cache = {}
+volume_cache = LRUCache(VOLUME_CACHE_MAX_BYTES)
+volume_dtype = VOLUME_DTYPE
 
+# Version (see get_image_version) of each image's file when its volumes were last cached
+volume_versions: Dict[Tuple[str, str], str] = {}
+volume_versions_lock = threading.Lock()
 
-def __load_cached_image(image: DataImage):
-    cache_key = image.dataset.name + image.name
-    if cache_key not in thumb_cache:
-        thumb_cache[cache_key] = nibabel.as_closest_canonical(nibabel.load(image.path))
 
-        while len(thumb_cache) > THUMB_CACHE_SIZE:
-            thumb_cache.pop(list(thumb_cache.keys())[0])
+def _read_volume(d_img: DataImage) -> np.ndarray:
+    vol = nibabel.as_closest_canonical(nibabel.load(d_img.path))
+    if volume_dtype is None:
+        return np.asanyarray(vol.dataobj)
 
-    return thumb_cache[cache_key]
+    dtype = np.dtype(volume_dtype)
+    if np.issubdtype(dtype, np.floating):
+        return vol.get_fdata(dtype=dtype)
+    return np.asanyarray(vol.dataobj).astype(dtype, copy=False)
 
 
-def get_slice(d_img: DataImage, slice_index: int, slice_type: SliceType,
-              intensity_min: int, intensity_max: Optional[int], intensity_max_pct: float = None) -> Image.Image:
-    data = __load_cached_image(d_img).get_fdata()
+def get_prepared_path(d_img: DataImage, slice_type: Optional[SliceType] = None) -> str:
+    """
+    Gets the path of an image's prepared (uncompressed, canonical orientation) array file.
+
+    :param d_img: The image.
+    :param slice_type: If given, the path of the copy of the volume with this slice type's axis moved first, so that
+                       each slice is stored contiguously.
+    :return: The path of the .npy file.
+    """
+    name = d_img.name if slice_type is None else '{}.{}'.format(d_img.name, slice_type.name)
+    return os.path.join(PREPARED_PATH, d_img.dataset.name, name + PREPARED_EXTENSION)
+
+
+def is_prepared(d_img: DataImage, slice_type: Optional[SliceType] = None) -> bool:
+    prepared_path = get_prepared_path(d_img, slice_type)
+    return os.path.exists(prepared_path) and os.path.getmtime(prepared_path) >= os.path.getmtime(d_img.path)
+
+
+def prepare_image(d_img: DataImage, per_axis: bool = False):
+    """
+    Writes an image to the prepared dataset format, which is read with np.memmap instead of decompressing the volume.
+
+    :param d_img: The image to prepare.
+    :param per_axis: Also write one copy per slice type with that axis first (triples the disk space used, but reading
+                     a slice of any orientation becomes a single contiguous read).
+    """
+    data = _read_volume(d_img)
+
+    arrays = [(get_prepared_path(d_img), data)]
+    if per_axis:
+        arrays += [(get_prepared_path(d_img, st), np.ascontiguousarray(np.moveaxis(data, st.value, 0)))
+                   for st in SliceType]
+
+    for path, arr in arrays:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Save to a temporary file first so a partially written file is never memory-mapped
+        temp_path = path + '.tmp' + PREPARED_EXTENSION
+        np.save(temp_path, arr)
+        os.replace(temp_path, path)
+
+
+def _discard_changed_volume(d_img: DataImage):
+    """
+    Removes an image's volume and its pyramid levels from the volume cache if the image file changed since they were
+    cached.
+    """
+    key = (d_img.dataset.name, d_img.name)
+    version = get_image_version(d_img)
+    with volume_versions_lock:
+        if volume_versions.get(key) == version:
+            return
+        volume_versions[key] = version
+
+    volume_cache.discard(key)
+    for level in range(1, PYRAMID_MAX_LEVEL + 1):
+        volume_cache.discard(key + (level,))
+
+
+def _load_volume(d_img: DataImage) -> np.ndarray:
+    if is_prepared(d_img):
+        # Memory-mapped volumes are paged in by the OS, so they bypass the volume cache
+        return np.load(get_prepared_path(d_img), mmap_mode='r')
+
+    _discard_changed_volume(d_img)
+    return volume_cache.get((d_img.dataset.name, d_img.name), lambda: _read_volume(d_img))
+
+
+def get_volume(d_img: DataImage) -> np.ndarray:
+    """
+    Gets an image's full resolution volume (Sagittal, Coronal, Axial). Batch work can pass it to get_slice for each of
+    the image's slices, so it is only read once even if the volume cache evicts it (or it is too large to be cached).
+    """
+    return _load_volume(d_img)
+
+
+def group_slices_by_image(dataset: Dataset, slices: Iterable[ImageSlice]) -> List[Tuple[DataImage, List[ImageSlice]]]:
+    """
+    Groups slices by image (in order of first appearance) for batch work, so each volume only has to be read once.
+
+    :param dataset: Dataset the slices are from.
+    :param slices: Slices to group.
+    :return: A list of tuples containing each image and its slices (in their original order).
+    """
+    slices_by_image: Dict[str, List[ImageSlice]] = {}
+    for sl in slices:
+        slices_by_image.setdefault(sl.image_name, []).append(sl)
+
+    return [(get_image(dataset, image_name), image_slices) for image_name, image_slices in slices_by_image.items()]
+
+
+def _downsample_volume(data: np.ndarray) -> np.ndarray:
+    """
+    Halves each dimension of a volume by averaging blocks of 2x2x2 voxels (an odd last voxel is dropped). The
+    result keeps the volume's dtype.
+    """
+    data = data[(slice(None),) * 3 + (0,) * (data.ndim - 3)]
+    x, y, z = [dim // 2 for dim in data.shape]
+
+    downsampled = np.empty((x, y, z), dtype=data.dtype)
+    # Average two sagittal slices at a time to avoid a float copy of the whole volume
+    for i in range(x):
+        block = data[2 * i:2 * i + 2, :2 * y, :2 * z].astype(np.float32)
+        downsampled[i] = block.reshape(2, y, 2, z, 2).mean(axis=(0, 2, 4))
+    return downsampled
+
+
+def _load_volume_level(d_img: DataImage, level: int, volume: Optional[np.ndarray] = None) -> np.ndarray:
+    if level == 0:
+        return _load_volume(d_img) if volume is None else volume
+
+    _discard_changed_volume(d_img)
+    return volume_cache.get((d_img.dataset.name, d_img.name, level),
+                            lambda: _downsample_volume(_load_volume_level(d_img, level - 1, volume)))
+
+
+def get_pyramid_level(d_img: DataImage, slice_type: SliceType, size: int) -> int:
+    """
+    Gets the lowest resolution pyramid level whose slices are still at least the given size.
+
+    :param size: Minimum size of the larger side of the slice, in pixels.
+    :return: A level between 0 (full resolution) and PYRAMID_MAX_LEVEL.
+    """
+    level = 0
+    max_side = max(get_slice_size(d_img, slice_type))
+    while level < PYRAMID_MAX_LEVEL and max_side >> (level + 1) >= size:
+        level += 1
+    return level
+
+
+def _load_slice_data(d_img: DataImage, slice_index: int, slice_type: SliceType, level: int = 0,
+                     volume: Optional[np.ndarray] = None) -> np.ndarray:
+    if level == 0 and is_prepared(d_img, slice_type):
+        return np.load(get_prepared_path(d_img, slice_type), mmap_mode='r')[slice_index]
+
+    data = _load_volume_level(d_img, level, volume)
+    if level > 0:
+        # Levels with an odd size drop the last slice of the level below, so its index is clamped to the last slice
+        slice_index = min(slice_index >> level, data.shape[slice_type.value] - 1)
 
     if slice_type == SliceType.SAGITTAL:
-        slice_data = data[slice_index, :, :]
+        return data[slice_index, :, :]
     elif slice_type == SliceType.CORONAL:
-        slice_data = data[:, slice_index, :]
+        return data[:, slice_index, :]
     else:  # AXIAL
-        slice_data = data[:, :, slice_index]
+        return data[:, :, slice_index]
+
+
+def get_slice(d_img: DataImage, slice_index: int, slice_type: SliceType,
+              intensity_min: int, intensity_max: Optional[int], intensity_max_pct: float = None,
+              level: int = 0, volume: Optional[np.ndarray] = None) -> Image.Image:
+    """
+    Renders a slice of an image.
+
+    :param level: Pyramid level of the slice (see PYRAMID_MAX_LEVEL).
+    :param volume: The image's volume, if the caller already loaded it with get_volume.
+    """
+    slice_data = _load_slice_data(d_img, slice_index, slice_type, level, volume)
 
     if len(slice_data.shape) > 2:
         slice_data = slice_data.squeeze(axis=2)
 
+    # Volumes are cached in a compact dtype, so only the 2D slice is converted for rendering
+    slice_data = slice_data.astype(np.float64)
+
     if intensity_max is None:
         if intensity_max_pct is None:
             intensity_max = int(np.max(slice_data))
@@ -130,6 +400,77 @@ def get_slice(d_img: DataImage, slice_index: int, slice_type: SliceType,
     return Image.fromarray(slice_data)
 
 
+stats_indexes: Dict[str, StatsIndex] = {}
+stats_indexes_lock = threading.Lock()
+
+
+def get_stats_index(dataset: Dataset) -> StatsIndex:
+    index_path = os.path.join(STATS_PATH, dataset.name + '.json')
+    with stats_indexes_lock:
+        if index_path not in stats_indexes:
+            stats_indexes[index_path] = StatsIndex(index_path)
+        return stats_indexes[index_path]
+
+
+def get_image_stats(d_img: DataImage) -> VolumeStats:
+    """
+    Gets precomputed statistics for an image, computing and storing them in the dataset's stats index if they are
+    missing or the image file has changed.
+    """
+    index = get_stats_index(d_img.dataset)
+    volume_stats = index.get(d_img.path)
+    if volume_stats is None:
+        volume_stats = stats.compute_stats(_load_volume(d_img))
+        index.put(d_img.path, volume_stats)
+    return volume_stats
+
+
+def build_stats_index(dataset: Dataset, save_every: int = 50):
+    """
+    Computes statistics for every image in a dataset which is missing from (or stale in) its stats index.
+
+    Volumes are read directly rather than through the volume cache to avoid evicting volumes in use by labelers.
+    Images which can't be read are skipped.
+    """
+    index = get_stats_index(dataset)
+
+    computed = 0
+    for d_img in get_images(dataset):
+        if index.get(d_img.path) is not None:
+            continue
+        try:
+            volume = _read_volume(d_img)
+        except (OSError, EOFError, ValueError, ImageFileError) as e:
+            print('Skipped unreadable image {} in dataset {}: {}'.format(d_img.name, dataset.name, e))
+            continue
+        index.put(d_img.path, stats.compute_stats(volume), save=False)
+
+        computed += 1
+        if computed % save_every == 0:
+            index.save()
+
+    if computed > 0:
+        index.save()
+    print('Computed stats for {} images in dataset {}'.format(computed, dataset.name))
+
+
+def build_stats_indexes():
+    for dataset in get_datasets():
+        build_stats_index(dataset)
+
+
+def get_slice_size(d_img: DataImage, slice_type: SliceType, level: int = 0) -> Tuple[int, int]:
+    """
+    Gets the size of an image's slices as rendered by get_slice.
+
+    :param level: Pyramid level of the slices (see PYRAMID_MAX_LEVEL).
+    :return: A tuple containing the width and height of the slice.
+    """
+    shape = get_canonical_shape(d_img.path)
+    width, height = [dim >> level for i, dim in enumerate(shape) if i != slice_type.value]
+    return width, height
+
+
 def get_image_info(d_img: DataImage) -> Tuple[Tuple[int, int, int], int]:
     """
     Gets info for an image.
@@ -137,6 +478,28 @@ def get_image_info(d_img: DataImage) -> Tuple[Tuple[int, int, int], int]:
     :param d_img: Image to get info from.
     :return: A tuple containing image dimensions (Saggital, Coronal, Axial) and the maximum value of the image.
     """
-    data = __load_cached_image(d_img).get_fdata()
-    shape = data.shape
-    return (shape[0], shape[1], shape[2]), int(np.max(data))
+    volume_stats = get_image_stats(d_img)
+    return volume_stats.shape, int(volume_stats.max_value)
+
+
+def get_volume_uint8(d_img: DataImage, downsample: int = 1) -> Tuple[np.ndarray, int]:
+    """
+    Gets an image's volume scaled to uint8 (0 maps to 0 and the image's maximum value to 255), e.g. for slicing
+    on the client.
+
+    :param d_img: The image.
+    :param downsample: Keep every nth voxel along each axis.
+    :return: A tuple containing the uint8 volume (Sagittal, Coronal, Axial) and the maximum value of the image.
+    """
+    data = _load_volume(d_img)
+    data = data[(slice(None, None, downsample),) * 3 + (0,) * (data.ndim - 3)]
+
+    max_value = int(get_image_stats(d_img).max_value)
+
+    volume = np.zeros(data.shape, dtype=np.uint8)
+    if max_value > 0:
+        # Convert one sagittal slice at a time to avoid a float copy of the whole volume
+        for i in range(data.shape[0]):
+            volume[i] = (np.clip(data[i].astype(np.float32), 0, max_value) / max_value * 255).astype(np.uint8)
+
+    return volume, max_value
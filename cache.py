@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    entry_count: int
+    current_bytes: int
+    max_bytes: int
+
+
+def array_size(value: Any) -> int:
+    return int(getattr(value, 'nbytes', 0))
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache bounded by the total size (in bytes) of its entries.
+
+    Values are loaded through a loader function passed to get(). Concurrent requests for the same missing key
+    wait on a per-key lock so the value is only loaded once.
+    """
+
+    def __init__(self, max_bytes: int, size_fn: Callable[[Any], int] = array_size):
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+
+        self._entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._current_bytes = 0
+
+        self._lock = threading.Lock()
+        self._load_locks: Dict[Hashable, threading.Lock] = {}
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable, load_fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self._hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Another thread may have loaded the value while we were waiting
+            with self._lock:
+                if key in self._entries:
+                    self._hits += 1
+                    self._entries.move_to_end(key)
+                    return self._entries[key]
+                self._misses += 1
+
+            try:
+                value = load_fn()
+                self.put(key, value)
+            finally:
+                with self._lock:
+                    self._load_locks.pop(key, None)
+
+        return value
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._entries:
+                self._hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self._misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any):
+        size = self.size_fn(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return  # Never cache values which would evict everything else
+
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._current_bytes += size
+
+            while self._current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._current_bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions,
+                              len(self._entries), self._current_bytes, self.max_bytes)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _remove(self, key: Hashable):
+        self._entries.pop(key)
+        self._current_bytes -= self._sizes.pop(key)
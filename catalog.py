@@ -0,0 +1,200 @@
+import os
+import threading
+from typing import List, NamedTuple, Optional, Dict, Tuple
+
+from nibabel.filebasedimages import ImageFileError
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import backend
+from backend import Dataset, DataImage, DatasetIndex, SliceType
+from model import CatalogImage
+from stats import StatsIndex
+
+SHAPE_COLUMNS = {
+    SliceType.SAGITTAL: CatalogImage.shape_sagittal,
+    SliceType.CORONAL: CatalogImage.shape_coronal,
+    SliceType.AXIAL: CatalogImage.shape_axial
+}
+
+
+class CatalogScanResult(NamedTuple):
+    added: int
+    updated: int
+    removed: int
+    unchanged: int
+
+
+# Dataset index each dataset's catalog was last synced with (by dataset path). Dataset indexes are only rebuilt when
+# their directory changes, so a different index means images may have been added or removed.
+synced_indexes: Dict[str, DatasetIndex] = {}
+# mtime (in ns) and size of each cataloged image file when the catalog was last synced (by dataset path, then image
+# name). Files modified in place don't change their directory's mtime, so they are checked when an image is opened.
+synced_file_versions: Dict[str, Dict[str, Tuple[int, int]]] = {}
+scan_lock = threading.RLock()
+
+
+def scan_dataset(session: Session, dataset: Dataset, compute_stats: bool = False) -> CatalogScanResult:
+    """
+    Syncs the catalog of a dataset with its files, adding new images, refreshing images which changed (one stat per
+    image) and removing images which no longer exist.
+
+    :param session: The database session.
+    :param dataset: The dataset.
+    :param compute_stats: Compute stats of images which don't have any yet, to catalog their max value. Otherwise the
+                          max value is only taken from the stats index.
+    :return: The number of images added, updated, removed and unchanged.
+    """
+    with scan_lock:
+        index = backend.get_dataset_index(dataset)
+        stats_index = backend.get_stats_index(dataset)
+
+        rows = {row.name: row for row in session.query(CatalogImage).filter(CatalogImage.dataset == dataset.name)}
+
+        added, updated, unchanged = 0, 0, 0
+        file_versions = {}
+        for d_img in index.images:
+            row = rows.pop(d_img.name, None)
+
+            st = os.stat(d_img.path)
+            if row is None:
+                row = CatalogImage(dataset=dataset.name, name=d_img.name)
+                session.add(row)
+                added += 1
+                _update_row(row, d_img, st, stats_index, compute_stats)
+            elif row.mtime_ns != st.st_mtime_ns or row.file_size != st.st_size:
+                updated += 1
+                _update_row(row, d_img, st, stats_index, compute_stats)
+            else:
+                if row.max_value is None:
+                    row.max_value = _get_max_value(d_img, stats_index, compute_stats)
+                unchanged += 1
+
+            file_versions[d_img.name] = (row.mtime_ns, row.file_size)
+
+        for row in rows.values():
+            session.delete(row)
+
+        session.commit()
+        synced_indexes[dataset.path] = index
+        synced_file_versions[dataset.path] = file_versions
+
+    return CatalogScanResult(added, updated, len(rows), unchanged)
+
+
+def scan_datasets(session: Session, compute_stats: bool = False):
+    for dataset in backend.get_datasets():
+        result = scan_dataset(session, dataset, compute_stats=compute_stats)
+        print('Cataloged dataset {} ({} added, {} updated, {} removed, {} unchanged)'.format(dataset.name, *result))
+
+
+def _update_row(row: CatalogImage, d_img: DataImage, st: os.stat_result, stats_index: StatsIndex,
+                compute_stats: bool):
+    row.path = d_img.path
+    row.file_size = st.st_size
+    row.mtime_ns = st.st_mtime_ns
+
+    try:
+        header = backend.get_volume_header(d_img.path)
+    except (OSError, ImageFileError):
+        row.shape_sagittal, row.shape_coronal, row.shape_axial = None, None, None
+        row.axis_codes = None
+        row.max_value = None
+        return
+
+    row.shape_sagittal, row.shape_coronal, row.shape_axial = backend.get_canonical_shape(d_img.path)
+    row.axis_codes = header.axis_codes
+    row.max_value = _get_max_value(d_img, stats_index, compute_stats)
+
+
+def _get_max_value(d_img: DataImage, stats_index: StatsIndex, compute_stats: bool) -> Optional[float]:
+    volume_stats = backend.get_image_stats(d_img) if compute_stats else stats_index.get(d_img.path)
+    return None if volume_stats is None else float(volume_stats.max_value)
+
+
+def is_synced(dataset: Dataset) -> bool:
+    """
+    Checks whether images have been added or removed since a dataset's catalog was last synced. Images modified in
+    place are refreshed by sync_image instead, so this doesn't stat every image.
+    """
+    return synced_indexes.get(dataset.path) is backend.get_dataset_index(dataset)
+
+
+def sync_dataset(session: Session, dataset: Dataset, blocking: bool = True) -> bool:
+    """
+    Syncs the catalog of a dataset if images may have been added or removed since it was last synced. Only rows of
+    images which changed are refreshed.
+
+    :param blocking: Wait for a scan which is already running. Otherwise return False instead of waiting.
+    :return: Whether the catalog is in sync.
+    """
+    if is_synced(dataset):
+        return True
+
+    if not scan_lock.acquire(blocking=blocking):
+        return False
+    try:
+        if not is_synced(dataset):
+            scan_dataset(session, dataset)
+    finally:
+        scan_lock.release()
+    return True
+
+
+def sync_image(session: Session, d_img: DataImage):
+    """
+    Refreshes the catalog row of an image if its file was modified in place since the catalog was last synced (one
+    stat). Called when an image is opened, as modifying a file doesn't change its directory's mtime.
+    """
+    file_versions = synced_file_versions.get(d_img.dataset.path)
+    if file_versions is None or d_img.name not in file_versions:
+        return
+
+    st = os.stat(d_img.path)
+    if file_versions[d_img.name] == (st.st_mtime_ns, st.st_size):
+        return
+
+    with scan_lock:
+        row = session.query(CatalogImage) \
+            .filter(CatalogImage.dataset == d_img.dataset.name, CatalogImage.name == d_img.name).one_or_none()
+        if row is None:
+            return
+        _update_row(row, d_img, st, backend.get_stats_index(d_img.dataset), compute_stats=False)
+        session.commit()
+        file_versions[d_img.name] = (row.mtime_ns, row.file_size)
+
+
+def get_catalog_images(session: Session, dataset: Dataset, axis_codes: str = None,
+                       min_shape: List[int] = None) -> List[CatalogImage]:
+    """
+    Gets the cataloged images of a dataset (sorted by name), optionally only those with the given orientation or at
+    least the given shape (Sagittal, Coronal, Axial).
+    """
+    sync_dataset(session, dataset)
+
+    query = session.query(CatalogImage).filter(CatalogImage.dataset == dataset.name)
+    if axis_codes is not None:
+        query = query.filter(CatalogImage.axis_codes == axis_codes)
+    if min_shape is not None:
+        for slice_type, min_size in zip(SliceType, min_shape):
+            query = query.filter(SHAPE_COLUMNS[slice_type] >= min_size)
+    return query.order_by(CatalogImage.name).all()
+
+
+def get_image_count(session: Session, dataset: Dataset) -> int:
+    if not sync_dataset(session, dataset, blocking=False):
+        return len(backend.get_images(dataset))
+    return session.query(func.count(CatalogImage.id)).filter(CatalogImage.dataset == dataset.name).scalar()
+
+
+def get_volume_widths(session: Session, dataset: Dataset, slice_type: SliceType) -> Optional[Dict[str, int]]:
+    """
+    Gets the number of slices of each image in a dataset along an axis, or None if the catalog is busy being synced.
+    """
+    if not sync_dataset(session, dataset, blocking=False):
+        return None
+
+    shape_column = SHAPE_COLUMNS[slice_type]
+    rows = session.query(CatalogImage.name, shape_column) \
+        .filter(CatalogImage.dataset == dataset.name, shape_column.isnot(None)).all()
+    return {name: width for name, width in rows}
@@ -1,58 +1,1075 @@
-import functools
-from typing import Tuple, Optional, List
+import json
+from datetime import datetime, timedelta
+from typing import Tuple, Optional, List, Dict, Callable, TypeVar, Type, Generator
 
+from sqlalchemy import and_, exists, func, literal, or_, select
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import Insert
 
 import sampling
-from backend import ImageSlice
+from backend import ImageSlice, SliceType
 from model import LabelSession, SessionElement
+from sessions import SortStrategy
 
+SORT_LEASE_SECONDS = 5 * 60  # How long a pending comparison stays assigned to a labeler of a parallel sort session
 
-class ComparisonNotFound(Exception):
-    pass
+ComparisonAddResult = Tuple[bool, Optional[SessionElement], Optional[List[ImageSlice]]]
+Comparison = Tuple[ImageSlice, ImageSlice]
 
+T = TypeVar('T')
+CompareFunction = Callable[[T, T], int]
+SortFunction = Callable[[List[T], CompareFunction], List[T]]
 
-ComparisonAddResult = Tuple[bool, Optional[SessionElement], Optional[List[ImageSlice]]]
+ItemComparison = Tuple[int, int]  # Positions of two items compared by a Sorter
+
+MIN_GALLOP = 7  # Initial number of wins in a row after which Timsort merges start galloping (as in CPython)
+
+
+class Sorter:
+    """
+    A sort of the items 0..n-1 (the positions of the items to sort) which waits for the result of each comparison it
+    makes, so it can be advanced as comparisons are labeled. Its state is plain JSON data, so the progress of a sort
+    session can be saved and continued later (possibly by another app process) instead of sorting from scratch.
+    """
+
+    def __init__(self, state: Dict, results: List[int] = ()):
+        """
+        :param state: State saved by to_json.
+        :param results: Results saved by to_json.
+        """
+        self.state = state
+
+    @classmethod
+    def start(cls, item_count: int) -> 'Sorter':
+        raise NotImplementedError
+
+    @property
+    def pending(self) -> List[ItemComparison]:
+        """
+        The comparisons the sort is waiting for (empty once the items are sorted).
+        """
+        raise NotImplementedError
+
+    @property
+    def result(self) -> Optional[List[int]]:
+        return self.state['result']
+
+    def add_result(self, comparison: ItemComparison, result: int):
+        raise NotImplementedError
+
+    def to_json(self) -> Dict:
+        return {'state': self.state, 'results': []}
+
+
+def sort_items(sorter_class: Type[Sorter], items: List[T], compare: CompareFunction) -> List[T]:
+    sorter = sorter_class.start(len(items))
+    while sorter.result is None:
+        i, j = sorter.pending[0]
+        sorter.add_result((i, j), compare(items[i], items[j]))
+    return [items[i] for i in sorter.result]
+
+
+class SequentialSorter(Sorter):
+    """
+    A sort which makes one comparison at a time, written as a generator (steps) which yields each comparison and is
+    sent its result. The generator only changes the state between the last comparison of a step and the end of the
+    step, where it yields None. The state is then enough to continue the sort from, while the results of comparisons
+    made since are saved alongside it and sent to the generator again when the sort is loaded. Steps make at most
+    O(log n) comparisons (e.g. a binary search), so loading a sort is O(log n).
+    """
+
+    def __init__(self, state: Dict, results: List[int] = ()):
+        super().__init__(state)
+
+        self.results: List[int] = []
+        self._pending: List[ItemComparison] = []
+        self._steps = self.steps()
+        self._send(None)
+        for result in results:
+            self.add_result(self._pending[0], result)
+
+    @property
+    def pending(self) -> List[ItemComparison]:
+        return self._pending
+
+    def add_result(self, comparison: ItemComparison, result: int):
+        assert [comparison] == self._pending
+        self.results.append(result)
+        self._send(result)
+
+    def to_json(self) -> Dict:
+        return {'state': self.state, 'results': self.results}
+
+    def steps(self) -> Generator[Optional[ItemComparison], Optional[int], None]:
+        raise NotImplementedError
+
+    def _send(self, result: Optional[int]):
+        try:
+            comparison = self._steps.send(result)
+            while comparison is None:
+                self.results = []
+                comparison = next(self._steps)
+            self._pending = [comparison]
+        except StopIteration:
+            self.results = []
+            self._pending = []
+
+
+def _binary_search(item: int, items: List[int], start: int, end: int) -> Generator[ItemComparison, int, int]:
+    """
+    Finds where to insert an item into sorted items (after any equal items), searching only between start and end.
+    """
+    while start < end:
+        middle = (start + end) // 2
+        if (yield item, items[middle]) < 0:
+            end = middle
+        else:
+            start = middle + 1
+    return start
+
+
+class BinaryInsertionSorter(SequentialSorter):
+    """
+    Sorts items by inserting them one at a time into a sorted list with a binary search. Makes at most
+    sum(ceil(log2(i + 1)) for i in range(n)) comparisons.
+    """
+
+    @classmethod
+    def start(cls, item_count: int) -> 'BinaryInsertionSorter':
+        return cls({'item_count': item_count, 'chain': [], 'result': None})
+
+    def steps(self):
+        chain = self.state['chain']
+        while len(chain) < self.state['item_count']:
+            item = len(chain)
+            position = yield from _binary_search(item, chain, 0, len(chain))
+            chain.insert(position, item)
+            yield None
+        self.state['result'] = chain
+
+
+def _merge_insertion_level(items: List[int]) -> Dict:
+    return {'items': items, 'partners': [], 'chain': None, 'pending': None}
+
+
+class MergeInsertionSorter(SequentialSorter):
+    """
+    Sorts items with the Ford-Johnson merge-insertion algorithm, which makes close to the minimum possible number of
+    comparisons (and exactly the minimum for up to 11 items).
+
+    The algorithm pairs up items, sorts the larger item of each pair recursively, then inserts the smaller items into
+    the sorted chain. Each level of the recursion is kept in the state, deepest last.
+    """
+
+    @classmethod
+    def start(cls, item_count: int) -> 'MergeInsertionSorter':
+        return cls({'levels': [_merge_insertion_level(list(range(item_count)))], 'result': None})
+
+    def steps(self):
+        levels = self.state['levels']
+        while len(levels) > 0:
+            level = levels[-1]
+            items, partners = level['items'], level['partners']
+
+            if len(items) <= 1:
+                self._level_sorted(list(items))
+            elif level['chain'] is None and len(partners) < len(items) // 2:
+                # Compare items in pairs, keeping each pair as (larger, smaller)
+                a, b = items[2 * len(partners)], items[2 * len(partners) + 1]
+                if (yield a, b) > 0:
+                    a, b = b, a
+                partners.append([b, a])
+            elif level['chain'] is None:
+                levels.append(_merge_insertion_level([b for b, _ in partners]))
+            elif len(level['pending']) > 0:
+                item, bound = level['pending'][0]
+                chain = level['chain']
+                end = len(chain) if bound is None else chain.index(bound)
+                position = yield from _binary_search(item, chain, 0, end)
+                chain.insert(position, item)
+                del level['pending'][0]
+            else:
+                self._level_sorted(level['chain'])
+            yield None
+
+    def _level_sorted(self, sorted_items: List[int]):
+        levels = self.state['levels']
+        levels.pop()
+        if len(levels) == 0:
+            self.state['result'] = sorted_items
+            return
+
+        # The larger items of the pairs are sorted, and the partner of the smallest one is smaller than all of them
+        level = levels[-1]
+        smaller = {b: a for b, a in level['partners']}
+        level['chain'] = [smaller[sorted_items[0]]] + sorted_items
+        # Items to insert, with the item they are known to be below
+        pending = [[smaller[b], b] for b in sorted_items[1:]]
+        if len(level['items']) % 2 == 1:
+            pending.append([level['items'][-1], None])
+
+        # Insert pending items in groups whose sizes follow the Jacobsthal numbers (2, 2, 6, 10, 22, ...), last item of
+        # each group first, so each binary search is over at most 2^k - 1 items
+        level['pending'] = []
+        start, power, group_size = 0, 2, 2
+        while start < len(pending):
+            level['pending'] += reversed(pending[start:start + group_size])
+            start += group_size
+            power *= 2
+            group_size = power - group_size
+
+
+def _get_min_run(item_count: int) -> int:
+    r = 0
+    while item_count >= 64:
+        r |= item_count & 1
+        item_count >>= 1
+    return item_count + r
+
+
+def _get_run_power(start_1: int, length_1: int, length_2: int, item_count: int) -> int:
+    """
+    Gets the power of the boundary between two adjacent runs, which decides when Timsort merges runs (as in powersort).
+    """
+    power = 0
+    a = 2 * start_1 + length_1
+    b = a + length_1 + length_2
+    while True:
+        power += 1
+        if a >= item_count:
+            a -= item_count
+            b -= item_count
+        elif b >= item_count:
+            return power
+        a <<= 1
+        b <<= 1
+
+
+def _gallop_left(key: int, items: List[int], start: int, n: int,
+                 hint: int) -> Generator[ItemComparison, int, int]:
+    """
+    Finds where to insert a key into the sorted items[start:start + n] (before any equal items), starting from
+    start + hint and galloping outwards before a binary search. Returns the position relative to start.
+    """
+    last_offset, offset = 0, 1
+    if (yield items[start + hint], key) < 0:
+        max_offset = n - hint
+        while offset < max_offset:
+            if (yield items[start + hint + offset], key) < 0:
+                last_offset = offset
+                offset = (offset << 1) + 1
+            else:
+                break
+        offset = min(offset, max_offset)
+        last_offset, offset = last_offset + hint, offset + hint
+    else:
+        max_offset = hint + 1
+        while offset < max_offset:
+            if (yield items[start + hint - offset], key) < 0:
+                break
+            last_offset = offset
+            offset = (offset << 1) + 1
+        offset = min(offset, max_offset)
+        last_offset, offset = hint - offset, hint - last_offset
+
+    last_offset += 1
+    while last_offset < offset:
+        middle = last_offset + ((offset - last_offset) >> 1)
+        if (yield items[start + middle], key) < 0:
+            last_offset = middle + 1
+        else:
+            offset = middle
+    return offset
+
+
+def _gallop_right(key: int, items: List[int], start: int, n: int,
+                  hint: int) -> Generator[ItemComparison, int, int]:
+    """
+    Like _gallop_left, but finds the position after any items equal to the key.
+    """
+    last_offset, offset = 0, 1
+    if (yield key, items[start + hint]) < 0:
+        max_offset = hint + 1
+        while offset < max_offset:
+            if (yield key, items[start + hint - offset]) < 0:
+                last_offset = offset
+                offset = (offset << 1) + 1
+            else:
+                break
+        offset = min(offset, max_offset)
+        last_offset, offset = hint - offset, hint - last_offset
+    else:
+        max_offset = n - hint
+        while offset < max_offset:
+            if (yield key, items[start + hint + offset]) < 0:
+                break
+            last_offset = offset
+            offset = (offset << 1) + 1
+        offset = min(offset, max_offset)
+        last_offset, offset = last_offset + hint, offset + hint
+
+    last_offset += 1
+    while last_offset < offset:
+        middle = last_offset + ((offset - last_offset) >> 1)
+        if (yield key, items[start + middle]) < 0:
+            offset = middle
+        else:
+            last_offset = middle + 1
+    return offset
+
+
+class Timsorter(SequentialSorter):
+    """
+    Sorts items with Timsort, making the same comparisons in the same order as Python's built-in sort (list.sort of
+    CPython 3.11 and 3.12). Sort sessions created before sort strategies could be chosen were sorted with the built-in
+    sort, so they keep asking for the same comparisons.
+
+    Runs of already sorted items are found (and extended with binary insertion), then merged in the order of powersort.
+    Merges start by comparing items one by one, and gallop (search for where the next item goes with exponentially
+    growing steps) once one run keeps winning. The state keeps the phase of the sort and the progress of the current
+    merge, and each step makes a single comparison or a single search.
+    """
+
+    @classmethod
+    def start(cls, item_count: int) -> 'Timsorter':
+        state = {'items': list(range(item_count)), 'min_run': _get_min_run(item_count), 'min_gallop': MIN_GALLOP,
+                 'runs': [], 'phase': 'count_run', 'run_start': 0, 'run_length': 0, 'descending': False,
+                 'run_end': None, 'power': None, 'merge': None, 'result': None}
+        if item_count < 2:
+            state['result'] = state['items']
+        return cls(state)
+
+    def steps(self):
+        state = self.state
+        while state['result'] is None:
+            yield from getattr(self, '_' + state['phase'])()
+            yield None
+
+    def _count_run(self):
+        state, items = self.state, self.state['items']
+        start, length = state['run_start'], state['run_length']
+
+        # A run is either non-descending or strictly descending (so it can be reversed without breaking stability)
+        if length == 0 and start + 1 < len(items):
+            state['descending'] = (yield items[start + 1], items[start]) < 0
+            state['run_length'] = 2
+        elif length == 0:
+            state['run_length'] = 1
+            self._run_found()
+        elif start + length < len(items) and \
+                ((yield items[start + length], items[start + length - 1]) < 0) == state['descending']:
+            state['run_length'] += 1
+        else:
+            self._run_found()
+
+    def _run_found(self):
+        state, items = self.state, self.state['items']
+        start, length = state['run_start'], state['run_length']
+
+        if state['descending']:
+            items[start:start + length] = reversed(items[start:start + length])
+
+        # Short runs are extended to the minimum run length with binary insertion
+        if length < state['min_run']:
+            state['run_end'] = start + min(state['min_run'], len(items) - start)
+            state['phase'] = 'binary_insert'
+        else:
+            state['run_end'] = start + length
+            state['phase'] = 'new_run'
+
+    def _binary_insert(self):
+        state, items = self.state, self.state['items']
+        start, sorted_end = state['run_start'], state['run_start'] + state['run_length']
+
+        if sorted_end < state['run_end']:
+            item = items[sorted_end]
+            position = yield from _binary_search(item, items, start, sorted_end)
+            items[position + 1:sorted_end + 1] = items[position:sorted_end]
+            items[position] = item
+            state['run_length'] += 1
+        else:
+            state['phase'] = 'new_run'
+
+    def _new_run(self):
+        state, runs = self.state, self.state['runs']
+        if len(runs) > 0:
+            state['power'] = _get_run_power(runs[-1][0], runs[-1][1], state['run_end'] - state['run_start'],
+                                            len(state['items']))
+        state['phase'] = 'merge_runs'
+        yield from ()
+
+    def _merge_runs(self):
+        """
+        Merges runs whose boundary has a higher power than the new run's, then adds the new run.
+        """
+        state, runs = self.state, self.state['runs']
+        if len(runs) > 1 and runs[-2][2] > state['power']:
+            self._start_merge(len(runs) - 2)
+        else:
+            if len(runs) > 0:
+                runs[-1][2] = state['power']
+            runs.append([state['run_start'], state['run_end'] - state['run_start'], None])
+
+            state['run_start'], state['run_length'], state['descending'] = state['run_end'], 0, False
+            state['phase'] = 'count_run' if state['run_start'] < len(state['items']) else 'collapse_runs'
+        yield from ()
+
+    def _collapse_runs(self):
+        state, runs = self.state, self.state['runs']
+        if len(runs) > 1:
+            i = len(runs) - 2
+            if i > 0 and runs[i - 1][1] < runs[i + 1][1]:
+                i -= 1
+            self._start_merge(i)
+        else:
+            state['result'] = state['items']
+        yield from ()
+
+    def _start_merge(self, i: int):
+        state, runs = self.state, self.state['runs']
+        state['merge'] = {'step': 'trim_start', 'start_a': runs[i][0], 'length_a': runs[i][1],
+                          'start_b': runs[i + 1][0], 'length_b': runs[i + 1][1], 'return_phase': state['phase']}
+        runs[i][1] += runs[i + 1][1]
+        del runs[i + 1]
+        state['phase'] = 'merge'
+
+    def _merge(self):
+        merge = self.state['merge']
+        yield from getattr(self, '_merge_' + merge['step'])(merge)
+
+    def _merge_done(self, merge: Dict):
+        self.state['phase'] = merge['return_phase']
+        self.state['merge'] = None
+
+    def _merge_trim_start(self, merge: Dict):
+        # Items of run a before the first item of run b are already in place
+        items = self.state['items']
+        k = yield from _gallop_right(items[merge['start_b']], items, merge['start_a'], merge['length_a'], 0)
+        merge['start_a'] += k
+        merge['length_a'] -= k
+        if merge['length_a'] == 0:
+            self._merge_done(merge)
+        else:
+            merge['step'] = 'trim_end'
+
+    def _merge_trim_end(self, merge: Dict):
+        # Items of run b after the last item of run a are already in place
+        items = self.state['items']
+        start_a, length_a, start_b = merge['start_a'], merge['length_a'], merge['start_b']
+        length_b = yield from _gallop_left(items[start_a + length_a - 1], items, start_b, merge['length_b'],
+                                           merge['length_b'] - 1)
+        if length_b == 0:
+            self._merge_done(merge)
+            return
+
+        # Copy the shorter run, then merge from the side where the copy's space is
+        if length_a <= length_b:
+            merge.update(step='lo_one_by_one', temp=items[start_a:start_a + length_a], a=0, b=start_b,
+                         dest=start_a, length_a=length_a, length_b=length_b)
+            self._merge_lo_move_b(merge, 1)
+            if merge['length_b'] == 0:
+                self._merge_lo_done(merge)
+            elif merge['length_a'] == 1:
+                self._merge_lo_last_a(merge)
+        else:
+            merge.update(step='hi_one_by_one', temp=items[start_b:start_b + length_b], a=start_a + length_a - 1,
+                         b=length_b - 1, dest=start_b + length_b - 1, length_a=length_a, length_b=length_b)
+            self._merge_hi_move_a(merge, 1)
+            if merge['length_a'] == 0:
+                self._merge_hi_done(merge)
+            elif merge['length_b'] == 1:
+                self._merge_hi_first_b(merge)
+        merge.update(min_gallop=self.state['min_gallop'], count_a=0, count_b=0)
+
+    # Merging when run a is copied: run a's remaining items are temp[a:a + length_a], run b's are
+    # items[b:b + length_b], and merged items are written forwards from dest
+
+    def _merge_lo_move_a(self, merge: Dict, k: int):
+        items, temp = self.state['items'], merge['temp']
+        items[merge['dest']:merge['dest'] + k] = temp[merge['a']:merge['a'] + k]
+        merge['dest'] += k
+        merge['a'] += k
+        merge['length_a'] -= k
+
+    def _merge_lo_move_b(self, merge: Dict, k: int):
+        items = self.state['items']
+        items[merge['dest']:merge['dest'] + k] = items[merge['b']:merge['b'] + k]
+        merge['dest'] += k
+        merge['b'] += k
+        merge['length_b'] -= k
+
+    def _merge_lo_done(self, merge: Dict):
+        self._merge_lo_move_a(merge, merge['length_a'])
+        self._merge_done(merge)
+
+    def _merge_lo_last_a(self, merge: Dict):
+        # The last item of run a belongs after the rest of run b
+        self._merge_lo_move_b(merge, merge['length_b'])
+        self._merge_lo_move_a(merge, 1)
+        self._merge_done(merge)
+
+    def _merge_lo_one_by_one(self, merge: Dict):
+        items = self.state['items']
+        if (yield items[merge['b']], merge['temp'][merge['a']]) < 0:
+            self._merge_lo_move_b(merge, 1)
+            merge['count_a'], merge['count_b'] = 0, merge['count_b'] + 1
+            if merge['length_b'] == 0:
+                self._merge_lo_done(merge)
+                return
+        else:
+            self._merge_lo_move_a(merge, 1)
+            merge['count_a'], merge['count_b'] = merge['count_a'] + 1, 0
+            if merge['length_a'] == 1:
+                self._merge_lo_last_a(merge)
+                return
+
+        if max(merge['count_a'], merge['count_b']) >= merge['min_gallop']:
+            merge['min_gallop'] += 1
+            merge['step'] = 'lo_gallop_a'
+
+    def _merge_lo_gallop_a(self, merge: Dict):
+        items = self.state['items']
+        k = yield from _gallop_right(items[merge['b']], merge['temp'], merge['a'], merge['length_a'], 0)
+        self._gallop_started(merge)
+        merge['count_a'] = k
+        if k > 0:
+            self._merge_lo_move_a(merge, k)
+            if merge['length_a'] == 1:
+                self._merge_lo_last_a(merge)
+                return
+            if merge['length_a'] == 0:
+                self._merge_lo_done(merge)
+                return
+
+        self._merge_lo_move_b(merge, 1)
+        if merge['length_b'] == 0:
+            self._merge_lo_done(merge)
+        else:
+            merge['step'] = 'lo_gallop_b'
+
+    def _merge_lo_gallop_b(self, merge: Dict):
+        items = self.state['items']
+        k = yield from _gallop_left(merge['temp'][merge['a']], items, merge['b'], merge['length_b'], 0)
+        merge['count_b'] = k
+        if k > 0:
+            self._merge_lo_move_b(merge, k)
+            if merge['length_b'] == 0:
+                self._merge_lo_done(merge)
+                return
+
+        self._merge_lo_move_a(merge, 1)
+        if merge['length_a'] == 1:
+            self._merge_lo_last_a(merge)
+        else:
+            self._gallop_done(merge, 'lo')
+
+    # Merging when run b is copied: run a's remaining items are items[a + 1 - length_a:a + 1], run b's are
+    # temp[:b + 1], and merged items are written backwards from dest
+
+    def _merge_hi_move_a(self, merge: Dict, k: int):
+        items = self.state['items']
+        dest, a = merge['dest'], merge['a']
+        items[dest + 1 - k:dest + 1] = items[a + 1 - k:a + 1]
+        merge['dest'] -= k
+        merge['a'] -= k
+        merge['length_a'] -= k
+
+    def _merge_hi_move_b(self, merge: Dict, k: int):
+        items, temp = self.state['items'], merge['temp']
+        dest, b = merge['dest'], merge['b']
+        items[dest + 1 - k:dest + 1] = temp[b + 1 - k:b + 1]
+        merge['dest'] -= k
+        merge['b'] -= k
+        merge['length_b'] -= k
+
+    def _merge_hi_done(self, merge: Dict):
+        self._merge_hi_move_b(merge, merge['length_b'])
+        self._merge_done(merge)
+
+    def _merge_hi_first_b(self, merge: Dict):
+        # The first item of run b belongs before the rest of run a
+        self._merge_hi_move_a(merge, merge['length_a'])
+        self._merge_hi_move_b(merge, 1)
+        self._merge_done(merge)
 
+    def _merge_hi_one_by_one(self, merge: Dict):
+        items = self.state['items']
+        if (yield merge['temp'][merge['b']], items[merge['a']]) < 0:
+            self._merge_hi_move_a(merge, 1)
+            merge['count_a'], merge['count_b'] = merge['count_a'] + 1, 0
+            if merge['length_a'] == 0:
+                self._merge_hi_done(merge)
+                return
+        else:
+            self._merge_hi_move_b(merge, 1)
+            merge['count_a'], merge['count_b'] = 0, merge['count_b'] + 1
+            if merge['length_b'] == 1:
+                self._merge_hi_first_b(merge)
+                return
 
-def add_next_comparison(session: Session, label_session: LabelSession) -> ComparisonAddResult:
-    comparison_elements = [el for el in label_session.elements if el.image_2_name is not None]
-    if len(comparison_elements) > 0 and len(comparison_elements[-1].labels) == 0:
-        return False, comparison_elements[-1], None  # There is already a pending comparison
+        if max(merge['count_a'], merge['count_b']) >= merge['min_gallop']:
+            merge['min_gallop'] += 1
+            merge['step'] = 'hi_gallop_a'
+
+    def _merge_hi_gallop_a(self, merge: Dict):
+        items, length_a = self.state['items'], merge['length_a']
+        k = length_a - (yield from _gallop_right(merge['temp'][merge['b']], items, merge['a'] + 1 - length_a,
+                                                 length_a, length_a - 1))
+        self._gallop_started(merge)
+        merge['count_a'] = k
+        if k > 0:
+            self._merge_hi_move_a(merge, k)
+            if merge['length_a'] == 0:
+                self._merge_hi_done(merge)
+                return
+
+        self._merge_hi_move_b(merge, 1)
+        if merge['length_b'] == 1:
+            self._merge_hi_first_b(merge)
+        else:
+            merge['step'] = 'hi_gallop_b'
+
+    def _merge_hi_gallop_b(self, merge: Dict):
+        items, length_b = self.state['items'], merge['length_b']
+        k = length_b - (yield from _gallop_left(items[merge['a']], merge['temp'], 0, length_b, length_b - 1))
+        merge['count_b'] = k
+        if k > 0:
+            self._merge_hi_move_b(merge, k)
+            if merge['length_b'] == 1:
+                self._merge_hi_first_b(merge)
+                return
+            if merge['length_b'] == 0:
+                self._merge_hi_done(merge)
+                return
+
+        self._merge_hi_move_a(merge, 1)
+        if merge['length_a'] == 0:
+            self._merge_hi_done(merge)
+        else:
+            self._gallop_done(merge, 'hi')
+
+    def _gallop_started(self, merge: Dict):
+        # Each round of galloping makes it easier to keep galloping
+        merge['min_gallop'] -= merge['min_gallop'] > 1
+        self.state['min_gallop'] = merge['min_gallop']
+
+    def _gallop_done(self, merge: Dict, side: str):
+        if max(merge['count_a'], merge['count_b']) >= MIN_GALLOP:
+            merge['step'] = side + '_gallop_a'
+        else:
+            # Leaving galloping makes it harder to start again
+            merge['min_gallop'] += 1
+            self.state['min_gallop'] = merge['min_gallop']
+            merge['count_a'], merge['count_b'] = 0, 0
+            merge['step'] = side + '_one_by_one'
+
+
+class ParallelMergeSorter(Sorter):
+    """
+    Sorts items with a top-down merge sort whose merges are advanced independently, so it waits for one comparison of
+    each merge whose two halves are sorted. These comparisons can be labeled at the same time, in any order.
+
+    The state keeps the merges in progress (ordered by position) and the sorted halves whose other half isn't sorted
+    yet.
+    """
+
+    @classmethod
+    def start(cls, item_count: int) -> 'ParallelMergeSorter':
+        sorter = cls({'item_count': item_count, 'merges': [], 'sorted': {}, 'result': None})
+
+        def start_node(start: int, end: int):
+            if end - start <= 1:
+                sorter._node_sorted(start, end, list(range(start, end)))
+            else:
+                middle = start + (end - start) // 2
+                start_node(start, middle)
+                start_node(middle, end)
+
+        start_node(0, item_count)
+        return sorter
+
+    @property
+    def pending(self) -> List[ItemComparison]:
+        return [(merge['left'][merge['i']], merge['right'][merge['j']]) for merge in self.state['merges']]
+
+    def add_result(self, comparison: ItemComparison, result: int):
+        merges = self.state['merges']
+        k = self.pending.index(comparison)
+        merge = merges[k]
+
+        if result > 0:
+            merge['merged'].append(merge['right'][merge['j']])
+            merge['j'] += 1
+        else:
+            merge['merged'].append(merge['left'][merge['i']])
+            merge['i'] += 1
+
+        if merge['i'] == len(merge['left']) or merge['j'] == len(merge['right']):
+            del merges[k]
+            self._node_sorted(merge['start'], merge['end'],
+                              merge['merged'] + merge['left'][merge['i']:] + merge['right'][merge['j']:])
+
+    def _node_sorted(self, start: int, end: int, sorted_items: List[int]):
+        item_count = self.state['item_count']
+        if (start, end) == (0, item_count):
+            self.state['result'] = sorted_items
+            return
+
+        # Find the parent of the sorted half by halving the items from the top, like the recursion of a merge sort
+        parent_start, parent_end = 0, item_count
+        while True:
+            middle = parent_start + (parent_end - parent_start) // 2
+            child = (parent_start, middle) if end <= middle else (middle, parent_end)
+            if child == (start, end):
+                break
+            parent_start, parent_end = child
+
+        sibling = (middle, parent_end) if start == parent_start else (parent_start, middle)
+        sibling_items = self.state['sorted'].pop('{}-{}'.format(*sibling), None)
+        if sibling_items is None:
+            self.state['sorted']['{}-{}'.format(start, end)] = sorted_items
+            return
+
+        left, right = (sorted_items, sibling_items) if start == parent_start else (sibling_items, sorted_items)
+        merge = {'start': parent_start, 'end': parent_end, 'left': left, 'right': right, 'i': 0, 'j': 0, 'merged': []}
+        merges = self.state['merges']
+        merges.insert(sum(m['start'] < parent_start for m in merges), merge)
+
+
+def timsort(items: List[T], compare: CompareFunction) -> List[T]:
+    return sort_items(Timsorter, items, compare)
+
+
+def binary_insertion_sort(items: List[T], compare: CompareFunction) -> List[T]:
+    return sort_items(BinaryInsertionSorter, items, compare)
+
+
+def merge_insertion_sort(items: List[T], compare: CompareFunction) -> List[T]:
+    return sort_items(MergeInsertionSorter, items, compare)
+
+
+def merge_sort(items: List[T], compare: CompareFunction) -> List[T]:
+    return sort_items(ParallelMergeSorter, items, compare)
+
+
+SORTERS: Dict[SortStrategy, Type[Sorter]] = {
+    SortStrategy.TIMSORT: Timsorter,
+    SortStrategy.BINARY_INSERTION: BinaryInsertionSorter,
+    SortStrategy.MERGE_INSERTION: MergeInsertionSorter,
+    SortStrategy.PARALLEL_MERGE: ParallelMergeSorter
+}
+
+SORT_FUNCTIONS: Dict[SortStrategy, SortFunction] = {
+    SortStrategy.TIMSORT: timsort,
+    SortStrategy.BINARY_INSERTION: binary_insertion_sort,
+    SortStrategy.MERGE_INSERTION: merge_insertion_sort,
+    SortStrategy.PARALLEL_MERGE: merge_sort
+}
+
+
+def get_sort_strategy(label_session: LabelSession) -> SortStrategy:
+    if label_session.sort_strategy is None:
+        return SortStrategy.TIMSORT
+    return SortStrategy[label_session.sort_strategy]
+
+
+COMPARISON_RESULTS = {'First': 1, 'Second': -1, 'No Difference': 0}
+
+
+def add_comparison_results(results: Dict[Comparison, int], comparison_elements: List[SessionElement]):
+    """
+    Adds the results of labeled comparisons to an index of comparison results, in both orders of the compared slices.
+    Like sorting by scanning the comparisons in order, a pair which was compared more than once keeps the result of
+    its first comparison.
+    """
+    for el in comparison_elements:
+        result = COMPARISON_RESULTS[el.current_label_value]
+        sl1, sl2 = sampling.get_comparison_from_element(el)
+        results.setdefault((sl1, sl2), result)
+        results.setdefault((sl2, sl1), -result)
+
+
+def _get_comparison_values(label_session: LabelSession, comparison: Comparison) -> Dict:
+    sl1, sl2 = comparison
+    return {
+        'session_id': label_session.id,
+        'image_1_name': sl1.image_name,
+        'slice_1_index': sl1.slice_index,
+        'slice_1_type': sl1.slice_type.name,
+        'image_2_name': sl2.image_name,
+        'slice_2_index': sl2.slice_index,
+        'slice_2_type': sl2.slice_type.name
+    }
+
+
+def _is_comparison(label_session: LabelSession, comparison: Comparison):
+    """
+    Builds a condition which matches the session's elements for a comparison (in the same order).
+    """
+    elements = SessionElement.__table__
+    return and_(*[elements.c[name] == value
+                  for name, value in _get_comparison_values(label_session, comparison).items()])
+
+
+def _insert_comparison_element(label_session: LabelSession, comparison: Comparison) -> Insert:
+    """
+    Builds a statement which adds an element for a comparison unless the session already has an unlabeled element for
+    it. The element index follows the largest index of the session's comparison elements. Both are evaluated by the
+    database within the insert, so app processes adding comparisons at the same time don't add a comparison twice or
+    give two elements the same index.
+    """
+    values = _get_comparison_values(label_session, comparison)
+    elements = SessionElement.__table__
+
+    next_index = select([func.coalesce(func.max(elements.c.element_index) + 1, 0)]) \
+        .where(elements.c.session_id == label_session.id) \
+        .where(elements.c.image_2_name.isnot(None)) \
+        .as_scalar()
+    unlabeled_element = select([elements.c.id]) \
+        .where(_is_comparison(label_session, comparison)) \
+        .where(elements.c.current_label_value.is_(None))
+
+    element_values = select([literal(value) for value in values.values()] + [next_index]) \
+        .where(~exists(unlabeled_element))
+    return elements.insert().from_select(list(values) + ['element_index'], element_values)
+
+
+def _add_comparison_elements(session: Session, label_session: LabelSession, comparisons: List[Comparison]) -> List[int]:
+    """
+    Gets the ids of the elements of comparisons, adding elements for those which don't have an unlabeled one yet.
+    """
+    element_ids = []
+    for comparison in comparisons:
+        session.execute(_insert_comparison_element(label_session, comparison))
+
+        # The latest element of a comparison is the unlabeled one, unless it was labeled since
+        element_ids.append(session.query(SessionElement.id)
+                           .filter(_is_comparison(label_session, comparison))
+                           .order_by(SessionElement.id.desc())
+                           .limit(1)
+                           .scalar())
+    return element_ids
+
+
+def _get_comparison_result(session: Session, label_session: LabelSession, comparison: Comparison) -> Optional[int]:
+    """
+    Gets the result of the first labeled comparison of two slices (in either order), like add_comparison_results.
+    """
+    sl1, sl2 = comparison
+    labeled_elements = []
+    for order in ((sl1, sl2), (sl2, sl1)):  # Separate queries, so each can use the index on the slice indices
+        el = session.query(SessionElement) \
+            .filter(_is_comparison(label_session, order)) \
+            .filter(SessionElement.current_label_value.isnot(None)) \
+            .order_by(SessionElement.id) \
+            .first()
+        if el is not None:
+            labeled_elements.append(el)
+    if len(labeled_elements) == 0:
+        return None
+
+    el = min(labeled_elements, key=lambda el: el.id)
+    result = COMPARISON_RESULTS[el.current_label_value]
+    return result if sampling.get_comparison_from_element(el) == comparison else -result
+
+
+def _get_sort_slices(session: Session, label_session: LabelSession,
+                     positions: List[int] = None) -> Dict[int, ImageSlice]:
+    """
+    Gets slices of a sort session by their position in the sort, which is the index of their element.
+
+    :param positions: Positions of the slices to get, or None to get every slice.
+    """
+    slice_elements = session.query(SessionElement.element_index, SessionElement.image_1_name,
+                                   SessionElement.slice_1_index, SessionElement.slice_1_type) \
+        .filter(SessionElement.session_id == label_session.id) \
+        .filter(SessionElement.image_2_name.is_(None))
+    if positions is not None:
+        slice_elements = slice_elements.filter(SessionElement.element_index.in_(positions))
+    return {element_index: ImageSlice(image_name, slice_index, SliceType[slice_type])
+            for element_index, image_name, slice_index, slice_type in slice_elements}
+
+
+def _replay_sort(label_session: LabelSession) -> Tuple[Sorter, List[ImageSlice], Dict[Comparison, int], Optional[int]]:
+    """
+    Starts sorting a session's slices from scratch, with the results of all of its labeled comparisons.
+
+    :return: The sorter, the slices, the comparison results and the id of the latest label of a comparison.
+    """
+    labeled_elements = [el for el in label_session.elements
+                        if el.is_comparison() and el.current_label_value is not None]
+    results = {}
+    add_comparison_results(results, labeled_elements)
 
     slices = sampling.get_slices_from_session(label_session)
-    comparison_count = len(comparison_elements)
-
-    new_comparison = None
-
-    def compare(sl1: ImageSlice, sl2: ImageSlice):
-        for comparison_el in comparison_elements:
-            label = comparison_el.labels[-1].label_value
-            comparison = sampling.get_comparison_from_element(comparison_el)
-            if sl1 == comparison[0] and sl2 == comparison[1]:
-                return {'First': 1, 'Second': -1, 'No Difference': 0}[label]
-            elif sl1 == comparison[1] and sl2 == comparison[0]:
-                return {'First': -1, 'Second': 1, 'No Difference': 0}[label]
-        nonlocal new_comparison
-        new_comparison = (sl1, sl2)
-        raise ComparisonNotFound()
-
-    try:
-        slices_sorted = sorted(slices, key=functools.cmp_to_key(compare))
-        return True, None, slices_sorted
-    except ComparisonNotFound:
-        assert new_comparison is not None
-        new_comparison: Tuple[ImageSlice, ImageSlice]
-
-        comparison_el = SessionElement(
-            element_index=comparison_count,
-            image_1_name=new_comparison[0].image_name,
-            slice_1_index=new_comparison[0].slice_index,
-            slice_1_type=new_comparison[0].slice_type.name,
-            image_2_name=new_comparison[1].image_name,
-            slice_2_index=new_comparison[1].slice_index,
-            slice_2_type=new_comparison[1].slice_type.name
-        )
-        label_session.elements.append(comparison_el)
+    sorter = SORTERS[get_sort_strategy(label_session)].start(len(slices))
+    return sorter, slices, results, max((el.current_label_id for el in labeled_elements), default=None)
+
+
+def get_pending_comparisons(session: Session,
+                            label_session: LabelSession) -> Tuple[Optional[List[ImageSlice]], List[SessionElement]]:
+    """
+    Gets the comparisons a sort session is waiting for, adding elements for those which don't have one yet. Sequential
+    sorts wait for one comparison at a time. Parallel merge sorts wait for one comparison of each merge, so their
+    pending comparisons are independent of each other and can be labeled at the same time, in any order.
+
+    The sort is continued from the state saved on the session (sort_state), which includes the labels up to
+    sort_state_label_id and the elements of the pending comparisons. Labels of pending comparisons advance the sort by
+    their results, which takes a few indexed queries, and loading the state repeats at most the O(log n) comparisons of
+    the sort's current step. The sort is replayed from scratch with the results of every labeled comparison when
+    another comparison is labeled (relabeling a comparison the sort already used changes its result), or if the
+    session doesn't have a state yet.
+
+    :return: The sorted slices (if every comparison is labeled) and the pending comparison elements.
+    """
+    sorter, slices, results, last_label_id = None, {}, None, label_session.sort_state_label_id
+    pending_element_ids: Dict[ItemComparison, int] = {}
+    changed = False
+
+    if label_session.sort_state is not None:
+        sort_state = json.loads(label_session.sort_state)
+        sorter = SORTERS[get_sort_strategy(label_session)](**sort_state['sorter'])
+        pending_element_ids = {(i, j): element_id for i, j, element_id in sort_state['elements']}
+
+        new_labels = session.query(SessionElement.id, SessionElement.current_label_id,
+                                   SessionElement.current_label_value) \
+            .filter(SessionElement.session_id == label_session.id) \
+            .filter(SessionElement.image_2_name.isnot(None)) \
+            .filter(SessionElement.current_label_id.isnot(None) if last_label_id is None else
+                    SessionElement.current_label_id > last_label_id) \
+            .order_by(SessionElement.id) \
+            .all()
+
+        pending_comparisons = {element_id: comparison for comparison, element_id in pending_element_ids.items()}
+        if not all(element_id in pending_comparisons for element_id, _, _ in new_labels):
+            sorter = None
+        elif len(new_labels) > 0:
+            for element_id, _, label_value in new_labels:
+                comparison = pending_comparisons[element_id]
+                sorter.add_result(comparison, COMPARISON_RESULTS[label_value])
+                del pending_element_ids[comparison]
+            last_label_id = max(label_id for _, label_id, _ in new_labels)
+            changed = True
+
+    if sorter is None:
+        sorter, session_slices, results, last_label_id = _replay_sort(label_session)
+        slices = dict(enumerate(session_slices))
+        pending_element_ids = {}
+        changed = True
+
+    # Continue the sort with comparisons which were already labeled, then add elements for the others
+    while True:
+        new_comparisons = [comparison for comparison in sorter.pending if comparison not in pending_element_ids]
+        missing_positions = {i for comparison in new_comparisons for i in comparison if i not in slices}
+        if len(missing_positions) > 0:
+            slices.update(_get_sort_slices(session, label_session, list(missing_positions)))
+
+        known_results = {}
+        for i, j in new_comparisons:
+            if results is None:
+                result = _get_comparison_result(session, label_session, (slices[i], slices[j]))
+            else:
+                result = results.get((slices[i], slices[j]))
+            if result is not None:
+                known_results[(i, j)] = result
+
+        if len(known_results) == 0:
+            break
+        for comparison, result in known_results.items():
+            sorter.add_result(comparison, result)
+
+    if len(new_comparisons) > 0:
+        new_element_ids = _add_comparison_elements(session, label_session,
+                                                   [(slices[i], slices[j]) for i, j in new_comparisons])
+        pending_element_ids.update(zip(new_comparisons, new_element_ids))
+        changed = True
+
+    if changed:
+        # Only replace a state which includes fewer labels, in case another app process saved a newer one meanwhile
+        sort_state = {'sorter': sorter.to_json(),
+                      'elements': [[i, j, pending_element_ids[(i, j)]] for i, j in sorter.pending]}
+        saved_label_id = LabelSession.sort_state_label_id
+        session.query(LabelSession) \
+            .filter(LabelSession.id == label_session.id) \
+            .filter(saved_label_id.is_(None) if last_label_id is None else
+                    or_(saved_label_id.is_(None), saved_label_id <= last_label_id)) \
+            .update({LabelSession.sort_state: json.dumps(sort_state), LabelSession.sort_state_label_id: last_label_id},
+                    synchronize_session=False)
         session.commit()
-        return False, comparison_el, None
+
+    if sorter.result is not None:
+        if len(slices) < len(sorter.result):
+            slices = _get_sort_slices(session, label_session)
+        return [slices[i] for i in sorter.result], []
+
+    pending_elements = {el.id: el for el in session.query(SessionElement)
+                        .filter(SessionElement.id.in_([pending_element_ids[comparison]
+                                                       for comparison in sorter.pending]))}
+    return None, [pending_elements[pending_element_ids[comparison]] for comparison in sorter.pending]
+
+
+def lease_comparison(session: Session, pending_elements: List[SessionElement], labeler_id: str) -> SessionElement:
+    """
+    Assigns one of a session's pending comparisons to a labeler for SORT_LEASE_SECONDS, so labelers working on the
+    same session at the same time are given different comparisons. A labeler keeps their comparison until they label
+    it or their lease expires. If every pending comparison is leased to someone else, the one whose lease expires first
+    is shared, since labeling a comparison twice only replaces its label.
+
+    Leases are stored on the elements and taken with a conditional update, so they hold across app processes.
+    """
+    now = datetime.now()
+    expires = now + timedelta(seconds=SORT_LEASE_SECONDS)
+
+    def is_leased(el: SessionElement) -> bool:
+        return el.lease_labeler_id is not None and el.lease_expires > now
+
+    # The labeler's own comparison first, then comparisons nobody holds
+    candidates = [el for el in pending_elements if is_leased(el) and el.lease_labeler_id == labeler_id] + \
+                 [el for el in pending_elements if not is_leased(el)]
+
+    comparison_el = None
+    for el in candidates:
+        lease_count = session.query(SessionElement) \
+            .filter(SessionElement.id == el.id) \
+            .filter(or_(SessionElement.lease_labeler_id.is_(None), SessionElement.lease_expires <= now,
+                        SessionElement.lease_labeler_id == labeler_id)) \
+            .update({SessionElement.lease_labeler_id: labeler_id, SessionElement.lease_expires: expires},
+                    synchronize_session=False)
+        if lease_count == 1:
+            comparison_el = el
+            break
+
+    if comparison_el is None:
+        comparison_el = min(pending_elements, key=lambda el: el.lease_expires if is_leased(el) else now)
+        session.query(SessionElement) \
+            .filter(SessionElement.id == comparison_el.id) \
+            .update({SessionElement.lease_labeler_id: labeler_id, SessionElement.lease_expires: expires},
+                    synchronize_session=False)
+
+    session.commit()
+    return comparison_el
+
+
+def release_comparison_lease(session: Session, element: SessionElement):
+    if element.lease_labeler_id is None:
+        return
+
+    element.lease_labeler_id = None
+    element.lease_expires = None
+    session.commit()
+
+
+def add_next_comparison(session: Session, label_session: LabelSession, labeler_id: str = None) -> ComparisonAddResult:
+    """
+    Gets the next comparison of a sort session to label, adding it to the session if needed, or the sorted slices if
+    every comparison is labeled.
+
+    :param labeler_id: Identifies the labeler the comparison is for. Parallel merge sort sessions lease a different
+                       pending comparison to each labeler. Without a labeler the first pending comparison is returned.
+    """
+    sorted_slices, pending_elements = get_pending_comparisons(session, label_session)
+    if sorted_slices is not None:
+        return True, None, sorted_slices
+    if labeler_id is None or get_sort_strategy(label_session) != SortStrategy.PARALLEL_MERGE:
+        return False, pending_elements[0], None
+    return False, lease_comparison(session, pending_elements, labeler_id), None
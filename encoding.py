@@ -0,0 +1,54 @@
+from enum import Enum
+from io import BytesIO
+from typing import NamedTuple
+
+from PIL import Image
+
+DEFAULT_QUALITY = 90
+DEFAULT_COMPRESS_LEVEL = 6  # Pillow's default zlib level for PNG
+
+QUALITY_RANGE = (1, 100)
+COMPRESS_LEVEL_RANGE = (0, 9)
+
+
+class ImageFormat(Enum):
+    PNG = 0
+    JPEG = 1
+    WEBP = 2
+    RAW = 3  # Raw uint8 pixels (row-major, one byte per pixel), e.g. for drawing on a canvas in JS
+
+
+FORMAT_MIMETYPES = {
+    ImageFormat.PNG: 'image/png',
+    ImageFormat.JPEG: 'image/jpeg',
+    ImageFormat.WEBP: 'image/webp',
+    ImageFormat.RAW: 'application/octet-stream'
+}
+
+FORMAT_EXTENSIONS = {
+    ImageFormat.PNG: '.png',
+    ImageFormat.JPEG: '.jpg',
+    ImageFormat.WEBP: '.webp',
+    ImageFormat.RAW: '.raw'
+}
+
+
+class SliceEncoding(NamedTuple):
+    image_format: ImageFormat = ImageFormat.PNG
+    quality: int = DEFAULT_QUALITY  # JPEG/WebP quality (QUALITY_RANGE)
+    compress_level: int = DEFAULT_COMPRESS_LEVEL  # PNG zlib level (COMPRESS_LEVEL_RANGE, lower is faster but larger)
+
+
+def encode_image(img: Image.Image, slice_encoding: SliceEncoding) -> bytes:
+    image_format = slice_encoding.image_format
+    if image_format == ImageFormat.RAW:
+        return img.tobytes()
+
+    bio = BytesIO()
+    if image_format == ImageFormat.PNG:
+        img.save(bio, 'PNG', compress_level=slice_encoding.compress_level)
+    elif image_format == ImageFormat.JPEG:
+        img.save(bio, 'JPEG', quality=slice_encoding.quality)
+    else:  # WEBP
+        img.save(bio, 'WEBP', quality=slice_encoding.quality)
+    return bio.getvalue()
@@ -106,6 +106,12 @@ class CreateSortSessionForm(FlaskForm):
     max_slice_percent = IntegerField('Max Slice (%)', validators=[NumberRange(min=1, max=100)],
                                      render_kw={'placeholder': 100,
                                                 'value': 90})
+
+    # Merge insertion asks for the fewest comparisons, so it is the default
+    sort_strategy = SelectField('Sort Strategy', choices=[('MERGE_INSERTION', 'Merge Insertion'),
+                                                          ('PARALLEL_MERGE', 'Parallel Merge (Several Labelers)'),
+                                                          ('BINARY_INSERTION', 'Binary Insertion'),
+                                                          ('TIMSORT', 'Timsort')])
     submit_button = SubmitField('Create')
 
 
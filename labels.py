@@ -4,6 +4,7 @@ from datetime import datetime
 from io import StringIO, BytesIO
 from typing import Dict, Optional, List
 
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from model import LabelSession, SessionElement, ElementLabel
@@ -32,9 +33,38 @@ def set_label(session: Session, element: SessionElement, label_value: str, ms: i
         milliseconds=ms
     )
     session.add(label)
+    session.flush()  # Assigns the label's id
+
+    # Update the element's current label with conditional updates, so concurrent labels can't count an element twice
+    # or replace a newer label with an older one
+    current_label = {
+        SessionElement.current_label_id: label.id,
+        SessionElement.current_label_value: label_value
+    }
+    element_query = session.query(SessionElement).filter(SessionElement.id == element.id)
+    first_label = element_query.filter(SessionElement.current_label_id.is_(None)) \
+        .update(current_label, synchronize_session=False) == 1
+
+    if first_label:
+        session.query(LabelSession).filter(LabelSession.id == element.session_id) \
+            .update({LabelSession.labeled_count: LabelSession.labeled_count + 1}, synchronize_session=False)
+    else:
+        element_query.filter(SessionElement.current_label_id < label.id) \
+            .update(current_label, synchronize_session=False)
+
     session.commit()
 
 
+def get_resume_point(session: Session, label_session: LabelSession) -> Optional[int]:
+    """
+    Gets the index of the first element of a session without a label, or None if every element is labeled.
+    """
+    return session.query(func.min(SessionElement.element_index)) \
+        .filter(SessionElement.session_id == label_session.id) \
+        .filter(SessionElement.current_label_id.is_(None)) \
+        .scalar()
+
+
 def get_all_labels(label_session: LabelSession) -> Dict[SessionElement, List[ElementLabel]]:
     return {el: el.labels for el in label_session.elements}
 
@@ -0,0 +1,72 @@
+from typing import NamedTuple, Optional, List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+
+class ColumnMigration(NamedTuple):
+    table: str
+    column: str
+    column_sql: str  # Column definition for ALTER TABLE ... ADD COLUMN
+    backfill_sql: Optional[str]  # Fills in the new column from existing rows
+
+
+# Columns added after the first release. db.create_all() only creates missing tables, so databases created before a
+# column was added get it (and its data) from here.
+COLUMN_MIGRATIONS: List[ColumnMigration] = [
+    ColumnMigration(
+        'session_elements', 'current_label_id', 'current_label_id INTEGER',
+        'UPDATE session_elements SET current_label_id = '
+        '(SELECT MAX(id) FROM element_labels WHERE element_labels.element_id = session_elements.id)'
+    ),
+    ColumnMigration(
+        'session_elements', 'current_label_value', 'current_label_value VARCHAR(100)',
+        'UPDATE session_elements SET current_label_value = '
+        '(SELECT label_value FROM element_labels WHERE element_labels.id = session_elements.current_label_id)'
+    ),
+    ColumnMigration(
+        'label_sessions', 'labeled_count', 'labeled_count INTEGER NOT NULL DEFAULT 0',
+        'UPDATE label_sessions SET labeled_count = '
+        '(SELECT COUNT(*) FROM session_elements WHERE session_elements.session_id = label_sessions.id '
+        'AND session_elements.current_label_id IS NOT NULL)'
+    ),
+    ColumnMigration('label_sessions', 'sort_strategy', 'sort_strategy VARCHAR(100)', None),
+    ColumnMigration('session_elements', 'lease_labeler_id', 'lease_labeler_id VARCHAR(100)', None),
+    ColumnMigration('session_elements', 'lease_expires', 'lease_expires DATETIME', None),
+    ColumnMigration('label_sessions', 'sort_state', 'sort_state TEXT', None),
+    ColumnMigration('label_sessions', 'sort_state_label_id', 'sort_state_label_id INTEGER', None)
+]
+
+# Indexes which db.create_all() doesn't add to existing tables
+INDEX_MIGRATIONS: List[str] = [
+    'CREATE INDEX IF NOT EXISTS ix_label_sessions_dataset_type ON label_sessions (dataset, session_type)',
+    'CREATE INDEX IF NOT EXISTS ix_session_elements_session_element_index '
+    'ON session_elements (session_id, element_index)',
+    'CREATE INDEX IF NOT EXISTS ix_session_elements_session_current_label '
+    'ON session_elements (session_id, current_label_id)',
+    'CREATE INDEX IF NOT EXISTS ix_session_elements_session_slice_indices '
+    'ON session_elements (session_id, slice_1_index, slice_2_index)',
+    'CREATE INDEX IF NOT EXISTS ix_element_labels_element ON element_labels (element_id)'
+]
+
+
+def upgrade_database(engine: Engine):
+    """
+    Adds columns and indexes which are missing from a database created by an earlier version. Migrations are applied
+    in order, so backfills may depend on columns added by earlier migrations.
+    """
+    inspector = inspect(engine)
+    table_columns = {table: {c['name'] for c in inspector.get_columns(table)} for table in inspector.get_table_names()}
+
+    with engine.begin() as conn:
+        for migration in COLUMN_MIGRATIONS:
+            if migration.column in table_columns[migration.table]:
+                continue
+
+            conn.execute(text('ALTER TABLE {} ADD COLUMN {}'.format(migration.table, migration.column_sql)))
+            if migration.backfill_sql is not None:
+                conn.execute(text(migration.backfill_sql))
+            print('Added column {}.{}'.format(migration.table, migration.column))
+
+        for index_sql in INDEX_MIGRATIONS:
+            conn.execute(text(index_sql))
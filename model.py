@@ -1,9 +1,50 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple, Dict, Union
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
 
 db = SQLAlchemy()
 
+# Pragmas applied to every connection to the label database. In WAL mode labelers can keep reading while another
+# labeler writes, and the busy timeout makes concurrent writers wait for each other instead of failing with
+# "database is locked". synchronous=NORMAL is durable across application crashes in WAL mode (only a power loss can
+# lose the most recent commits) and avoids an fsync on every label.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 10000,  # Milliseconds
+    'mmap_size': 256 * 2 ** 20,  # Bytes
+    'cache_size': -16 * 2 ** 10  # Negative sizes are in KiB
+}
+
+# Keep connections open between requests (Flask-SQLAlchemy opens a new connection per request for SQLite files by
+# default), so pragmas and the page cache aren't set up again on every request
+SQLITE_ENGINE_OPTIONS = {
+    'poolclass': QueuePool,
+    'pool_size': 8,
+    'max_overflow': 8,
+    'connect_args': {'check_same_thread': False}
+}
+
+
+def is_sqlite_uri(database_uri: str) -> bool:
+    return make_url(database_uri).get_backend_name() == 'sqlite'
+
+
+def set_sqlite_pragmas(engine: Engine, pragmas: Dict[str, Union[str, int]]):
+    """
+    Applies pragmas to every new connection of an engine. Must be called before the engine's first connection.
+    """
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+        cursor.close()
+
 
 class LabelSession(db.Model):
     __tablename__ = 'label_sessions'
@@ -19,12 +60,22 @@ class LabelSession(db.Model):
     label_values_str = db.Column(db.String(1000), nullable=False)
 
     element_count = db.Column(db.Integer, nullable=False)
+    labeled_count = db.Column(db.Integer, nullable=False, default=0)  # Elements with at least one label
+
+    # Name of the SortStrategy of a SORT_SLICE session (None for sessions created before strategies could be chosen)
+    sort_strategy = db.Column(db.String(100))
+
+    # Progress of a SORT_SLICE session's sort as JSON (see comparesort.get_pending_comparisons), including the labels
+    # up to sort_state_label_id. Deferred, so loading sessions doesn't load it.
+    sort_state = db.deferred(db.Column(db.Text))
+    sort_state_label_id = db.Column(db.Integer)
 
     elements: 'List[SessionElement]' = db.relationship('SessionElement', back_populates='session',
                                                        order_by='SessionElement.id')
 
     __table_args__ = (
         db.UniqueConstraint(dataset, session_name),
+        db.Index('ix_label_sessions_dataset_type', dataset, session_type)
     )
 
     def label_values(self) -> List[str]:
@@ -48,19 +99,28 @@ class SessionElement(db.Model):
     image_2_name = db.Column(db.String(100), nullable=True)
     slice_2_index = db.Column(db.Integer, nullable=True)
     slice_2_type = db.Column(db.String(50), nullable=True)
+
+    # Latest label of the element (copied from its labels by labels.set_label, so reading it doesn't load the labels)
+    current_label_id = db.Column(db.Integer, nullable=True)
+    current_label_value = db.Column(db.String(100), nullable=True)
+
+    # Labeler a pending comparison of a parallel sort session is assigned to, until the lease expires
+    lease_labeler_id = db.Column(db.String(100), nullable=True)
+    lease_expires = db.Column(db.DateTime, nullable=True)
     
     session = db.relationship(LabelSession, back_populates='elements')
     labels: 'List[ElementLabel]' = db.relationship('ElementLabel', back_populates='element',
                                                    order_by='ElementLabel.id')
 
+    __table_args__ = (
+        db.Index('ix_session_elements_session_element_index', session_id, element_index),
+        db.Index('ix_session_elements_session_current_label', session_id, current_label_id),
+        db.Index('ix_session_elements_session_slice_indices', session_id, slice_1_index, slice_2_index)
+    )
+
     def is_comparison(self) -> bool:
         return self.image_2_name is not None
 
-    def current_label_value(self) -> Optional[str]:
-        if len(self.labels) == 0:
-            return None
-        return self.labels[-1].label_value
-
 
 class ElementLabel(db.Model):
     __tablename__ = 'element_labels'
@@ -74,3 +134,41 @@ class ElementLabel(db.Model):
     milliseconds = db.Column(db.Integer, nullable=False)
 
     element = db.relationship(SessionElement, back_populates='labels')
+
+    __table_args__ = (
+        db.Index('ix_element_labels_element', element_id),
+    )
+
+
+class CatalogImage(db.Model):
+    """
+    Metadata of a dataset image, so dataset-wide questions (counts, shapes, orientations) can be answered with a query
+    instead of opening every file. Rows are kept in sync with the files by the catalog module.
+    """
+    __tablename__ = 'catalog_images'
+
+    id = db.Column(db.Integer, primary_key=True)
+    dataset = db.Column(db.String(100), nullable=False)
+
+    name = db.Column(db.String(100), nullable=False)
+    path = db.Column(db.String(1000), nullable=False)
+
+    file_size = db.Column(db.BigInteger, nullable=False)
+    mtime_ns = db.Column(db.BigInteger, nullable=False)
+
+    # Shape of the volume as loaded for slicing, null if the image's header couldn't be read
+    shape_sagittal = db.Column(db.Integer, nullable=True)
+    shape_coronal = db.Column(db.Integer, nullable=True)
+    shape_axial = db.Column(db.Integer, nullable=True)
+
+    axis_codes = db.Column(db.String(10), nullable=True)  # Orientation of the image data on disk, e.g. RAS
+    max_value = db.Column(db.Float, nullable=True)  # Null until the image's stats have been computed
+
+    __table_args__ = (
+        db.UniqueConstraint(dataset, name),
+    )
+
+    def shape(self) -> Optional[Tuple[int, int, int]]:
+        if self.shape_sagittal is None:
+            return None
+        return self.shape_sagittal, self.shape_coronal, self.shape_axial
@@ -1,55 +1,251 @@
-from typing import List, Tuple, NamedTuple
+from enum import Enum, auto
+from typing import List, Tuple, NamedTuple, Optional
 
-import labels
-import sampling
-from backend import ImageSlice
-from model import LabelSession
+import numpy as np
+from sqlalchemy import case, inspect, null, select
+from sqlalchemy.orm import object_session
+
+from backend import ImageSlice, SliceType
+from model import LabelSession, SessionElement
 from sessions import LabelSessionType
 
+CONFIDENCE_Z = 1.96  # Confidence intervals are 95%
+
+LABEL_OUTCOMES = {'First': 1.0, 'Second': 0.0}  # Outcome of a comparison for its first slice
+DRAW_OUTCOME = 0.5
+
+BRADLEY_TERRY_MAX_ITERATIONS = 200
+BRADLEY_TERRY_TOLERANCE = 1e-6
+BRADLEY_TERRY_PRIOR = 1.0  # Virtual win and loss of each slice against an average slice, so every strength is finite
+
+ELO_INITIAL_RATING = 1500.0
+ELO_K = 32.0
+
+
+class RankingMethod(Enum):
+    SCORE = auto()  # Wins minus losses
+    WIN_RATE = auto()
+    BRADLEY_TERRY = auto()
+    ELO = auto()
+
 
 class ComparisonRankResult(NamedTuple):
-    score: int
+    score: float
     win_count: int
     loss_count: int
     draw_count: int
     total_count: int
+    ci_low: Optional[float] = None  # Confidence interval of the score, if the ranking method has one
+    ci_high: Optional[float] = None
 
 
-def rank_slices(label_session: LabelSession) -> List[Tuple[ImageSlice, ComparisonRankResult]]:
-    assert label_session.session_type == LabelSessionType.COMPARISON_SLICE.name
+class ComparisonArrays(NamedTuple):
+    """
+    A session's labeled comparisons as arrays of slice indices, in the order the comparisons were added.
+    """
+    slices: List[ImageSlice]  # Every slice of the session, including slices without labeled comparisons
+    first: np.ndarray  # Index of the first slice of each comparison
+    second: np.ndarray  # Index of the second slice of each comparison
+    outcome: np.ndarray  # 1 if the first slice won, 0 if the second slice won, 0.5 for a draw
+
+
+ComparisonRow = Tuple[str, str, int, int, int, int, Optional[float]]
 
-    rank_data = {sl: [0, 0, 0, 0, 0] for sl in sampling.get_slices_from_session(label_session)}
 
-    for el, el_labels in labels.get_all_labels(label_session).items():
-        if len(el_labels) == 0:
-            continue
-        comparison = sampling.get_comparison_from_element(el)
-        latest_label = el_labels[-1].label_value
+def _get_comparison_rows(label_session: LabelSession) -> List[ComparisonRow]:
+    """
+    Gets the image names, slice types (SliceType values), slice indices and outcome (None if it isn't labeled) of each
+    of a session's comparisons, first slice then second slice for each column. Labels other than First and Second count
+    as draws.
+    """
+    # Use the session's elements if they are already loaded, otherwise only query the columns which are needed instead
+    # of loading every element
+    session = object_session(label_session)
+    if session is None or 'elements' not in inspect(label_session).unloaded:
+        return [(el.image_1_name, el.image_2_name,
+                 SliceType[el.slice_1_type].value, SliceType[el.slice_2_type].value,
+                 el.slice_1_index, el.slice_2_index,
+                 None if el.current_label_value is None else LABEL_OUTCOMES.get(el.current_label_value, DRAW_OUTCOME))
+                for el in label_session.elements]
 
-        data1 = rank_data[comparison[0]]
-        data2 = rank_data[comparison[1]]
+    # Slice types and outcomes are converted to numbers by the query, so fewer and smaller values are fetched
+    elements = SessionElement.__table__.c
 
-        # total_count
-        data1[4] += 1
-        data2[4] += 1
+    def slice_type_value(column):
+        return case([(column == slice_type.name, slice_type.value) for slice_type in SliceType])
 
-        if latest_label == 'First':
-            data1[0] += 1  # score
-            data2[0] -= 1  # score
+    outcome = case([(elements.current_label_value.is_(None), null())] +
+                   [(elements.current_label_value == label, value) for label, value in LABEL_OUTCOMES.items()],
+                   else_=DRAW_OUTCOME)
+    query = select([elements.image_1_name, elements.image_2_name,
+                    slice_type_value(elements.slice_1_type), slice_type_value(elements.slice_2_type),
+                    elements.slice_1_index, elements.slice_2_index,
+                    outcome]) \
+        .where(elements.session_id == label_session.id) \
+        .order_by(elements.element_index, elements.id)  # Same order as by id, read from the element index's order
+    return session.execute(query).fetchall()
 
-            data1[1] += 1  # win_count
-            data2[2] += 1  # loss_count
-        elif latest_label == 'Second':
-            data2[0] += 1  # score
-            data1[0] -= 1  # score
 
-            data2[1] += 1  # win_count
-            data1[2] += 1  # loss_count
-        else:
-            data1[3] += 1  # draw_count
-            data2[3] += 1  # draw_count
+def get_comparison_arrays(label_session: LabelSession) -> ComparisonArrays:
+    """
+    Converts a session's comparisons to arrays, without a Python loop over its elements. Labels other than First and
+    Second count as draws.
+    """
+    rows = _get_comparison_rows(label_session)
+    image_names_1, image_names_2, slice_types_1, slice_types_2, slice_indices_1, slice_indices_2, outcomes = \
+        zip(*rows) if len(rows) > 0 else [()] * 7
 
-    return sorted(
-        [(sl, ComparisonRankResult(d[0], d[1], d[2], d[3], d[4])) for sl, d in rank_data.items()],
-        key=lambda t: t[1].score, reverse=True
+    # Number the images in order of appearance, then number the slices by their image, type and index combined into
+    # one integer, for both slices of every comparison at once
+    image_names = image_names_1 + image_names_2
+    image_ids = {name: i for i, name in enumerate(dict.fromkeys(image_names))}
+    slice_image_ids = np.fromiter(map(image_ids.__getitem__, image_names), dtype=np.int64, count=len(image_names))
+    slice_types = np.array(slice_types_1 + slice_types_2, dtype=np.int64)
+    slice_indices = np.array(slice_indices_1 + slice_indices_2, dtype=np.int64)
+
+    slice_shape = (len(image_ids), len(SliceType), np.max(slice_indices, initial=0) + 1)
+    slice_keys = np.ravel_multi_index((slice_image_ids, slice_types, slice_indices), slice_shape)
+    unique_slice_keys, slice_ids = np.unique(slice_keys, return_inverse=True)
+
+    unique_image_names = list(image_ids)
+    unique_slices = zip(*[a.tolist() for a in np.unravel_index(unique_slice_keys, slice_shape)])
+    slices = [ImageSlice(unique_image_names[image_id], slice_index, SliceType(slice_type))
+              for image_id, slice_type, slice_index in unique_slices]
+
+    # Same slice order as sampling.get_slices_from_session, so slices with equal scores are ranked the same way
+    order = sorted(range(len(slices)),
+                   key=lambda k: slices[k].image_name + slices[k].slice_type.name + str(slices[k].slice_index))
+    new_indices = np.empty(len(slices), dtype=np.int64)
+    new_indices[order] = np.arange(len(slices))
+
+    outcome = np.array(outcomes, dtype=np.float64)  # Unlabeled comparisons are NaN
+    labeled = ~np.isnan(outcome)
+    first, second = slice_ids[:len(rows)], slice_ids[len(rows):]
+
+    return ComparisonArrays(
+        [slices[k] for k in order],
+        new_indices[first[labeled]],
+        new_indices[second[labeled]],
+        outcome[labeled]
     )
+
+
+def _count_results(arrays: ComparisonArrays) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    n = len(arrays.slices)
+    first_won, second_won, draw = arrays.outcome == 1, arrays.outcome == 0, arrays.outcome == 0.5
+
+    wins = np.bincount(arrays.first[first_won], minlength=n) + np.bincount(arrays.second[second_won], minlength=n)
+    losses = np.bincount(arrays.first[second_won], minlength=n) + np.bincount(arrays.second[first_won], minlength=n)
+    draws = np.bincount(arrays.first[draw], minlength=n) + np.bincount(arrays.second[draw], minlength=n)
+    return wins, losses, draws
+
+
+def win_rate(wins: np.ndarray, losses: np.ndarray,
+             draws: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Gets the rate at which each slice wins its comparisons (draws count as half a win), with Wilson score intervals.
+    """
+    total = wins + losses + draws
+    n = np.maximum(total, 1)
+    rate = (wins + 0.5 * draws) / n
+
+    z2 = CONFIDENCE_Z ** 2
+    center = (rate + z2 / (2 * n)) / (1 + z2 / n)
+    half_width = CONFIDENCE_Z * np.sqrt(rate * (1 - rate) / n + z2 / (4 * n ** 2)) / (1 + z2 / n)
+
+    # Slices without comparisons could have any win rate
+    no_comparisons = total == 0
+    rate[no_comparisons] = 0.5
+    return rate, np.where(no_comparisons, 0, center - half_width), np.where(no_comparisons, 1, center + half_width)
+
+
+def bradley_terry(arrays: ComparisonArrays) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fits a Bradley-Terry model, in which slice i wins a comparison against slice j with probability
+    p_i / (p_i + p_j). Draws count as half a win for each slice. Strengths are fitted with the fixed-point iteration of
+    Newman (2023), which converges to the same maximum likelihood as the MM algorithm of Hunter (2004) in far fewer
+    iterations.
+
+    :return: The log-strength of each slice (with a mean of 0), and confidence intervals from the diagonal of the Fisher
+             information (which ignores the covariance between strengths, so the intervals are somewhat narrow).
+    """
+    n = len(arrays.slices)
+    a, b, outcome = arrays.first, arrays.second, arrays.outcome
+
+    strength = np.ones(n)
+    for _ in range(BRADLEY_TERRY_MAX_ITERATIONS):
+        inverse_sums = 1 / (strength[a] + strength[b])
+        prior = BRADLEY_TERRY_PRIOR / (strength + 1)
+
+        # Wins weighted by the probability of losing, over losses weighted by the inverse of the sum of strengths
+        numerator = np.bincount(a, weights=outcome * strength[b] * inverse_sums, minlength=n) + \
+            np.bincount(b, weights=(1 - outcome) * strength[a] * inverse_sums, minlength=n) + prior
+        denominator = np.bincount(a, weights=(1 - outcome) * inverse_sums, minlength=n) + \
+            np.bincount(b, weights=outcome * inverse_sums, minlength=n) + prior
+
+        new_strength = numerator / denominator
+
+        # Scaling every strength by the same factor doesn't change the likelihood of the comparisons, only the prior's,
+        # so take a Newton step of the common factor towards the prior's maximum. The step is 0 at the maximum
+        # likelihood, which it doesn't change, but it saves most of the iterations the prior alone would take to set the
+        # scale of the strengths. Steps are limited, as Newton's method can overshoot.
+        prior_slopes = np.tanh(np.log(new_strength) / 2)  # Slope of minus the prior with respect to each log-strength
+        log_scale = -np.sum(prior_slopes) / np.sum((1 - prior_slopes ** 2) / 2)
+        new_strength *= np.exp(np.clip(log_scale, -1, 1))
+
+        converged = np.max(np.abs(np.log(new_strength) - np.log(strength))) < BRADLEY_TERRY_TOLERANCE
+        strength = new_strength
+        if converged:
+            break
+
+    products = strength[a] * strength[b] / (strength[a] + strength[b]) ** 2
+    information = np.bincount(a, weights=products, minlength=n) + np.bincount(b, weights=products, minlength=n) + \
+        2 * BRADLEY_TERRY_PRIOR * strength / (strength + 1) ** 2
+    half_width = CONFIDENCE_Z / np.sqrt(information)
+
+    # Only centered once the strengths have converged, as the maximum likelihood isn't centered (the prior is centered
+    # on a strength of 1)
+    log_strength = np.log(strength)
+    log_strength -= np.mean(log_strength)
+    return log_strength, log_strength - half_width, log_strength + half_width
+
+
+def elo(arrays: ComparisonArrays) -> np.ndarray:
+    """
+    Gets the Elo rating of each slice after playing its comparisons in the order they were added. Unlike the other
+    methods, ratings depend on the order of the comparisons.
+    """
+    ratings = [ELO_INITIAL_RATING] * len(arrays.slices)
+    for i, j, outcome in zip(arrays.first.tolist(), arrays.second.tolist(), arrays.outcome.tolist()):
+        expected = 1 / (1 + 10 ** ((ratings[j] - ratings[i]) / 400))
+        ratings[i] += ELO_K * (outcome - expected)
+        ratings[j] -= ELO_K * (outcome - expected)
+    return np.array(ratings)
+
+
+def rank_slices(label_session: LabelSession,
+                method: RankingMethod = RankingMethod.SCORE) -> List[Tuple[ImageSlice, ComparisonRankResult]]:
+    assert label_session.session_type == LabelSessionType.COMPARISON_SLICE.name
+
+    arrays = get_comparison_arrays(label_session)
+    if len(arrays.slices) == 0:
+        return []
+    wins, losses, draws = _count_results(arrays)
+
+    ci_low, ci_high = None, None
+    if method == RankingMethod.SCORE:
+        scores = wins - losses
+    elif method == RankingMethod.WIN_RATE:
+        scores, ci_low, ci_high = win_rate(wins, losses, draws)
+    elif method == RankingMethod.BRADLEY_TERRY:
+        scores, ci_low, ci_high = bradley_terry(arrays)
+    elif method == RankingMethod.ELO:
+        scores = elo(arrays)
+    else:
+        raise ValueError('Invalid ranking method {}'.format(method))
+
+    order = np.argsort(-scores, kind='stable')
+    return [(arrays.slices[k], ComparisonRankResult(
+        scores[k].item(), int(wins[k]), int(losses[k]), int(draws[k]), int(wins[k] + losses[k] + draws[k]),
+        None if ci_low is None else ci_low[k].item(), None if ci_high is None else ci_high[k].item()
+    )) for k in order.tolist()]
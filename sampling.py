@@ -1,8 +1,6 @@
 import itertools
 import random
-from typing import List, Tuple, Optional
-
-import nibabel
+from typing import List, Tuple, Optional, Dict
 
 import backend
 from backend import Dataset, DataImage, ImageSlice, SliceType
@@ -46,23 +44,28 @@ def get_comparisons_from_session(label_session: LabelSession) -> List[Tuple[Imag
 
 
 def get_volume_width(image_path: str, slice_type: SliceType) -> int:
-    vol = nibabel.load(image_path)
-
     # Correct for orientation of volume without loading image data
-    orientations = [int(v[0]) for v in nibabel.io_orientation(vol.affine)]
-    dim = orientations.index(slice_type.value)
-
-    return vol.header.get_data_shape()[dim]
+    return backend.get_canonical_shape(image_path)[slice_type.value]
 
 
 def sample_slices(dataset: Dataset, slice_type: SliceType, image_count: int, slice_count: int,
-                  min_slice_percent: int, max_slice_percent: int) -> List[ImageSlice]:
+                  min_slice_percent: int, max_slice_percent: int,
+                  volume_widths: Dict[str, int] = None) -> List[ImageSlice]:
+    """
+    Samples slices from random images of a dataset, within a range of slice positions along the slice type's axis.
+
+    :param volume_widths: Number of slices of each image along the slice type's axis (e.g. from the catalog). Images
+                          which aren't included have their header read instead.
+    """
     images = random.sample(backend.get_images(dataset), image_count)
     slices: List[ImageSlice] = []
 
     for i in range(slice_count):
         im: DataImage = random.choice(images)
-        im_slice_max = get_volume_width(im.path, slice_type)
+        if volume_widths is not None and im.name in volume_widths:
+            im_slice_max = volume_widths[im.name]
+        else:
+            im_slice_max = get_volume_width(im.path, slice_type)  # Headers are cached, so repeated images are cheap
 
         slice_min = int(im_slice_max * (min_slice_percent / 100))
         slice_max = int(im_slice_max * (max_slice_percent / 100))
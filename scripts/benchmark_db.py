@@ -0,0 +1,156 @@
+"""Utility script to compare label database lookup latency with and without the lookup indexes."""
+import os
+import random
+import tempfile
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from typing import Callable, List
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import labels
+import migrations
+import sessions
+from backend import Dataset
+from model import db, LabelSession, SessionElement, ElementLabel
+from sessions import LabelSessionType
+
+BENCHMARK_INDEXES = [
+    'ix_label_sessions_dataset_type',
+    'ix_session_elements_session_element_index',
+    'ix_element_labels_element'
+]
+
+INSERT_CHUNK_SIZE = 50000
+
+
+def build_database(engine: Engine, dataset_count: int, session_count: int, elements_per_session: int,
+                   labels_per_element: int):
+    db.metadata.create_all(engine)
+    session_types = [st.name for st in LabelSessionType]
+
+    with engine.begin() as conn:
+        conn.execute(LabelSession.__table__.insert(), [{
+            'id': i + 1,
+            'dataset': 'dataset{}'.format(i % dataset_count),
+            'session_name': 'session{}'.format(i),
+            'session_type': session_types[i % len(session_types)],
+            'prompt': '',
+            'date_created': datetime.now(),
+            'label_values_str': 'l1,l2',
+            'element_count': elements_per_session,
+            'labeled_count': elements_per_session
+        } for i in range(session_count)])
+
+        element_rows = []
+        label_rows = []
+        for session_index in range(session_count):
+            for element_index in range(elements_per_session):
+                element_id = session_index * elements_per_session + element_index + 1
+                element_rows.append({
+                    'id': element_id,
+                    'session_id': session_index + 1,
+                    'element_index': element_index,
+                    'image_1_name': 'img{}.nii.gz'.format(element_index)
+                })
+                for _ in range(labels_per_element):
+                    label_rows.append({
+                        'element_id': element_id,
+                        'label_value': 'l1',
+                        'date_labeled': datetime.now(),
+                        'milliseconds': 0
+                    })
+
+        # Labels are inserted in random order, as they would be by labelers working on many sessions at once
+        random.shuffle(label_rows)
+        for rows, table in ((element_rows, SessionElement.__table__), (label_rows, ElementLabel.__table__)):
+            for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+                conn.execute(table.insert(), rows[i:i + INSERT_CHUNK_SIZE])
+
+
+def time_lookups(name: str, lookups: List[Callable], repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for lookup in lookups:
+            lookup()
+    elapsed = time.perf_counter() - start
+    print('{:<28} {:>12.1f}'.format(name, elapsed / (repeat * len(lookups)) * 10 ** 6))
+
+
+def benchmark_lookups(engine: Engine, dataset_count: int, session_count: int, elements_per_session: int,
+                      lookup_count: int, repeat: int):
+    session = Session(bind=engine)
+
+    label_sessions = [LabelSession(id=random.randrange(session_count) + 1) for _ in range(lookup_count)]
+    element_indices = [random.randrange(elements_per_session) for _ in range(lookup_count)]
+    element_ids = [random.randrange(session_count * elements_per_session) + 1 for _ in range(lookup_count)]
+    datasets = [Dataset('dataset{}'.format(random.randrange(dataset_count)), '') for _ in range(lookup_count)]
+
+    print('{:<28} {:>12}'.format('Lookup', 'us / lookup'))
+    time_lookups('get_element_by_index', [
+        lambda ls=ls, i=i: labels.get_element_by_index(session, ls, i)
+        for ls, i in zip(label_sessions, element_indices)
+    ], repeat)
+    time_lookups('get_sessions (by type)', [
+        lambda d=d: sessions.get_sessions(session, d, LabelSessionType.COMPARISON_SLICE)
+        for d in datasets
+    ], repeat)
+    time_lookups('labels by element_id', [
+        lambda el_id=el_id: session.query(ElementLabel).filter(ElementLabel.element_id == el_id).all()
+        for el_id in element_ids
+    ], repeat)
+
+    session.close()
+
+
+def print_query_plans(engine: Engine):
+    with engine.connect() as conn:
+        for query in ('SELECT * FROM session_elements WHERE session_id = 1 AND element_index = 1',
+                      "SELECT * FROM label_sessions WHERE dataset = 'dataset0' AND session_type = 'SORT_SLICE'",
+                      'SELECT * FROM element_labels WHERE element_id = 1'):
+            plan = conn.execute(text('EXPLAIN QUERY PLAN ' + query)).fetchall()
+            print('{}\n    {}'.format(query, '\n    '.join(row[-1] for row in plan)))
+
+
+def benchmark_db(dataset_count: int, session_count: int, elements_per_session: int, labels_per_element: int,
+                 lookup_count: int, repeat: int):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        engine = create_engine('sqlite:///' + os.path.join(temp_dir, 'benchmark.db'))
+
+        label_count = session_count * elements_per_session * labels_per_element
+        print('Building database with {} sessions, {} elements and {} labels...'.format(
+            session_count, session_count * elements_per_session, label_count))
+        build_database(engine, dataset_count, session_count, elements_per_session, labels_per_element)
+
+        with engine.begin() as conn:
+            for index_name in BENCHMARK_INDEXES:
+                conn.execute(text('DROP INDEX IF EXISTS {}'.format(index_name)))
+
+        print('\nWithout indexes')
+        print_query_plans(engine)
+        benchmark_lookups(engine, dataset_count, session_count, elements_per_session, lookup_count, repeat)
+
+        # Same path as an existing database being upgraded on startup
+        migrations.upgrade_database(engine)
+
+        print('\nWith indexes')
+        print_query_plans(engine)
+        benchmark_lookups(engine, dataset_count, session_count, elements_per_session, lookup_count, repeat)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--datasets', type=int, default=10)
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--elements-per-session', type=int, default=2500)
+    parser.add_argument('--labels-per-element', type=int, default=2, help='Default sizes give 1M labels')
+    parser.add_argument('--lookups', type=int, default=200, help='Number of distinct random lookups of each kind')
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    benchmark_db(args.datasets, args.sessions, args.elements_per_session, args.labels_per_element,
+                 args.lookups, args.repeat)
@@ -0,0 +1,86 @@
+"""Utility script to compare slice encoding time and payload size for each supported encoding."""
+import time
+from argparse import ArgumentParser
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+import backend
+import encoding
+from encoding import ImageFormat, SliceEncoding
+
+BENCHMARK_ENCODINGS = [
+    SliceEncoding(ImageFormat.PNG, compress_level=0),
+    SliceEncoding(ImageFormat.PNG, compress_level=1),
+    SliceEncoding(ImageFormat.PNG, compress_level=3),
+    SliceEncoding(ImageFormat.PNG, compress_level=6),
+    SliceEncoding(ImageFormat.PNG, compress_level=9),
+    SliceEncoding(ImageFormat.JPEG, quality=75),
+    SliceEncoding(ImageFormat.JPEG, quality=90),
+    SliceEncoding(ImageFormat.WEBP, quality=75),
+    SliceEncoding(ImageFormat.WEBP, quality=90),
+    SliceEncoding(ImageFormat.RAW)
+]
+
+
+def synthetic_slices(count: int, size: int) -> List[Image.Image]:
+    """Smooth blobs plus noise, which compresses roughly like an MRI slice (unlike pure noise)."""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:size, 0:size] / size
+
+    slices = []
+    for _ in range(count):
+        cx, cy, r = rng.uniform(0.3, 0.7), rng.uniform(0.3, 0.7), rng.uniform(0.2, 0.4)
+        blob = np.clip(1 - ((x - cx) ** 2 + (y - cy) ** 2) / r ** 2, 0, 1)
+        data = blob * 200 + rng.normal(0, 8, (size, size))
+        slices.append(Image.fromarray(np.clip(data, 0, 255).astype('uint8')))
+    return slices
+
+
+def dataset_slices(dataset_name: str, image_name: str, slice_type: backend.SliceType) -> List[Image.Image]:
+    d_img = backend.get_image(backend.get_dataset(dataset_name), image_name)
+    slice_counts, max_value = backend.get_image_info(d_img)
+
+    slice_count = slice_counts[slice_type.value]
+    return [backend.get_slice(d_img, i, slice_type, 0, max_value)
+            for i in range(slice_count // 4, slice_count * 3 // 4)]
+
+
+def benchmark_encodings(slices: List[Image.Image], repeat: int):
+    print('{:<24} {:>12} {:>14}'.format('Encoding', 'ms / slice', 'bytes / slice'))
+    for slice_encoding in BENCHMARK_ENCODINGS:
+        total_bytes = 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for img in slices:
+                total_bytes += len(encoding.encode_image(img, slice_encoding))
+        elapsed = time.perf_counter() - start
+
+        encode_count = repeat * len(slices)
+        if slice_encoding.image_format == ImageFormat.PNG:
+            name = 'PNG (level {})'.format(slice_encoding.compress_level)
+        elif slice_encoding.image_format == ImageFormat.RAW:
+            name = 'RAW'
+        else:
+            name = '{} (quality {})'.format(slice_encoding.image_format.name, slice_encoding.quality)
+
+        print('{:<24} {:>12.3f} {:>14.0f}'.format(name, elapsed / encode_count * 1000, total_bytes / encode_count))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--dataset', type=str, help='Benchmark slices from this dataset (default: synthetic slices)')
+    parser.add_argument('--image', type=str, help='Image within the dataset')
+    parser.add_argument('--slice-type', type=str, default='AXIAL', choices=[st.name for st in backend.SliceType])
+    parser.add_argument('--size', type=int, default=256, help='Size of synthetic slices')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.dataset is not None:
+        benchmark_slices = dataset_slices(args.dataset, args.image, backend.SliceType[args.slice_type])
+    else:
+        benchmark_slices = synthetic_slices(32, args.size)
+
+    benchmark_encodings(benchmark_slices, args.repeat)
@@ -0,0 +1,84 @@
+"""Utility script to benchmark ranking a large comparison session with each ranking method."""
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import ranking
+import sessions
+from model import db, LabelSession, SessionElement
+from sessions import LabelSessionType
+
+
+def create_session(session: Session, slice_count: int, comparison_count: int):
+    """
+    Creates a comparison session whose labels follow a Bradley-Terry model with random strengths.
+    """
+    rand = np.random.RandomState(0)
+    strengths = rand.normal(size=slice_count)
+    first = rand.randint(slice_count, size=comparison_count)
+    second = (first + rand.randint(1, slice_count, size=comparison_count)) % slice_count
+    first_wins = rand.random_sample(comparison_count) < 1 / (1 + np.exp(strengths[second] - strengths[first]))
+
+    session.execute(LabelSession.__table__.insert(), {
+        'id': 1,
+        'dataset': 'dataset',
+        'session_name': 'benchmark',
+        'session_type': LabelSessionType.COMPARISON_SLICE.name,
+        'prompt': '',
+        'date_created': datetime.now(),
+        'label_values_str': '',
+        'element_count': comparison_count
+    })
+    session.execute(SessionElement.__table__.insert(), [{
+        'session_id': 1,
+        'element_index': k,
+        'image_1_name': 'img{}.nii.gz'.format(i),
+        'slice_1_index': 0,
+        'slice_1_type': 'AXIAL',
+        'image_2_name': 'img{}.nii.gz'.format(j),
+        'slice_2_index': 0,
+        'slice_2_type': 'AXIAL',
+        'current_label_value': 'First' if won else 'Second'
+    } for k, (i, j, won) in enumerate(zip(first.tolist(), second.tolist(), first_wins.tolist()))])
+    session.commit()
+
+    return strengths
+
+
+def benchmark_ranking(slice_count: int, comparison_count: int):
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    session = Session(bind=engine)
+
+    strengths = create_session(session, slice_count, comparison_count)
+    true_order = np.argsort(-strengths)
+
+    print('{:>15} {:>10} {:>22}'.format('Method', 'Time (ms)', 'Rank correlation'))
+    for method in ranking.RankingMethod:
+        session.expire_all()
+        start = time.perf_counter()
+        ranked_slices = ranking.rank_slices(sessions.get_session_by_id(session, 1), method)
+        elapsed = time.perf_counter() - start
+
+        # Spearman correlation between the ranking and the order of the true strengths
+        ranks = np.empty(slice_count)
+        ranks[[int(sl.image_name[3:-7]) for sl, _ in ranked_slices]] = np.arange(slice_count)
+        correlation = np.corrcoef(ranks[true_order], np.arange(slice_count))[0, 1]
+
+        print('{:>15} {:>10.1f} {:>22.3f}'.format(method.name, elapsed * 1000, correlation))
+
+    session.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--slices', type=int, default=5000)
+    parser.add_argument('--comparisons', type=int, default=100000)
+    args = parser.parse_args()
+
+    benchmark_ranking(args.slices, args.comparisons)
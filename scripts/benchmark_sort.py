@@ -0,0 +1,163 @@
+"""Utility script to benchmark the latency of sort session pages, which find the next comparison to label."""
+import functools
+import random
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from typing import Any, List, Tuple
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import comparesort
+import labels
+import sessions
+from backend import ImageSlice, SliceType
+from model import db, LabelSession, SessionElement, ElementLabel
+from sessions import LabelSessionType
+
+
+class PendingComparison(Exception):
+    pass
+
+
+def simulate_comparisons(slices: List[ImageSlice], true_values: List[int]) -> List[Tuple[ImageSlice, ImageSlice, str]]:
+    """
+    Gets the comparisons (and their labels) made by sorting slices with labels which follow their true values.
+    """
+    values = dict(zip(slices, true_values))
+    comparisons = []
+    labeled = set()
+
+    def compare(sl1: ImageSlice, sl2: ImageSlice) -> int:
+        result = (values[sl1] > values[sl2]) - (values[sl1] < values[sl2])
+        if (sl1, sl2) not in labeled and (sl2, sl1) not in labeled:
+            labeled.add((sl1, sl2))
+            comparisons.append((sl1, sl2, {1: 'First', -1: 'Second', 0: 'No Difference'}[result]))
+        return result
+
+    sorted(slices, key=functools.cmp_to_key(compare))
+    return comparisons
+
+
+def create_session(session: Session, slices: List[ImageSlice],
+                   comparisons: List[Tuple[ImageSlice, ImageSlice, str]]):
+    session.execute(LabelSession.__table__.insert(), {
+        'id': 1,
+        'dataset': 'dataset',
+        'session_name': 'benchmark',
+        'session_type': LabelSessionType.SORT_SLICE.name,
+        'prompt': '',
+        'date_created': datetime.now(),
+        'label_values_str': sessions.SORT_LABEL_VALUES_STR,
+        'element_count': len(slices)
+    })
+    session.execute(SessionElement.__table__.insert(), [{
+        'session_id': 1,
+        'element_index': i,
+        'image_1_name': sl.image_name,
+        'slice_1_index': sl.slice_index,
+        'slice_1_type': sl.slice_type.name
+    } for i, sl in enumerate(slices)])
+    session.execute(SessionElement.__table__.insert(), [{
+        'id': len(slices) + i + 1,
+        'session_id': 1,
+        'element_index': i,
+        'image_1_name': sl1.image_name,
+        'slice_1_index': sl1.slice_index,
+        'slice_1_type': sl1.slice_type.name,
+        'image_2_name': sl2.image_name,
+        'slice_2_index': sl2.slice_index,
+        'slice_2_type': sl2.slice_type.name,
+        'current_label_id': i + 1,
+        'current_label_value': label
+    } for i, (sl1, sl2, label) in enumerate(comparisons)])
+    session.execute(ElementLabel.__table__.insert(), [{
+        'id': i + 1,
+        'element_id': len(slices) + i + 1,
+        'label_value': label,
+        'date_labeled': datetime.now(),
+        'milliseconds': 0
+    } for i, (_, _, label) in enumerate(comparisons)])
+    session.commit()
+
+
+def sort_from_scratch(label_session: LabelSession):
+    """
+    Finds the next comparison by sorting from scratch and scanning every comparison on each comparator call, as
+    add_next_comparison did before the comparison index.
+    """
+    comparison_elements = [el for el in label_session.elements if el.is_comparison()]
+
+    def compare(sl1: ImageSlice, sl2: ImageSlice) -> int:
+        for el in comparison_elements:
+            comparison = (ImageSlice(el.image_1_name, el.slice_1_index, SliceType[el.slice_1_type]),
+                          ImageSlice(el.image_2_name, el.slice_2_index, SliceType[el.slice_2_type]))
+            if sl1 == comparison[0] and sl2 == comparison[1]:
+                return {'First': 1, 'Second': -1, 'No Difference': 0}[el.current_label_value]
+            elif sl1 == comparison[1] and sl2 == comparison[0]:
+                return {'First': -1, 'Second': 1, 'No Difference': 0}[el.current_label_value]
+        raise PendingComparison()
+
+    slices = [ImageSlice(el.image_1_name, el.slice_1_index, SliceType[el.slice_1_type])
+              for el in label_session.elements if not el.is_comparison()]
+    try:
+        sorted(slices, key=functools.cmp_to_key(compare))
+    except PendingComparison:
+        pass
+
+
+def time_page(session: Session, page) -> Tuple[float, Any]:
+    session.expire_all()
+    start = time.perf_counter()
+    result = page(sessions.get_session_by_id(session, 1))
+    return (time.perf_counter() - start) * 1000, result
+
+
+def benchmark_sort(slice_count: int, max_scan_slice_count: int):
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    session = Session(bind=engine)
+
+    slices = [ImageSlice('img{}.nii.gz'.format(i), i % 200, SliceType.AXIAL) for i in range(slice_count)]
+    true_values = [random.randrange(slice_count // 2) for _ in slices]
+    comparisons = simulate_comparisons(slices, true_values)
+
+    # All comparisons but the last two are labeled, so the pages load the sort with nearly all of its comparisons
+    create_session(session, slices, comparisons[:-2])
+
+    def add_next_comparison(label_session: LabelSession):
+        return comparesort.add_next_comparison(session, label_session)
+
+    scan_ms = time_page(session, sort_from_scratch)[0] if slice_count <= max_scan_slice_count else None
+
+    # The session doesn't have a saved sort state yet, so the first page replays the sort
+    replay_ms, (_, comparison_el, _) = time_page(session, add_next_comparison)
+
+    # Labeling the comparison added by the previous page advances the saved sort state to the last comparison
+    labels.set_label(session, comparison_el, comparisons[-2][2], 0)
+    next_ms, (_, comparison_el, _) = time_page(session, add_next_comparison)
+
+    labels.set_label(session, comparison_el, comparisons[-1][2], 0)
+    complete_ms, (complete, _, _) = time_page(session, add_next_comparison)
+    assert complete
+
+    print('{:>7} {:>12} {:>16} {:>14.1f} {:>14.1f} {:>14.1f}'.format(
+        slice_count, len(comparisons), '-' if scan_ms is None else '{:.1f}'.format(scan_ms), replay_ms, next_ms,
+        complete_ms))
+
+    session.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--slices', type=str, default='200,1000,5000', help='Comma-separated session sizes')
+    parser.add_argument('--max-scan-slices', type=int, default=200,
+                        help='Largest session size to benchmark sorting from scratch with a scan of every comparison')
+    args = parser.parse_args()
+
+    print('{:>7} {:>12} {:>16} {:>14} {:>14} {:>14}'.format('Slices', 'Comparisons', 'Scan (ms)', 'Replay (ms)',
+                                                            'Next (ms)', 'Complete (ms)'))
+    for count in [int(s) for s in args.slices.split(',')]:
+        benchmark_sort(count, args.max_scan_slices)
@@ -1,58 +1,184 @@
 import os
+import zipfile
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+from typing import List, Tuple, Dict
+
+import numpy as np
 
 import backend
+import encoding
 import sampling
 import sessions
+import stats
+from encoding import ImageFormat, SliceEncoding
 from sessions import LabelSessionType
 from application import application
 from model import db
 
 EXPORTED_SLICES_DIR_PATH = 'exported_slices'
 
+# Image formats write one file per slice, npz writes one stack per image and orientation (with the slice indices)
+EXPORT_FORMATS = ['png', 'jpeg', 'webp', 'npz']
+
 
-def inc_dir_name(path: str) -> str:
+def inc_dir_name(path: str, extension: str = '') -> str:
     new_path = path
 
     i = 1
-    while os.path.exists(new_path):
+    while os.path.exists(new_path + extension):
         new_path = path + ' {}'.format(i)
         i += 1
 
-    return new_path
+    return new_path + extension
+
+
+def get_export_name(sl: backend.ImageSlice, export_format: str) -> str:
+    if export_format == 'npz':
+        return '{}_{}.npz'.format(sl.image_name, sl.slice_type.name)
+
+    extension = encoding.FORMAT_EXTENSIONS[ImageFormat[export_format.upper()]]
+    return '{}_{}_{}{}'.format(sl.image_name, sl.slice_type.name, sl.slice_index, extension)
+
+
+def render_slices(dataset: backend.Dataset, slices: List[backend.ImageSlice],
+                  export_format: str) -> Tuple[List[Tuple[str, bytes]], Dict[str, stats.VolumeStats]]:
+    """
+    Renders slices for export, one image at a time.
+
+    Stats missing from the dataset's stats index are computed but not saved, since workers would otherwise each
+    rewrite the index. They are returned for the caller to save once.
+
+    :return: A tuple containing a list of the name and contents of each exported file, and the stats computed for
+             images missing from the stats index (by image path).
+    """
+    index = backend.get_stats_index(dataset)
+
+    exported = []
+    computed_stats = {}
+    for d_img, image_slices in backend.group_slices_by_image(dataset, slices):
+        volume = backend.get_volume(d_img)
+        volume_stats = index.get(d_img.path)
+        if volume_stats is None:
+            volume_stats = stats.compute_stats(volume)
+            computed_stats[d_img.path] = volume_stats
+        image_max = int(volume_stats.max_value)
 
+        if export_format == 'npz':
+            slices_by_type: Dict[backend.SliceType, List[backend.ImageSlice]] = {}
+            for sl in sorted(image_slices, key=lambda s: s.slice_index):
+                slices_by_type.setdefault(sl.slice_type, []).append(sl)
 
-def export_slices(session_id: int):
+            for type_slices in slices_by_type.values():
+                type_images = [backend.get_slice(d_img, sl.slice_index, sl.slice_type, 0, image_max, volume=volume)
+                               for sl in type_slices]
+                stack = np.stack([np.asarray(img) for img in type_images])
+                bio = BytesIO()
+                np.savez_compressed(bio, slices=stack, slice_indices=np.array([sl.slice_index for sl in type_slices]))
+                exported.append((get_export_name(type_slices[0], export_format), bio.getvalue()))
+        else:
+            slice_encoding = SliceEncoding(ImageFormat[export_format.upper()])
+            for sl in image_slices:
+                sl_img = backend.get_slice(d_img, sl.slice_index, sl.slice_type, 0, image_max, volume=volume)
+                exported.append((get_export_name(sl, export_format), encoding.encode_image(sl_img, slice_encoding)))
+
+    return exported, computed_stats
+
+
+def export_slices(session_id: int, workers: int = 1, resume: bool = False, export_format: str = 'png',
+                  archive: bool = False):
     with application.app_context():
         label_session = sessions.get_session_by_id(db.session, session_id)
         if label_session is None:
             print('Session with id {} not found'.format(session_id))
             return
 
-        session_slices_dir_path = os.path.join(EXPORTED_SLICES_DIR_PATH, label_session.session_name + ' Slices')
-        session_slices_dir_path = inc_dir_name(session_slices_dir_path)
-
-        os.makedirs(session_slices_dir_path, exist_ok=True)
-
         slices = sampling.get_slices_from_session(label_session)
         dataset = backend.get_dataset(label_session.dataset)
-
-        for sl in slices:
-            d_img = backend.get_image(dataset, sl.image_name)
-            sl_max = backend.get_image_info(d_img)[1]
-            sl_img = backend.get_slice(d_img, sl.slice_index, sl.slice_type, 0, sl_max)
-
-            save_name = '{}_{}_{}.png'.format(sl.image_name, sl.slice_type.name, sl.slice_index)
-            save_path = os.path.join(session_slices_dir_path, save_name)
-
-            sl_img.save(save_path)
+        session_slices_path = os.path.join(EXPORTED_SLICES_DIR_PATH, label_session.session_name + ' Slices')
+
+    if archive:
+        archive_path = session_slices_path + '.zip'
+        if not resume:
+            archive_path = inc_dir_name(session_slices_path, '.zip')
+        os.makedirs(EXPORTED_SLICES_DIR_PATH, exist_ok=True)
+
+        # An export killed before closing its archive leaves it without a central directory. Appending to it would write
+        # a new archive after the unreadable one, so start it over instead.
+        if resume and os.path.exists(archive_path) and not zipfile.is_zipfile(archive_path):
+            print('Archive {} is incomplete, exporting all slices again'.format(archive_path))
+            resume = False
+
+        archive_file = zipfile.ZipFile(archive_path, 'a' if resume else 'w')
+        existing_names = set(archive_file.namelist())
+
+        def save(name: str, data: bytes):
+            archive_file.writestr(name, data)
+            print('Saved {} in {}'.format(name, archive_path))
+    else:
+        if not resume:
+            session_slices_path = inc_dir_name(session_slices_path)
+        os.makedirs(session_slices_path, exist_ok=True)
+
+        archive_file = None
+        existing_names = set(os.listdir(session_slices_path))
+
+        def save(name: str, data: bytes):
+            save_path = os.path.join(session_slices_path, name)
+
+            # Write to a temporary file first so an interrupted export never leaves a partial file to resume from
+            with open(save_path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(save_path + '.tmp', save_path)
             print('Saved {}'.format(save_path))
 
+    pending_slices = [sl for sl in slices if get_export_name(sl, export_format) not in existing_names]
+    if len(pending_slices) < len(slices):
+        print('Skipping {} slices which were already exported'.format(len(slices) - len(pending_slices)))
+
+    # Shard work by image, so each volume is only read by one worker
+    image_groups = [image_slices for _, image_slices in backend.group_slices_by_image(dataset, pending_slices)]
+
+    stats_index = backend.get_stats_index(dataset)
+    computed_stats_count = 0
+
+    def save_rendered(rendered: Tuple[List[Tuple[str, bytes]], Dict[str, stats.VolumeStats]]):
+        nonlocal computed_stats_count
+        exported, computed_stats = rendered
+        for name, data in exported:
+            save(name, data)
+        for image_path, volume_stats in computed_stats.items():
+            stats_index.put(image_path, volume_stats, save=False)
+        computed_stats_count += len(computed_stats)
+
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(render_slices, dataset, image_slices, export_format)
+                           for image_slices in image_groups]
+                for future in as_completed(futures):
+                    save_rendered(future.result())
+        else:
+            for image_slices in image_groups:
+                save_rendered(render_slices(dataset, image_slices, export_format))
+    finally:
+        if archive_file is not None:
+            archive_file.close()
+        if computed_stats_count > 0:
+            stats_index.save()
+
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('session_id', type=int)
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes rendering slices')
+    parser.add_argument('--resume', action='store_true',
+                        help='Add to the existing export of the session, skipping slices which were already exported')
+    parser.add_argument('--format', type=str, default='png', choices=EXPORT_FORMATS,
+                        help='Image format of exported slices, or npz for one stack per image and orientation')
+    parser.add_argument('--archive', action='store_true', help='Export to a single zip file instead of a directory')
 
     args = parser.parse_args()
 
-    export_slices(args.session_id)
+    export_slices(args.session_id, args.workers, args.resume, args.format, args.archive)
@@ -0,0 +1,117 @@
+"""Utility script to simulate concurrent labelers setting labels in one session of a label database."""
+import os
+import random
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from typing import List
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import labels
+import model
+from model import db, LabelSession, SessionElement
+from sessions import LabelSessionType
+
+LABEL_VALUES = ['yes', 'no']
+
+
+class LabelerResult:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.locked_errors = 0
+
+
+def create_session(engine: Engine, element_count: int) -> LabelSession:
+    db.metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        conn.execute(LabelSession.__table__.insert(), {
+            'id': 1,
+            'dataset': 'dataset',
+            'session_name': 'load test',
+            'session_type': LabelSessionType.CATEGORICAL_IMAGE.name,
+            'prompt': '',
+            'date_created': datetime.now(),
+            'label_values_str': ','.join(LABEL_VALUES),
+            'element_count': element_count
+        })
+        conn.execute(SessionElement.__table__.insert(), [{
+            'session_id': 1,
+            'element_index': i,
+            'image_1_name': 'img{}.nii.gz'.format(i)
+        } for i in range(element_count)])
+
+    return LabelSession(id=1, element_count=element_count)
+
+
+def run_labeler(engine: Engine, label_session: LabelSession, label_count: int, result: LabelerResult):
+    session = Session(bind=engine)
+
+    for _ in range(label_count):
+        start = time.perf_counter()
+        try:
+            # Same queries as loading the labeling page and posting to /api/set-label-value
+            element = labels.get_element_by_index(session, label_session,
+                                                  random.randrange(label_session.element_count))
+            labels.set_label(session, element, random.choice(LABEL_VALUES), random.randrange(5000))
+        except OperationalError as e:
+            session.rollback()
+            if 'locked' not in str(e):
+                raise
+            result.locked_errors += 1
+        else:
+            result.latencies.append(time.perf_counter() - start)
+
+    session.close()
+
+
+def load_test(engine: Engine, labelers: int, labels_per_labeler: int, element_count: int):
+    label_session = create_session(engine, element_count)
+
+    results = [LabelerResult() for _ in range(labelers)]
+    threads = [threading.Thread(target=run_labeler, args=(engine, label_session, labels_per_labeler, result))
+               for result in results]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for result in results for latency in result.latencies]) * 1000
+    print('Labels set: {}, "database is locked" errors: {}'.format(
+        len(latencies), sum(result.locked_errors for result in results)))
+    print('Throughput: {:.1f} labels/s'.format(len(latencies) / elapsed))
+    if len(latencies) > 0:
+        print('Latency: p50 {:.1f} ms, p95 {:.1f} ms, max {:.1f} ms'.format(
+            *np.percentile(latencies, [50, 95, 100])))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--labelers', type=int, default=16, help='Number of concurrent labelers')
+    parser.add_argument('--labels', type=int, default=200, help='Number of labels set by each labeler')
+    parser.add_argument('--elements', type=int, default=5000, help='Number of elements in the session')
+    parser.add_argument('--default-settings', action='store_true',
+                        help='Use SQLite\'s default journaling and one connection per session, as before tuning')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        url = 'sqlite:///' + os.path.join(temp_dir, 'load_test.db')
+        if args.default_settings:
+            test_engine = create_engine(url)
+        else:
+            test_engine = create_engine(url, **model.SQLITE_ENGINE_OPTIONS)
+            model.set_sqlite_pragmas(test_engine, model.SQLITE_PRAGMAS)
+
+        load_test(test_engine, args.labelers, args.labels, args.elements)
+        test_engine.dispose()
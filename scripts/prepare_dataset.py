@@ -0,0 +1,39 @@
+"""Utility script to convert a dataset to the prepared (uncompressed, memory-mapped) slice-store format."""
+from argparse import ArgumentParser
+
+import backend
+
+
+def prepare_dataset(dataset_name: str, per_axis: bool, force: bool):
+    dataset = backend.get_dataset(dataset_name)
+    if dataset is None:
+        print('Dataset {} not found'.format(dataset_name))
+        return
+
+    # Files each image needs: the full volume, and with per_axis a copy for every slice type
+    slice_types = [None] + (list(backend.SliceType) if per_axis else [])
+
+    prepared_count = 0
+    skip_count = 0
+    for d_img in backend.get_images(dataset):
+        if not force and all(backend.is_prepared(d_img, st) for st in slice_types):
+            skip_count += 1
+            continue
+
+        backend.prepare_image(d_img, per_axis=per_axis)
+        print('Prepared', backend.get_prepared_path(d_img))
+        prepared_count += 1
+
+    print('\nSuccessfully prepared {} images (skipped {} already prepared)'.format(prepared_count, skip_count))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('dataset_name', type=str)
+    parser.add_argument('--per-axis', action='store_true',
+                        help='Also store one copy per orientation so every slice is a contiguous read')
+    parser.add_argument('--force', action='store_true', help='Re-prepare images which are already up to date')
+    args = parser.parse_args()
+
+    prepare_dataset(args.dataset_name, args.per_axis, args.force)
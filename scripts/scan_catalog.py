@@ -0,0 +1,33 @@
+"""Utility script to sync the image catalog of one or all datasets with their files."""
+from argparse import ArgumentParser
+
+import backend
+import catalog
+from application import application
+from model import db
+
+
+def scan_catalog(dataset_name: str, compute_stats: bool):
+    with application.app_context():
+        if dataset_name is None:
+            catalog.scan_datasets(db.session, compute_stats)
+            return
+
+        dataset = backend.get_dataset(dataset_name)
+        if dataset is None:
+            print('Dataset {} not found'.format(dataset_name))
+            return
+
+        result = catalog.scan_dataset(db.session, dataset, compute_stats=compute_stats)
+        print('Cataloged dataset {} ({} added, {} updated, {} removed, {} unchanged)'.format(dataset.name, *result))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('dataset_name', type=str, nargs='?', help='Dataset to scan (default: all datasets)')
+    parser.add_argument('--stats', action='store_true',
+                        help='Compute stats of images without any, so their max value is cataloged')
+    args = parser.parse_args()
+
+    scan_catalog(args.dataset_name, args.stats)
@@ -0,0 +1,56 @@
+"""Utility script to simulate the number of comparisons labelers are asked for by each sort strategy."""
+import math
+import random
+from argparse import ArgumentParser
+from typing import List
+
+import numpy as np
+
+import comparesort
+from sessions import SortStrategy
+
+
+def count_comparisons(strategy: SortStrategy, values: List[int]) -> int:
+    """
+    Counts the comparisons a sort session asks labelers for when sorting items with the given true values. A pair
+    which was already compared is answered from the earlier label, so it isn't counted again.
+    """
+    compared = set()
+
+    def compare(i: int, j: int) -> int:
+        compared.add((min(i, j), max(i, j)))
+        return (values[i] > values[j]) - (values[i] < values[j])
+
+    comparesort.SORT_FUNCTIONS[strategy](list(range(len(values))), compare)
+    return len(compared)
+
+
+def simulate_sort(item_counts: List[int], trials: int, distinct_values: float):
+    print('{:>7} {:>13} {:>18} {:>14} {:>14}'.format('Items', 'Lower bound', 'Strategy', 'Mean', 'Max'))
+    for item_count in item_counts:
+        # Any comparison sort needs log2(n!) comparisons in the worst case
+        lower_bound = math.lgamma(item_count + 1) / math.log(2)
+        value_count = max(1, int(item_count * distinct_values))
+
+        counts = {strategy: [] for strategy in SortStrategy}
+        for _ in range(trials):
+            values = [random.randrange(value_count) for _ in range(item_count)]
+            for strategy in SortStrategy:
+                counts[strategy].append(count_comparisons(strategy, values))
+
+        for strategy in SortStrategy:
+            print('{:>7} {:>13.1f} {:>18} {:>14.1f} {:>14}'.format(
+                item_count, lower_bound, strategy.name, np.mean(counts[strategy]), np.max(counts[strategy])))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--items', type=str, default='10,50,200,1000', help='Comma-separated numbers of items')
+    parser.add_argument('--trials', type=int, default=20, help='Number of random orders sorted for each item count')
+    parser.add_argument('--distinct-values', type=float, default=1.0,
+                        help='Number of distinct true values as a fraction of the number of items (lower means more '
+                             'ties, which labelers answer with "No Difference")')
+    args = parser.parse_args()
+
+    simulate_sort([int(s) for s in args.items.split(',')], args.trials, args.distinct_values)
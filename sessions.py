@@ -4,7 +4,7 @@ from enum import Enum, auto
 from io import BytesIO, StringIO
 from typing import List, Tuple, Optional, Dict
 
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from werkzeug.datastructures import FileStorage
 
 import backend
@@ -19,8 +19,24 @@ class LabelSessionType(Enum):
     SORT_SLICE = auto()
 
 
-def get_session_by_id(session: Session, label_session_id: int) -> Optional[LabelSession]:
-    return session.query(LabelSession).filter(LabelSession.id == label_session_id).one_or_none()
+class SortStrategy(Enum):
+    TIMSORT = auto()  # Python's built-in sort, used by sort sessions created before sort strategies could be chosen
+    BINARY_INSERTION = auto()
+    MERGE_INSERTION = auto()  # Ford-Johnson
+    PARALLEL_MERGE = auto()  # Merge sort whose independent merges can be labeled by several labelers at once
+
+
+def get_session_by_id(session: Session, label_session_id: int, load_labels: bool = False) -> Optional[LabelSession]:
+    """
+    Gets a label session by its id.
+
+    :param load_labels: Load all of the session's elements and their labels up front (in two extra queries), instead
+                        of one query per element when they are accessed. Use this when walking every element.
+    """
+    query = session.query(LabelSession).filter(LabelSession.id == label_session_id)
+    if load_labels:
+        query = query.options(selectinload(LabelSession.elements).selectinload(SessionElement.labels))
+    return query.one_or_none()
 
 
 def get_sessions(session: Session, dataset: Dataset, session_type: LabelSessionType = None) -> List[LabelSession]:
@@ -119,7 +135,7 @@ SORT_LABEL_VALUES_STR = 'No Difference'
 
 
 def create_sort_slice_session(session: Session, name: str, prompt: str, dataset: Dataset,
-                              slices: List[ImageSlice]):
+                              slices: List[ImageSlice], sort_strategy: SortStrategy = SortStrategy.TIMSORT):
     label_session = LabelSession(
         dataset=dataset.name,
         session_name=name,
@@ -127,7 +143,8 @@ def create_sort_slice_session(session: Session, name: str, prompt: str, dataset:
         prompt=prompt,
         date_created=datetime.now(),
         label_values_str=SORT_LABEL_VALUES_STR,
-        element_count=len(slices)
+        element_count=len(slices),
+        sort_strategy=sort_strategy.name
     )
 
     session.add(label_session)
@@ -153,6 +170,8 @@ def export_session_json(label_session: LabelSession) -> Dict:
         'prompt': label_session.prompt,
         'label_values_str': label_session.label_values_str
     }
+    if label_session.sort_strategy is not None:
+        session_json['sort_strategy'] = label_session.sort_strategy
 
     def conv_str(val) -> str:
         if val is None:
@@ -196,9 +215,12 @@ def import_session_json(session: Session, dataset: Dataset, name: str, session_j
     session_type = LabelSessionType[session_json['session_type']]
     prompt = session_json['prompt']
     label_values_str = session_json['label_values_str']
+    sort_strategy = session_json.get('sort_strategy')
 
     assert type(prompt) is str
     assert type(label_values_str) is str
+    if sort_strategy is not None:
+        sort_strategy = SortStrategy[sort_strategy].name
 
     label_session = LabelSession(
         dataset=dataset.name,
@@ -207,7 +229,8 @@ def import_session_json(session: Session, dataset: Dataset, name: str, session_j
         prompt=prompt,
         date_created=datetime.now(),
         label_values_str=label_values_str,
-        element_count=len(session_json['elements'])
+        element_count=len(session_json['elements']),
+        sort_strategy=sort_strategy
     )
 
     session.add(label_session)
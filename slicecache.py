@@ -0,0 +1,174 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from cache import CacheStats, LRUCache
+
+RENDERED_CACHE_MAX_BYTES = 64 * 1024 ** 2  # 64 MiB
+
+RENDERED_DISK_CACHE_PATH = os.path.join('static', 'slice_cache')
+RENDERED_DISK_CACHE_MAX_BYTES = 0  # Disk tier is disabled unless given a size limit
+
+
+class SliceCacheBackend:
+    """
+    Interface for a store of rendered (encoded) slices, keyed by a string which uniquely identifies the slice's
+    contents (see application.slice_etag).
+    """
+    name = ''
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError()
+
+    def put(self, key: str, data: bytes):
+        raise NotImplementedError()
+
+    def stats(self) -> CacheStats:
+        raise NotImplementedError()
+
+
+class MemorySliceCache(SliceCacheBackend):
+    name = 'memory'
+
+    def __init__(self, max_bytes: int):
+        self._cache = LRUCache(max_bytes, size_fn=len)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._cache.peek(key)
+
+    def put(self, key: str, data: bytes):
+        self._cache.put(key, data)
+
+    def stats(self) -> CacheStats:
+        return self._cache.stats()
+
+
+class DiskSliceCache(SliceCacheBackend):
+    """
+    Stores rendered slices as files in a directory, evicting the least recently used files once their total size
+    exceeds max_bytes. Files already in the directory are picked up (oldest first) when the cache is created.
+    """
+    name = 'disk'
+
+    def __init__(self, dir_path: str, max_bytes: int):
+        self.dir_path = dir_path
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._sizes: 'OrderedDict[str, int]' = OrderedDict()
+        self._current_bytes = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        self._scan()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._sizes:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._sizes.move_to_end(key)
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:  # Evicted by another thread or deleted externally
+            with self._lock:
+                if key in self._sizes:
+                    self._remove(key)
+            return None
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temp_path = path + '.tmp.{}'.format(threading.get_ident())
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            if key in self._sizes:
+                self._remove(key)
+            self._sizes[key] = len(data)
+            self._current_bytes += len(data)
+
+            while self._current_bytes > self.max_bytes:
+                evict_key = next(iter(self._sizes))
+                self._remove(evict_key)
+                try:
+                    os.remove(self._path(evict_key))
+                except FileNotFoundError:
+                    pass
+                self._evictions += 1
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions,
+                              len(self._sizes), self._current_bytes, self.max_bytes)
+
+    def _path(self, key: str) -> str:
+        # Shard files into subdirectories so no single directory grows too large
+        return os.path.join(self.dir_path, key[:2], key)
+
+    def _remove(self, key: str):
+        self._current_bytes -= self._sizes.pop(key)
+
+    def _scan(self):
+        if not os.path.isdir(self.dir_path):
+            return
+
+        entries = []
+        for shard_name in os.listdir(self.dir_path):
+            shard_path = os.path.join(self.dir_path, shard_name)
+            if not os.path.isdir(shard_path):
+                continue
+            for key in os.listdir(shard_path):
+                if '.tmp' in key:
+                    continue
+                st = os.stat(os.path.join(shard_path, key))
+                entries.append((st.st_mtime, key, st.st_size))
+
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self._current_bytes += size
+
+
+class TieredSliceCache:
+    """
+    Looks up slices in each tier in order (e.g. memory, then disk), copying slices found in a slower tier into the
+    faster tiers before it. New slices are stored in every tier.
+    """
+
+    def __init__(self, tiers: List[SliceCacheBackend]):
+        self.tiers = tiers
+
+    def get(self, key: str) -> Optional[bytes]:
+        for i, tier in enumerate(self.tiers):
+            data = tier.get(key)
+            if data is not None:
+                for faster_tier in self.tiers[:i]:
+                    faster_tier.put(key, data)
+                return data
+        return None
+
+    def put(self, key: str, data: bytes):
+        for tier in self.tiers:
+            tier.put(key, data)
+
+    def tier_stats(self) -> Dict[str, CacheStats]:
+        return {tier.name: tier.stats() for tier in self.tiers}
+
+
+def create_slice_cache(memory_max_bytes: int, disk_path: Optional[str], disk_max_bytes: int) -> TieredSliceCache:
+    tiers: List[SliceCacheBackend] = [MemorySliceCache(memory_max_bytes)]
+    if disk_path is not None and disk_max_bytes > 0:
+        tiers.append(DiskSliceCache(disk_path, disk_max_bytes))
+    return TieredSliceCache(tiers)
@@ -14,6 +14,21 @@ function setCookie(key, value, maxAge) {
     document.cookie = key + '=' + value + ';path=/;max-age=' + maxAge.toString() + ';';
 }
 
+// Slice Loading
+
+// Slices updated during the same task are fetched together in one /thumbs request, unless only one slice changed.
+// Single slices are loaded from /thumb, which the browser can cache.
+let pendingSliceEls = new Set();
+let latestSliceBatch = new Map();
+let sliceBatchCount = 0;
+
+// Slices loaded by /thumbs (by /thumb URL), so their ETags can be sent with later batches
+const batchSlices = new Map();
+const BATCH_SLICES_MAX_COUNT = 32;
+
+// Functions which can draw a slice without a request (e.g. from a downloaded volume), returning true if they did
+const localSliceRenderers = [];
+
 // Time Tracking
 
 let startTime = Date.now();
@@ -81,16 +96,94 @@ async function setLabel(elementId, labelValue) {
 }
 
 function updateSlice(sliceEl) {
-    const datasetName = sliceEl.dataset.datasetName;
-    const imageName = sliceEl.dataset.imageName;
+    for (const renderLocalSlice of localSliceRenderers) {
+        if (renderLocalSlice(sliceEl)) {
+            pendingSliceEls.delete(sliceEl);
+            latestSliceBatch.delete(sliceEl);
+            return;
+        }
+    }
+
+    if (pendingSliceEls.size === 0) {
+        queueMicrotask(fetchPendingSlices);
+    }
+    pendingSliceEls.add(sliceEl);
+}
+
+function getSliceUrl(sliceEl) {
     const queryParams = {
         'slice_index': sliceEl.dataset.sliceIndex,
         'slice_type': sliceEl.dataset.sliceType,
         'min': Math.floor(parseFloat(sliceEl.dataset.intensityMin)),
-        'max': Math.floor(parseFloat(sliceEl.dataset.intensityMax))
+        'max': Math.floor(parseFloat(sliceEl.dataset.intensityMax)),
+        'level': parseInt(sliceEl.dataset.level || '0')
     };
+    return '/thumb/' + sliceEl.dataset.datasetName + '/' + sliceEl.dataset.imageName + '?' +
+        new URLSearchParams(queryParams).toString();
+}
+
+async function fetchPendingSlices() {
+    const sliceEls = Array.from(pendingSliceEls);
+    pendingSliceEls.clear();
+
+    const batchIndex = ++sliceBatchCount;
+    for (const sliceEl of sliceEls) {
+        latestSliceBatch.set(sliceEl, batchIndex);
+    }
 
-    sliceEl.src = '/thumb/' + datasetName + '/' + imageName + '?' + new URLSearchParams(queryParams).toString();
+    if (sliceEls.length === 1) {
+        sliceEls[0].src = getSliceUrl(sliceEls[0]);
+        return;
+    }
+
+    const sliceUrls = sliceEls.map(getSliceUrl);
+    const slicesJson = sliceEls.map((sliceEl, i) => ({
+        'dataset': sliceEl.dataset.datasetName,
+        'image': sliceEl.dataset.imageName,
+        'slice_index': sliceEl.dataset.sliceIndex,
+        'slice_type': sliceEl.dataset.sliceType,
+        'min': Math.floor(parseFloat(sliceEl.dataset.intensityMin)),
+        'max': Math.floor(parseFloat(sliceEl.dataset.intensityMax)),
+        'level': parseInt(sliceEl.dataset.level || '0'),
+        'etag': batchSlices.has(sliceUrls[i]) ? batchSlices.get(sliceUrls[i]).etag : null
+    }));
+    const rawResponse = await fetch('/thumbs', {
+        method: 'POST',
+        headers: {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({'slices': slicesJson})
+    });
+
+    if (!rawResponse.ok) {
+        console.log('Loading slices failed');
+        return;
+    }
+    const responseJson = await rawResponse.json();
+
+    sliceEls.forEach((sliceEl, i) => {
+        const sliceJson = responseJson['slices'][i];
+        let src;
+        if (sliceJson['not_modified'] && batchSlices.has(sliceUrls[i])) {
+            src = batchSlices.get(sliceUrls[i]).src;
+            batchSlices.delete(sliceUrls[i]);
+        } else if (sliceJson['not_modified']) {
+            // Evicted while the batch was loading
+            src = sliceUrls[i];
+        } else {
+            src = 'data:' + responseJson['mimetype'] + ';base64,' + sliceJson['data'];
+        }
+        batchSlices.set(sliceUrls[i], {'etag': sliceJson['etag'], 'src': src});
+        if (batchSlices.size > BATCH_SLICES_MAX_COUNT) {
+            batchSlices.delete(batchSlices.keys().next().value);
+        }
+
+        // Skip slices which were requested again while this batch was loading
+        if (latestSliceBatch.get(sliceEl) === batchIndex) {
+            sliceEl.src = src;
+        }
+    });
 }
 
 function setSliceOptions(sliceEl, sliceType, sliceIndex) {
@@ -0,0 +1,29 @@
+// Constants
+
+const THUMBNAIL_JOB_POLL_INTERVAL = 1000;
+
+const jobProgressEl = document.getElementById('thumbnail-job-progress');
+
+// Thumbnail Job Progress
+
+async function pollThumbnailJob() {
+    const rawResponse = await fetch(jobProgressEl.dataset.jobUrl);
+    if (!rawResponse.ok) {
+        console.log('Loading thumbnail job status failed');
+        return;
+    }
+
+    const jobJson = await rawResponse.json();
+    if (jobJson['status'] === 'RUNNING') {
+        jobProgressEl.innerText = 'Generating thumbnails (' + jobJson['slices_done'] + ' / ' + jobJson['slice_count'] + ')';
+        setTimeout(pollThumbnailJob, THUMBNAIL_JOB_POLL_INTERVAL);
+    }
+    else {
+        // Reload to show the new thumbnails (and the remaining missing count if the job failed)
+        window.location.reload();
+    }
+}
+
+if (jobProgressEl !== null) {
+    setTimeout(pollThumbnailJob, THUMBNAIL_JOB_POLL_INTERVAL);
+}
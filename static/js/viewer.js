@@ -20,6 +20,75 @@ const guideElements = [
 
 const currentSliceIndicator = document.getElementById('current-slice');
 
+// Local Slicing
+
+let localVolume = null;
+
+async function loadLocalVolume() {
+    const queryParams = {'downsample': volumeDownsample};
+    const rawResponse = await fetch('/volume/' + datasetName + '/' + imageName + '?' + new URLSearchParams(queryParams).toString());
+    if (!rawResponse.ok) {
+        console.log('Loading volume failed, using server-side slicing');
+        return;
+    }
+
+    localVolume = {
+        'data': new Uint8Array(await rawResponse.arrayBuffer()),
+        'shape': rawResponse.headers.get('X-Volume-Shape').split(',').map(v => parseInt(v)),
+        'max': parseFloat(rawResponse.headers.get('X-Volume-Max')),
+        'canvas': document.createElement('canvas')
+    };
+    localSliceRenderers.push(renderLocalSlice);
+    updateSlices();
+}
+
+function renderLocalSlice(sliceEl) {
+    if (sliceEl.dataset.datasetName !== datasetName || sliceEl.dataset.imageName !== imageName) {
+        return false;
+    }
+
+    const shape = localVolume.shape;
+    const axis = sliceTypeNames.indexOf(sliceEl.dataset.sliceType);
+    const index = Math.min(Math.floor(parseInt(sliceEl.dataset.sliceIndex) / volumeDownsample), shape[axis] - 1);
+
+    // Same intensity windowing as backend.get_slice, applied to the uint8 volume with a lookup table
+    const intensityMin = Math.floor(parseFloat(sliceEl.dataset.intensityMin));
+    const intensityMax = Math.floor(parseFloat(sliceEl.dataset.intensityMax));
+    const lut = new Uint8ClampedArray(256);
+    for (let v = 0; v < 256; v++) {
+        const intensity = Math.min(Math.max(v * localVolume.max / 255, intensityMin), intensityMax);
+        lut[v] = Math.floor((intensity / intensityMax) * 255);
+    }
+
+    // Slices are displayed transposed and flipped vertically (see backend.get_slice)
+    const [widthAxis, heightAxis] = [0, 1, 2].filter(a => a !== axis);
+    const width = shape[widthAxis];
+    const height = shape[heightAxis];
+    const strides = [shape[1] * shape[2], shape[2], 1];
+
+    const canvas = localVolume.canvas;
+    canvas.width = width;
+    canvas.height = height;
+    const ctx = canvas.getContext('2d');
+    const imageData = ctx.createImageData(width, height);
+
+    for (let row = 0; row < height; row++) {
+        const rowOffset = index * strides[axis] + (height - 1 - row) * strides[heightAxis];
+        for (let col = 0; col < width; col++) {
+            const v = lut[localVolume.data[rowOffset + col * strides[widthAxis]]];
+            const p = (row * width + col) * 4;
+            imageData.data[p] = v;
+            imageData.data[p + 1] = v;
+            imageData.data[p + 2] = v;
+            imageData.data[p + 3] = 255;
+        }
+    }
+
+    ctx.putImageData(imageData, 0, 0);
+    sliceEl.src = canvas.toDataURL();
+    return true;
+}
+
 // Viewer Functions
 
 function updateSlices() {
@@ -119,3 +188,7 @@ sliceTypeSelect.addEventListener('change', ev => {
 // Run on page load
 
 updateSlices();
+
+if (localSlicing) {
+    loadLocalVolume();
+}
@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+STATS_INDEX_VERSION = 1
+
+STATS_PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+STATS_HISTOGRAM_BINS = 64
+
+
+class VolumeStats(NamedTuple):
+    shape: Tuple[int, int, int]
+    min_value: float
+    max_value: float
+    percentiles: List[float]  # Values at each of STATS_PERCENTILES
+    histogram: List[int]  # Counts of STATS_HISTOGRAM_BINS equal-width bins between min_value and max_value
+
+
+def compute_stats(data: np.ndarray) -> VolumeStats:
+    min_value = float(np.min(data))
+    max_value = float(np.max(data))
+    percentiles = np.percentile(data, STATS_PERCENTILES)
+    histogram, _ = np.histogram(data, bins=STATS_HISTOGRAM_BINS, range=(min_value, max_value))
+
+    return VolumeStats((data.shape[0], data.shape[1], data.shape[2]), min_value, max_value,
+                       [float(p) for p in percentiles], [int(c) for c in histogram])
+
+
+class StatsIndex:
+    """
+    Persistent index of per-volume statistics stored in a JSON sidecar file.
+
+    Entries are keyed by image path and record the file's mtime and size, so they are ignored once the file changes.
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[str, Dict]] = None
+
+    def get(self, image_path: str) -> Optional[VolumeStats]:
+        st = os.stat(image_path)
+        with self._lock:
+            entry = self._load_entries().get(image_path)
+
+        if entry is None or entry['mtime_ns'] != st.st_mtime_ns or entry['size'] != st.st_size:
+            return None
+
+        s = entry['stats']
+        return VolumeStats(tuple(s['shape']), s['min_value'], s['max_value'], s['percentiles'], s['histogram'])
+
+    def put(self, image_path: str, volume_stats: VolumeStats, save: bool = True):
+        st = os.stat(image_path)
+        with self._lock:
+            self._load_entries()[image_path] = {
+                'mtime_ns': st.st_mtime_ns,
+                'size': st.st_size,
+                'stats': volume_stats._asdict()
+            }
+            if save:
+                self._save_entries()
+
+    def save(self):
+        with self._lock:
+            self._save_entries()
+
+    def _load_entries(self) -> Dict[str, Dict]:
+        if self._entries is None:
+            self._entries = {}
+            if os.path.exists(self.index_path):
+                with open(self.index_path) as f:
+                    index_json = json.load(f)
+                if index_json.get('version') == STATS_INDEX_VERSION:
+                    self._entries = index_json['images']
+        return self._entries
+
+    def _save_entries(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partially written index. The file is per process, as
+        # several app processes may save the same index.
+        temp_path = self.index_path + '.tmp.{}'.format(os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump({'version': STATS_INDEX_VERSION, 'images': self._entries}, f)
+        os.replace(temp_path, self.index_path)
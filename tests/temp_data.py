@@ -0,0 +1,25 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+
+def use_temp_data_paths(test_case: unittest.TestCase, *path_names: str) -> str:
+    """
+    Points data paths to directories in a temporary directory until a test ends, so tests can write real image files
+    (which memory-mapped and spawned-process code can read, unlike a fake filesystem).
+
+    :param path_names: Module attributes to patch in addition to backend.DATASETS_PATH and backend.STATS_PATH, e.g.
+                       'backend.PREPARED_PATH'. Each gets a directory named after the attribute.
+    :return: The temporary directory.
+    """
+    temp_dir = tempfile.TemporaryDirectory()
+    test_case.addCleanup(temp_dir.cleanup)
+
+    for path_name in ('backend.DATASETS_PATH', 'backend.STATS_PATH') + path_names:
+        dir_name = path_name.rsplit('.', 1)[1].lower()[:-len('_path')]
+        path_patch = patch(path_name, os.path.join(temp_dir.name, dir_name))
+        path_patch.start()
+        test_case.addCleanup(path_patch.stop)
+
+    return temp_dir.name
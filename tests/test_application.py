@@ -0,0 +1,215 @@
+import base64
+import importlib
+import os
+import tempfile
+import threading
+
+import nibabel
+import numpy as np
+from flask_testing import TestCase
+
+import backend
+
+VOLUME_CACHE_MAX_BYTES = 64 * 1024 ** 2
+RENDERED_CACHE_MAX_BYTES = 2 * 1024 ** 2
+RENDERED_DISK_CACHE_MAX_BYTES = 4 * 1024 ** 2
+THUMB_BATCH_WORKERS = 2
+
+temp_dir = None
+original_cwd = None
+application = None
+import_threads = None
+
+
+def setUpModule():
+    global temp_dir, original_cwd, application, import_threads
+
+    # Importing the app creates its database and data directories in the working directory
+    temp_dir = tempfile.TemporaryDirectory()
+    original_cwd = os.getcwd()
+    os.chdir(temp_dir.name)
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(temp_dir.name, 'label_database.db')
+    threads = set(threading.enumerate())
+    application = importlib.import_module('application')
+    import_threads = set(threading.enumerate()) - threads
+
+    # Set before the first request, like a deployment's own config would be
+    application.application.config['VOLUME_CACHE_MAX_BYTES'] = VOLUME_CACHE_MAX_BYTES
+    application.application.config['RENDERED_CACHE_MAX_BYTES'] = RENDERED_CACHE_MAX_BYTES
+    application.application.config['RENDERED_DISK_CACHE_MAX_BYTES'] = RENDERED_DISK_CACHE_MAX_BYTES
+    application.application.config['THUMB_BATCH_WORKERS'] = THUMB_BATCH_WORKERS
+    application.application.config['STATS_INDEX_BACKGROUND_BUILD'] = False
+    application.application.config['CATALOG_BACKGROUND_SCAN'] = False
+
+
+def tearDownModule():
+    if application.thumb_batch_executor is not None:
+        application.thumb_batch_executor.shutdown()
+    backend.volume_cache.max_bytes = backend.VOLUME_CACHE_MAX_BYTES
+    backend.volume_dtype = backend.VOLUME_DTYPE
+    with application.application.app_context():
+        application.db.session.remove()
+        application.db.engine.dispose()
+
+    del os.environ['SQLALCHEMY_DATABASE_URI']
+    os.chdir(original_cwd)
+    temp_dir.cleanup()
+
+
+class TestApplication(TestCase):
+    def create_app(self):
+        application.application.config['TESTING'] = True
+        return application.application
+
+    def setUp(self):
+        backend.volume_cache.clear()
+        backend.dataset_indexes.clear()
+
+        for image_name in ('img1.nii.gz', 'img2.nii.gz'):
+            self.save_image(image_name, np.arange(4 * 5 * 6, dtype=np.uint8).reshape((4, 5, 6)))
+
+    def tearDown(self):
+        backend.volume_cache.clear()
+
+    def save_image(self, image_name: str, data: np.ndarray):
+        image_path = os.path.join(backend.DATASETS_PATH, 'dataset1', image_name)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        nibabel.save(nibabel.Nifti1Image(data, np.eye(4)), image_path)
+
+    def test_config_applied_on_first_request(self):
+        self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=1&max=100')
+        self.assertEqual(backend.volume_cache.max_bytes, VOLUME_CACHE_MAX_BYTES)
+
+    def test_slice_cache_config_applied(self):
+        cache_stats = self.client.get('/api/cache-stats').json['rendered_slices']
+        self.assertEqual(cache_stats['memory']['max_bytes'], RENDERED_CACHE_MAX_BYTES)
+        self.assertEqual(cache_stats['disk']['max_bytes'], RENDERED_DISK_CACHE_MAX_BYTES)
+
+    def test_thumb_batch_workers_config_applied(self):
+        self.client.get('/')
+        self.assertEqual(application.thumb_batch_executor._max_workers, THUMB_BATCH_WORKERS)
+
+    def test_import_starts_no_threads(self):
+        self.assertEqual(import_threads, set())
+
+    def test_thumb_not_modified(self):
+        response = self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=1&max=100')
+        self.assert200(response)
+        etag = response.headers['ETag']
+
+        response = self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=1&max=100',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        # Other slices of the same image don't match
+        response = self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=2&max=100',
+                                   headers={'If-None-Match': etag})
+        self.assert200(response)
+
+    def test_thumb_etag_changes_with_image(self):
+        response = self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=1&max=100')
+        etag, data = response.headers['ETag'], response.data
+
+        self.save_image('img1.nii.gz', np.full((4, 5, 6), 7, dtype=np.uint8))
+        os.utime(os.path.join(backend.DATASETS_PATH, 'dataset1', 'img1.nii.gz'), ns=(0, 0))
+
+        response = self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=1&max=100',
+                                   headers={'If-None-Match': etag})
+        self.assert200(response)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertNotEqual(response.data, data)  # Not rendered from the volume cached before the change
+
+    def test_thumb_format(self):
+        response = self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=1&max=100&format=jpeg')
+        self.assert200(response)
+        self.assertEqual(response.mimetype, 'image/jpeg')
+
+        self.assert400(self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=1&max=100&format=bmp'))
+        for query_string in ('compress_level=50', 'compress_level=-5', 'format=webp&quality=-3',
+                             'format=jpeg&quality=101', 'quality=high'):
+            response = self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=1&max=100&' + query_string)
+            self.assert400(response, query_string)
+
+        def get_etag(query_string: str) -> str:
+            return self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=1&max=100&' + query_string).headers['ETag']
+
+        # Settings which don't apply to the format don't change the ETag
+        self.assertEqual(get_etag(''), get_etag('quality=10'))
+        self.assertEqual(get_etag('format=jpeg'), get_etag('format=jpeg&compress_level=1'))
+        self.assertEqual(get_etag('format=webp&quality=80'), get_etag('format=webp&quality=80&compress_level=9'))
+        self.assertNotEqual(get_etag('format=jpeg'), get_etag('format=jpeg&quality=10'))
+
+    def test_thumbs_batch(self):
+        slices_json = [
+            {'dataset': 'dataset1', 'image': 'img1.nii.gz', 'slice_index': 1, 'slice_type': 'AXIAL', 'max': 100},
+            {'dataset': 'dataset1', 'image': 'img2.nii.gz', 'slice_index': 2, 'slice_type': 'CORONAL', 'max': 100},
+            {'dataset': 'dataset1', 'image': 'img1.nii.gz', 'slice_index': '3', 'slice_type': 'SAGITTAL', 'max': 100,
+             'level': 1}
+        ]
+        response = self.client.post('/thumbs', json={'slices': slices_json})
+        self.assert200(response)
+        self.assertEqual(response.json['mimetype'], 'image/png')
+
+        # Same slices and ETags as /thumb, in the order they were requested
+        for slice_json, result_json in zip(slices_json, response.json['slices']):
+            thumb_response = self.client.get('/thumb/{}/{}'.format(slice_json['dataset'], slice_json['image']),
+                                             query_string={k: v for k, v in slice_json.items()
+                                                           if k not in ('dataset', 'image')})
+            self.assertFalse(result_json['not_modified'])
+            self.assertEqual(result_json['etag'], thumb_response.headers['ETag'].strip('"'))
+            self.assertEqual(base64.b64decode(result_json['data']), thumb_response.data)
+
+    def test_thumbs_batch_not_modified(self):
+        slices_json = [
+            {'dataset': 'dataset1', 'image': 'img1.nii.gz', 'slice_index': 1, 'max': 100},
+            {'dataset': 'dataset1', 'image': 'img2.nii.gz', 'slice_index': 1, 'max': 100}
+        ]
+        etag = self.client.post('/thumbs', json={'slices': slices_json}).json['slices'][0]['etag']
+
+        slices_json[0]['etag'] = etag
+        slices_json[1]['etag'] = 'other'
+        results_json = self.client.post('/thumbs', json={'slices': slices_json}).json['slices']
+        self.assertEqual(results_json[0], {'etag': etag, 'not_modified': True})
+        self.assertFalse(results_json[1]['not_modified'])
+        self.assertIn('data', results_json[1])
+
+    def test_thumbs_batch_invalid(self):
+        valid_json = {'dataset': 'dataset1', 'image': 'img1.nii.gz', 'slice_index': 1, 'max': 100}
+        for invalid_json in ({'dataset': 'dataset2'},
+                             {'image': 'img3.nii.gz'},
+                             {'slice_index': 6},
+                             {'slice_index': -1},
+                             {'slice_index': 'one'},
+                             {'slice_type': 'OBLIQUE'}):
+            response = self.client.post('/thumbs', json={'slices': [valid_json, dict(valid_json, **invalid_json)]})
+            self.assert400(response, invalid_json)
+
+        self.assert400(self.client.post('/thumbs', json={'slices': None}))
+
+    def test_viewer_local_slicing_opt_in(self):
+        response = self.client.get('/viewer?dataset=dataset1&image=img1.nii.gz')
+        self.assert200(response)
+        self.assertIn(b'const localSlicing = false;', response.data)
+
+        response = self.client.get('/viewer?dataset=dataset1&image=img1.nii.gz&local=1')
+        self.assertIn(b'const localSlicing = true;', response.data)
+
+    def test_thumb_slice_index(self):
+        self.assert200(self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=5&slice_type=AXIAL&max=100'))
+        for query_string in ('slice_index=6', 'slice_index=100', 'slice_index=-1', 'slice_index=one',
+                             'slice_index=4&slice_type=SAGITTAL', 'slice_type=OBLIQUE'):
+            response = self.client.get('/thumb/dataset1/img1.nii.gz?max=100&' + query_string)
+            self.assert400(response, query_string)
+
+    def test_thumb_level(self):
+        response = self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=1&max=100&format=raw&size=2')
+        self.assert200(response)
+        self.assertEqual((response.headers['X-Slice-Width'], response.headers['X-Slice-Height']), ('2', '2'))
+
+        for query_string in ('size=large', 'level=1.5'):
+            response = self.client.get('/thumb/dataset1/img1.nii.gz?slice_index=1&max=100&' + query_string)
+            self.assert400(response, query_string)
+
+        slice_json = {'dataset': 'dataset1', 'image': 'img1.nii.gz', 'slice_index': 1, 'max': 100, 'level': 'low'}
+        self.assert400(self.client.post('/thumbs', json={'slices': [slice_json, slice_json]}))
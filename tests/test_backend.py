@@ -1,8 +1,15 @@
 import os
+import unittest
+from unittest.mock import patch
 
+import nibabel
+import numpy as np
 from pyfakefs.fake_filesystem_unittest import TestCase
 
 import backend
+from cache import LRUCache
+from stats import StatsIndex
+from temp_data import use_temp_data_paths
 
 
 class TestDatasets(TestCase):
@@ -21,6 +28,8 @@ class TestDatasets(TestCase):
         self.fs.create_dir(os.path.join(backend.DATASETS_PATH, 'dataset2'))
         self.fs.create_dir(os.path.join(backend.DATASETS_PATH, 'dataset3'))
 
+        backend.dataset_indexes.clear()
+
     def test_get_datasets_length(self):
         datasets = backend.get_datasets()
         num_datasets = len(datasets)
@@ -63,6 +72,22 @@ class TestDatasets(TestCase):
         self.assertFalse(backend.is_image_path(os.path.join(dataset_path, 'abc.jpg')))
         self.assertFalse(backend.is_image_path(os.path.join(dataset_path, '.dotfile')))
 
+    @patch('backend.DATASET_INDEX_MTIME_RESOLUTION_NS', 0)
+    def test_dataset_index_incremental(self):
+        dataset = backend.get_dataset('dataset1')
+        backend.get_images(dataset)
+
+        with patch('backend.is_image_path', wraps=backend.is_image_path) as is_image_path:
+            self.assertEqual(len(backend.get_images(dataset)), 3)
+            is_image_path.assert_not_called()
+
+            new_path = os.path.join(dataset.path, 'img4.nii')
+            self.fs.create_file(new_path)
+            os.utime(dataset.path, ns=(0, 0))
+
+            self.assertEqual(len(backend.get_images(dataset)), 4)
+            is_image_path.assert_called_once_with(new_path)
+
     def test_get_images_length(self):
         dataset = backend.get_dataset('dataset1')
         images = backend.get_images(dataset)
@@ -171,3 +196,176 @@ class TestDatasetsEmpty(TestCase):
         num_datasets = len(datasets)
 
         self.assertEqual(num_datasets, 0)
+
+
+class TestSlices(unittest.TestCase):
+    def setUp(self):
+        use_temp_data_paths(self, 'backend.PREPARED_PATH')
+        backend.volume_cache.clear()
+
+        dataset_path = os.path.join(backend.DATASETS_PATH, 'dataset1')
+        os.makedirs(dataset_path)
+
+        self.data = np.arange(4 * 5 * 6, dtype=np.uint8).reshape((4, 5, 6))
+        nibabel.save(nibabel.Nifti1Image(self.data, np.eye(4)), os.path.join(dataset_path, 'img1.nii.gz'))
+
+        self.image = backend.get_image(backend.get_dataset('dataset1'), 'img1.nii.gz')
+
+    def tearDown(self):
+        backend.volume_cache.clear()
+        backend.volume_dtype = backend.VOLUME_DTYPE
+
+    def test_get_image_info(self):
+        shape, max_value = backend.get_image_info(self.image)
+
+        self.assertEqual(shape, (4, 5, 6))
+        self.assertEqual(max_value, 119)
+
+    def test_volume_cached_in_native_dtype(self):
+        backend.get_image_info(self.image)
+        cached = backend.volume_cache.peek(('dataset1', 'img1.nii.gz'))
+
+        self.assertEqual(cached.dtype, np.uint8)
+
+    def test_get_slice_matches_float64_volume(self):
+        native_slices = [np.asarray(backend.get_slice(self.image, 2, st, 0, 119)) for st in backend.SliceType]
+
+        backend.volume_cache.clear()
+        backend.volume_dtype = 'float64'
+        float_slices = [np.asarray(backend.get_slice(self.image, 2, st, 0, 119)) for st in backend.SliceType]
+
+        for native_slice, float_slice in zip(native_slices, float_slices):
+            np.testing.assert_array_equal(native_slice, float_slice)
+
+    def test_get_slice_shape(self):
+        img = backend.get_slice(self.image, 1, backend.SliceType.AXIAL, 0, 119)
+
+        # Slices are transposed for display (width is the first axis of the volume)
+        self.assertEqual(img.size, (4, 5))
+
+    def test_get_image_stats(self):
+        volume_stats = backend.get_image_stats(self.image)
+
+        self.assertEqual(volume_stats.shape, (4, 5, 6))
+        self.assertEqual(volume_stats.min_value, 0)
+        self.assertEqual(volume_stats.max_value, 119)
+        self.assertEqual(sum(volume_stats.histogram), 4 * 5 * 6)
+
+    def test_image_stats_persisted(self):
+        backend.get_image_stats(self.image)
+        index = StatsIndex(backend.get_stats_index(self.image.dataset).index_path)
+
+        self.assertEqual(index.get(self.image.path).max_value, 119)
+
+    def test_image_stats_invalidated_on_change(self):
+        backend.get_image_stats(self.image)
+
+        new_data = np.full((4, 5, 6), 7, dtype=np.uint8)
+        nibabel.save(nibabel.Nifti1Image(new_data, np.eye(4)), self.image.path)
+        os.utime(self.image.path, ns=(0, 0))
+        backend.volume_cache.clear()
+
+        self.assertEqual(backend.get_image_info(self.image)[1], 7)
+
+    def test_build_stats_index(self):
+        backend.build_stats_index(self.image.dataset)
+
+        self.assertIsNotNone(backend.get_stats_index(self.image.dataset).get(self.image.path))
+
+    def test_build_stats_index_skips_unreadable(self):
+        unreadable_path = os.path.join(self.image.dataset.path, 'img0.nii.gz')
+        with open(unreadable_path, 'wb') as f:
+            f.write(b'not an image')
+
+        backend.build_stats_index(self.image.dataset)
+
+        index = backend.get_stats_index(self.image.dataset)
+        self.assertIsNone(index.get(unreadable_path))
+        self.assertIsNotNone(index.get(self.image.path))
+
+    def test_prepare_image(self):
+        backend.prepare_image(self.image)
+
+        self.assertTrue(backend.is_prepared(self.image))
+        self.assertFalse(backend.is_prepared(self.image, backend.SliceType.AXIAL))
+
+    def test_prepared_slices_match(self):
+        for per_axis in (False, True):
+            backend.prepare_image(self.image, per_axis=per_axis)
+            for st in backend.SliceType:
+                prepared_slice = np.asarray(backend.get_slice(self.image, 2, st, 0, 119))
+                volume_slice = np.flip(np.take(self.data, 2, axis=st.value).T, axis=0)
+                np.testing.assert_array_equal(prepared_slice, (volume_slice / 119 * 255).astype('uint8'))
+
+    def test_get_volume_uint8(self):
+        volume, max_value = backend.get_volume_uint8(self.image)
+
+        self.assertEqual(volume.dtype, np.uint8)
+        self.assertEqual(volume.shape, (4, 5, 6))
+        self.assertEqual(max_value, 119)
+        self.assertEqual(volume.max(), 255)
+
+    def test_get_volume_uint8_downsample(self):
+        volume, _ = backend.get_volume_uint8(self.image, downsample=2)
+
+        self.assertEqual(volume.shape, (2, 3, 3))
+
+    def test_get_slice_pyramid_level(self):
+        img = backend.get_slice(self.image, 2, backend.SliceType.AXIAL, 0, 119, level=1)
+
+        self.assertEqual(img.size, backend.get_slice_size(self.image, backend.SliceType.AXIAL, level=1))
+        self.assertEqual(img.size, (2, 2))
+
+        level_1 = backend.volume_cache.peek(('dataset1', 'img1.nii.gz', 1))
+        self.assertEqual(level_1.shape, (2, 2, 3))
+        self.assertEqual(level_1[0, 0, 0], self.data[:2, :2, :2].mean().astype(np.uint8))
+
+    def test_get_slice_index_bounds(self):
+        # The last coronal slice is dropped from level 1 (5 slices downsample to 2), so it maps to the last slice left
+        img = backend.get_slice(self.image, 4, backend.SliceType.CORONAL, 0, 119, level=1)
+        self.assertEqual(img.size, backend.get_slice_size(self.image, backend.SliceType.CORONAL, level=1))
+
+        with self.assertRaises(IndexError):
+            backend.get_slice(self.image, 5, backend.SliceType.CORONAL, 0, 119)
+
+    def test_get_pyramid_level(self):
+        self.assertEqual(backend.get_pyramid_level(self.image, backend.SliceType.AXIAL, 5), 0)
+        self.assertEqual(backend.get_pyramid_level(self.image, backend.SliceType.AXIAL, 2), 1)
+        self.assertEqual(backend.get_pyramid_level(self.image, backend.SliceType.AXIAL, 1), 2)
+
+    def test_group_slices_by_image(self):
+        slices = [backend.ImageSlice('img1.nii.gz', i, st) for st in backend.SliceType for i in range(3)]
+
+        self.assertEqual(backend.group_slices_by_image(self.image.dataset, slices), [(self.image, slices)])
+
+    def test_get_slice_from_volume(self):
+        slice_args = [(st, level) for st in backend.SliceType for level in (0, 1)]
+
+        # Too small to cache the volume, so it is only kept by the caller
+        with patch('backend.volume_cache', LRUCache(1)), \
+                patch('backend._read_volume', wraps=backend._read_volume) as read_volume:
+            volume = backend.get_volume(self.image)
+            volume_slices = [backend.get_slice(self.image, 2, st, 0, 119, level=level, volume=volume)
+                             for st, level in slice_args]
+
+        self.assertEqual(read_volume.call_count, 1)
+        self.assertEqual(volume_slices, [backend.get_slice(self.image, 2, st, 0, 119, level=level)
+                                         for st, level in slice_args])
+
+    def test_get_canonical_shape(self):
+        self.assertEqual(backend.get_canonical_shape(self.image.path), (4, 5, 6))
+
+        # Swapping the first two axes on disk is undone by the orientation
+        affine = np.array([[0, 1, 0, 0], [1, 0, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]])
+        nibabel.save(nibabel.Nifti1Image(self.data.transpose((1, 0, 2)), affine), self.image.path)
+        os.utime(self.image.path, ns=(0, 0))
+
+        self.assertEqual(backend.get_canonical_shape(self.image.path), (4, 5, 6))
+        self.assertEqual(backend.get_volume_header(self.image.path).shape, (5, 4, 6))
+
+    def test_volume_header_cached(self):
+        backend.get_volume_header(self.image.path)
+        with patch('nibabel.load') as load:
+            backend.get_volume_header(self.image.path)
+
+        load.assert_not_called()
@@ -0,0 +1,79 @@
+import threading
+import time
+from unittest import TestCase
+
+import numpy as np
+
+from cache import LRUCache
+
+
+class TestLRUCache(TestCase):
+    def test_get_loads_once(self):
+        cache = LRUCache(1000)
+        calls = []
+
+        def load():
+            calls.append(1)
+            return np.zeros(10, dtype=np.uint8)
+
+        cache.get('a', load)
+        cache.get('a', load)
+
+        self.assertEqual(len(calls), 1)
+
+    def test_stats_hits_misses(self):
+        cache = LRUCache(1000)
+        cache.get('a', lambda: np.zeros(10, dtype=np.uint8))
+        cache.get('a', lambda: np.zeros(10, dtype=np.uint8))
+        cache.get('b', lambda: np.zeros(10, dtype=np.uint8))
+
+        stats = cache.stats()
+        self.assertEqual(stats.hits, 1)
+        self.assertEqual(stats.misses, 2)
+        self.assertEqual(stats.entry_count, 2)
+        self.assertEqual(stats.current_bytes, 20)
+
+    def test_evicts_by_bytes(self):
+        cache = LRUCache(25)
+        cache.get('a', lambda: np.zeros(10, dtype=np.uint8))
+        cache.get('b', lambda: np.zeros(10, dtype=np.uint8))
+        cache.get('c', lambda: np.zeros(10, dtype=np.uint8))
+
+        self.assertNotIn('a', cache)
+        self.assertIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(cache.stats().evictions, 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(25)
+        cache.get('a', lambda: np.zeros(10, dtype=np.uint8))
+        cache.get('b', lambda: np.zeros(10, dtype=np.uint8))
+        cache.get('a', lambda: np.zeros(10, dtype=np.uint8))  # Touch a so b becomes least recently used
+        cache.get('c', lambda: np.zeros(10, dtype=np.uint8))
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+
+    def test_oversized_value_not_cached(self):
+        cache = LRUCache(5)
+        value = cache.get('a', lambda: np.zeros(10, dtype=np.uint8))
+
+        self.assertEqual(len(value), 10)
+        self.assertNotIn('a', cache)
+
+    def test_concurrent_get_loads_once(self):
+        cache = LRUCache(1000)
+        calls = []
+
+        def load():
+            calls.append(1)
+            time.sleep(0.05)
+            return np.zeros(10, dtype=np.uint8)
+
+        threads = [threading.Thread(target=cache.get, args=('a', load)) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
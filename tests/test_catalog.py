@@ -0,0 +1,104 @@
+import os
+
+import nibabel
+import numpy as np
+from flask import Flask
+from flask_testing import TestCase
+
+import backend
+import catalog
+from backend import SliceType
+from model import db, CatalogImage
+from temp_data import use_temp_data_paths
+
+
+class TestCatalog(TestCase):
+    def create_app(self):
+        application = Flask(__name__)
+        application.config['TESTING'] = True
+
+        # Empty SQLite URI points to in-memory database
+        application.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        application.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(application)
+
+        return application
+
+    def setUp(self):
+        db.create_all()
+
+        use_temp_data_paths(self)
+        catalog.synced_indexes.clear()
+        catalog.synced_file_versions.clear()
+
+        dataset_path = os.path.join(backend.DATASETS_PATH, 'dataset1')
+        os.makedirs(dataset_path)
+        self.save_image('img1.nii.gz', (4, 5, 6))
+        self.save_image('img2.nii.gz', (8, 5, 6))
+
+        self.dataset = backend.get_dataset('dataset1')
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def save_image(self, name: str, shape):
+        data = np.ones(shape, dtype=np.uint8)
+        nibabel.save(nibabel.Nifti1Image(data, np.eye(4)), os.path.join(backend.DATASETS_PATH, 'dataset1', name))
+
+    def test_scan_dataset(self):
+        result = catalog.scan_dataset(db.session, self.dataset)
+        images = catalog.get_catalog_images(db.session, self.dataset)
+
+        self.assertEqual(result, catalog.CatalogScanResult(2, 0, 0, 0))
+        self.assertEqual([im.name for im in images], ['img1.nii.gz', 'img2.nii.gz'])
+        self.assertEqual(images[0].shape(), (4, 5, 6))
+        self.assertEqual(images[0].axis_codes, 'RAS')
+        self.assertIsNone(images[0].max_value)
+
+    def test_scan_dataset_compute_stats(self):
+        catalog.scan_dataset(db.session, self.dataset, compute_stats=True)
+
+        self.assertEqual(catalog.get_catalog_images(db.session, self.dataset)[0].max_value, 1)
+
+    def test_scan_dataset_incremental(self):
+        catalog.scan_dataset(db.session, self.dataset)
+
+        os.remove(os.path.join(self.dataset.path, 'img1.nii.gz'))
+        self.save_image('img2.nii.gz', (8, 5, 7))
+        os.utime(os.path.join(self.dataset.path, 'img2.nii.gz'), ns=(0, 0))
+        self.save_image('img3.nii.gz', (4, 5, 6))
+
+        result = catalog.scan_dataset(db.session, self.dataset)
+
+        self.assertEqual(result, catalog.CatalogScanResult(1, 1, 1, 0))
+        self.assertEqual(db.session.query(CatalogImage).filter(CatalogImage.name == 'img2.nii.gz').one().shape(),
+                         (8, 5, 7))
+
+    def test_sync_image_modified_in_place(self):
+        self.assertEqual(catalog.get_volume_widths(db.session, self.dataset, SliceType.AXIAL),
+                         {'img1.nii.gz': 6, 'img2.nii.gz': 6})
+
+        # Rewriting a file doesn't change its directory's mtime
+        dir_mtime_ns = os.stat(self.dataset.path).st_mtime_ns
+        self.save_image('img2.nii.gz', (8, 5, 7))
+        os.utime(os.path.join(self.dataset.path, 'img2.nii.gz'), ns=(0, 0))
+        os.utime(self.dataset.path, ns=(dir_mtime_ns, dir_mtime_ns))
+
+        catalog.sync_image(db.session, backend.get_image(self.dataset, 'img2.nii.gz'))
+
+        self.assertEqual(catalog.get_volume_widths(db.session, self.dataset, SliceType.AXIAL),
+                         {'img1.nii.gz': 6, 'img2.nii.gz': 7})
+
+    def test_get_catalog_images_filter(self):
+        images = catalog.get_catalog_images(db.session, self.dataset, axis_codes='RAS', min_shape=[5, 0, 0])
+
+        self.assertEqual([im.name for im in images], ['img2.nii.gz'])
+
+    def test_get_image_count(self):
+        self.assertEqual(catalog.get_image_count(db.session, self.dataset), 2)
+
+    def test_get_volume_widths(self):
+        widths = catalog.get_volume_widths(db.session, self.dataset, SliceType.SAGITTAL)
+
+        self.assertEqual(widths, {'img1.nii.gz': 4, 'img2.nii.gz': 8})
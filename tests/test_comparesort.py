@@ -0,0 +1,317 @@
+import functools
+import itertools
+import json
+import random
+import sys
+from datetime import datetime, timedelta
+import unittest
+from typing import List, Tuple, Union
+from unittest.mock import patch
+
+from flask import Flask
+from flask_testing import TestCase
+
+import comparesort
+import labels
+import sampling
+import sessions
+from backend import Dataset, ImageSlice, SliceType
+from model import db, LabelSession, SessionElement
+from sessions import SortStrategy
+
+
+class PendingComparison(Exception):
+    pass
+
+
+def sort_from_scratch(label_session: LabelSession) -> Union[Tuple[ImageSlice, ImageSlice], List[ImageSlice]]:
+    """
+    Sorts a session's slices from scratch like add_next_comparison originally did, returning the first comparison
+    which isn't labeled or the sorted slices.
+    """
+    comparisons = [(sampling.get_comparison_from_element(el), el.current_label_value)
+                   for el in label_session.elements if el.is_comparison() and el.current_label_value is not None]
+
+    def compare(sl1: ImageSlice, sl2: ImageSlice) -> int:
+        for comparison, label in comparisons:
+            if sl1 == comparison[0] and sl2 == comparison[1]:
+                return {'First': 1, 'Second': -1, 'No Difference': 0}[label]
+            elif sl1 == comparison[1] and sl2 == comparison[0]:
+                return {'First': -1, 'Second': 1, 'No Difference': 0}[label]
+        raise PendingComparison(sl1, sl2)
+
+    sort_fn = comparesort.SORT_FUNCTIONS[comparesort.get_sort_strategy(label_session)]
+    try:
+        return sort_fn(sampling.get_slices_from_session(label_session), compare)
+    except PendingComparison as e:
+        return e.args
+
+
+class TestCompareSort(TestCase):
+    def create_app(self):
+        application = Flask(__name__)
+        application.config['TESTING'] = True
+
+        # Empty SQLite URI points to in-memory database
+        application.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        application.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(application)
+
+        return application
+
+    def setUp(self):
+        db.create_all()
+
+        self.random = random.Random(0)
+        self.slices = [ImageSlice('img{}.nii.gz'.format(i), i, SliceType.AXIAL) for i in range(30)]
+        self.random.shuffle(self.slices)
+        self.true_values = {sl: sl.slice_index // 2 for sl in self.slices}  # Pairs of slices are equal
+
+        dataset = Dataset('dataset1', '')
+        sessions.create_sort_slice_session(db.session, 'session1', 'prompt', dataset, self.slices)
+        sessions.create_sort_slice_session(db.session, 'session2', 'prompt', dataset, self.slices)
+        sessions.create_sort_slice_session(db.session, 'session3', 'prompt', dataset, self.slices,
+                                           SortStrategy.MERGE_INSERTION)
+        sessions.create_sort_slice_session(db.session, 'session4', 'prompt', dataset, self.slices,
+                                           SortStrategy.PARALLEL_MERGE)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def label_comparison(self, comparison_el, flip: bool = False):
+        value_1, value_2 = [self.true_values[sl] for sl in sampling.get_comparison_from_element(comparison_el)]
+        if value_1 == value_2:
+            label = 'No Difference'
+        else:
+            label = 'First' if (value_1 > value_2) != flip else 'Second'
+        labels.set_label(db.session, comparison_el, label, 100)
+
+    def sort_session(self, session_id: int) -> List[ImageSlice]:
+        while True:
+            label_session = sessions.get_session_by_id(db.session, session_id)
+            expected = sort_from_scratch(label_session)
+
+            complete, comparison_el, sorted_slices = comparesort.add_next_comparison(db.session, label_session)
+            if complete:
+                self.assertEqual(sorted_slices, expected)
+                return sorted_slices
+
+            self.assertEqual(sampling.get_comparison_from_element(comparison_el), tuple(expected))
+            self.label_comparison(comparison_el)
+
+    def test_add_next_comparison_matches_sort_from_scratch(self):
+        sorted_slices = self.sort_session(1)
+        self.assertEqual([self.true_values[sl] for sl in sorted_slices], sorted(self.true_values.values()))
+
+    def test_add_next_comparison_merge_insertion(self):
+        sorted_slices = self.sort_session(3)
+        self.assertEqual([self.true_values[sl] for sl in sorted_slices], sorted(self.true_values.values()))
+
+    def test_add_next_comparison_pending(self):
+        label_session = sessions.get_session_by_id(db.session, 1)
+        _, comparison_el, _ = comparesort.add_next_comparison(db.session, label_session)
+        _, pending_el, _ = comparesort.add_next_comparison(db.session, label_session)
+
+        self.assertEqual(pending_el.id, comparison_el.id)
+
+    def test_add_next_comparison_relabeled(self):
+        for _ in range(20):
+            label_session = sessions.get_session_by_id(db.session, 1)
+            self.label_comparison(comparesort.add_next_comparison(db.session, label_session)[1])
+
+        # Labeling an earlier comparison differently changes which comparisons the sort makes next
+        label_session = sessions.get_session_by_id(db.session, 1)
+        self.label_comparison([el for el in label_session.elements if el.is_comparison()][5], flip=True)
+
+        label_session = sessions.get_session_by_id(db.session, 1)
+        expected = sort_from_scratch(label_session)
+        _, comparison_el, _ = comparesort.add_next_comparison(db.session, label_session)
+        self.assertEqual(sampling.get_comparison_from_element(comparison_el), tuple(expected))
+
+        self.sort_session(1)
+
+    def test_get_pending_comparisons_parallel_merge(self):
+        label_session = sessions.get_session_by_id(db.session, 4)
+        sorted_slices, pending_els = comparesort.get_pending_comparisons(db.session, label_session)
+
+        self.assertIsNone(sorted_slices)
+        self.assertGreater(len(pending_els), 1)
+        pending_slices = [sl for el in pending_els for sl in sampling.get_comparison_from_element(el)]
+        self.assertEqual(len(set(pending_slices)), len(pending_slices))  # Independent comparisons
+
+        # Pending comparisons aren't added again
+        self.assertEqual([el.id for el in comparesort.get_pending_comparisons(db.session, label_session)[1]],
+                         [el.id for el in pending_els])
+
+        while sorted_slices is None:
+            for el in pending_els:
+                self.label_comparison(el)
+            label_session = sessions.get_session_by_id(db.session, 4)
+            sorted_slices, pending_els = comparesort.get_pending_comparisons(db.session, label_session)
+
+        self.assertEqual([self.true_values[sl] for sl in sorted_slices], sorted(self.true_values.values()))
+
+    def test_add_next_comparison_leases(self):
+        label_session = sessions.get_session_by_id(db.session, 4)
+        comparison_el_1 = comparesort.add_next_comparison(db.session, label_session, 'labeler1')[1]
+        comparison_el_2 = comparesort.add_next_comparison(db.session, label_session, 'labeler2')[1]
+
+        self.assertNotEqual(comparison_el_1.id, comparison_el_2.id)
+        self.assertEqual(comparesort.add_next_comparison(db.session, label_session, 'labeler1')[1].id,
+                         comparison_el_1.id)
+
+        self.label_comparison(comparison_el_1)
+        comparesort.release_comparison_lease(db.session, comparison_el_1)
+        label_session = sessions.get_session_by_id(db.session, 4)
+        comparison_el_3 = comparesort.add_next_comparison(db.session, label_session, 'labeler1')[1]
+        self.assertNotIn(comparison_el_3.id, (comparison_el_1.id, comparison_el_2.id))
+
+    def test_add_next_comparison_lease_expired(self):
+        label_session = sessions.get_session_by_id(db.session, 4)
+        pending_els = comparesort.get_pending_comparisons(db.session, label_session)[1]
+        for el in pending_els:
+            el.lease_labeler_id = 'labeler1'
+            el.lease_expires = datetime.now() + timedelta(minutes=1)
+        pending_els[1].lease_expires = datetime.now() - timedelta(minutes=1)
+        db.session.commit()
+
+        # Leases are read from the elements, so they hold for labelers served by other app processes
+        comparison_el = comparesort.add_next_comparison(db.session, label_session, 'labeler2')[1]
+        self.assertEqual(comparison_el.id, pending_els[1].id)
+        self.assertEqual(comparison_el.lease_labeler_id, 'labeler2')
+
+        # Every comparison is leased, so one is shared
+        comparison_el = comparesort.add_next_comparison(db.session, label_session, 'labeler3')[1]
+        self.assertIn(comparison_el.id, [el.id for el in pending_els])
+
+    def test_get_pending_comparisons_element_indices(self):
+        sorted_slices = None
+        while sorted_slices is None:
+            label_session = sessions.get_session_by_id(db.session, 4)
+            sorted_slices, pending_els = comparesort.get_pending_comparisons(db.session, label_session)
+            for el in pending_els[::2]:  # Comparisons of later merges are added while earlier ones are pending
+                self.label_comparison(el)
+
+        label_session = sessions.get_session_by_id(db.session, 4)
+        element_indices = [el.element_index for el in label_session.elements if el.is_comparison()]
+        self.assertEqual(element_indices, list(range(len(element_indices))))
+
+    def test_add_comparison_results_first_wins(self):
+        comparison_els = [SessionElement(image_1_name=sl1.image_name, slice_1_index=sl1.slice_index,
+                                         slice_1_type=sl1.slice_type.name, image_2_name=sl2.image_name,
+                                         slice_2_index=sl2.slice_index, slice_2_type=sl2.slice_type.name,
+                                         current_label_value=label)
+                          for sl1, sl2, label in ((self.slices[0], self.slices[1], 'First'),
+                                                  (self.slices[1], self.slices[0], 'First'),
+                                                  (self.slices[1], self.slices[2], 'No Difference'))]
+
+        results = {}
+        comparesort.add_comparison_results(results, comparison_els)
+        self.assertEqual(results[(self.slices[0], self.slices[1])], 1)
+        self.assertEqual(results[(self.slices[1], self.slices[0])], -1)
+        self.assertEqual(results[(self.slices[2], self.slices[1])], 0)
+        self.assertNotIn((self.slices[0], self.slices[2]), results)
+
+    def test_add_next_comparison_continues_saved_state(self):
+        with patch('comparesort._replay_sort', wraps=comparesort._replay_sort) as replay_sort:
+            for session_id in (1, 3, 4):
+                for _ in range(20):
+                    label_session = sessions.get_session_by_id(db.session, session_id)
+                    self.label_comparison(comparesort.add_next_comparison(db.session, label_session)[1])
+            self.assertEqual(replay_sort.call_count, 3)  # Once per session, which didn't have a saved state
+
+            # Relabeling a comparison the sort already used replays it
+            label_session = sessions.get_session_by_id(db.session, 1)
+            self.label_comparison([el for el in label_session.elements if el.is_comparison()][5], flip=True)
+            label_session = sessions.get_session_by_id(db.session, 1)
+            comparesort.add_next_comparison(db.session, label_session)
+            self.assertEqual(replay_sort.call_count, 4)
+
+        for session_id in (1, 3, 4):
+            self.sort_session(session_id)
+
+    def test_add_next_comparison_interleaved(self):
+        for _ in range(10):
+            for session_id in (1, 2):
+                label_session = sessions.get_session_by_id(db.session, session_id)
+                self.label_comparison(comparesort.add_next_comparison(db.session, label_session)[1])
+
+        self.sort_session(1)
+        self.sort_session(2)
+
+
+class TestSortFunctions(unittest.TestCase):
+    def test_sort_functions_sort_with_ties(self):
+        rand = random.Random(0)
+        items = [rand.randrange(20) for _ in range(100)]
+        for sort_fn in comparesort.SORT_FUNCTIONS.values():
+            self.assertEqual(sort_fn(items, lambda a, b: (a > b) - (a < b)), sorted(items))
+
+    def test_sorters_continue_from_saved_state(self):
+        rand = random.Random(0)
+        items = [rand.randrange(20) for _ in range(100)]
+
+        for sorter_class in comparesort.SORTERS.values():
+            comparisons = []
+            sorter = sorter_class.start(len(items))
+            while sorter.result is None:
+                comparisons += sorter.pending
+                for i, j in sorter.pending:
+                    sorter.add_result((i, j), (items[i] > items[j]) - (items[i] < items[j]))
+
+            # Saving and loading the sorter before every comparison doesn't change which comparisons it makes
+            saved_comparisons = []
+            sorter = sorter_class.start(len(items))
+            while sorter.result is None:
+                for i, j in sorter.pending:
+                    sorter = sorter_class(**json.loads(json.dumps(sorter.to_json())))
+                    saved_comparisons.append((i, j))
+                    sorter.add_result((i, j), (items[i] > items[j]) - (items[i] < items[j]))
+
+            self.assertEqual(saved_comparisons, comparisons)
+            self.assertEqual([items[i] for i in sorter.result], sorted(items))
+
+    @unittest.skipUnless((3, 11) <= sys.version_info < (3, 13), 'list.sort of other Python versions differs')
+    def test_timsort_matches_builtin_sort(self):
+        rand = random.Random(0)
+
+        def random_values(n: int) -> List[float]:
+            return [rand.random() for _ in range(n)]
+
+        # Random values, ties, partly sorted values (which make merges gallop) and descending runs
+        for n in (2, 10, 63, 64, 65, 300, 1000):
+            for values in (random_values(n),
+                           [rand.randrange(n // 4 + 1) for _ in range(n)],
+                           sorted(random_values(n // 3)) + random_values(n - n // 3),
+                           sorted(random_values(n // 2)) + sorted(random_values(n - n // 2)),
+                           [(i // 100) + rand.random() * (-1) ** (i // 50) for i in range(n)]):
+                comparisons = []
+
+                def compare(i: int, j: int) -> int:
+                    comparisons.append((i, j))
+                    return (values[i] > values[j]) - (values[i] < values[j])
+
+                expected = sorted(range(n), key=functools.cmp_to_key(compare))
+                expected_comparisons = comparisons
+                comparisons = []
+                self.assertEqual(comparesort.timsort(list(range(n)), compare), expected)
+                self.assertEqual(comparisons, expected_comparisons)
+
+    def test_merge_insertion_sort_comparison_count(self):
+        # Minimum number of comparisons needed to sort n items in the worst case, which merge insertion achieves
+        min_comparison_counts = [0, 0, 1, 3, 5, 7, 10, 13]
+
+        for n, min_comparison_count in enumerate(min_comparison_counts):
+            max_comparison_count = 0
+            for items in itertools.permutations(range(n)):
+                comparison_count = 0
+
+                def compare(a: int, b: int) -> int:
+                    nonlocal comparison_count
+                    comparison_count += 1
+                    return (a > b) - (a < b)
+
+                self.assertEqual(comparesort.merge_insertion_sort(list(items), compare), list(range(n)))
+                max_comparison_count = max(max_comparison_count, comparison_count)
+            self.assertEqual(max_comparison_count, min_comparison_count)
@@ -0,0 +1,30 @@
+from io import BytesIO
+from unittest import TestCase
+
+import numpy as np
+from PIL import Image
+
+import encoding
+from encoding import ImageFormat, SliceEncoding
+
+
+class TestEncoding(TestCase):
+    def setUp(self):
+        self.data = np.arange(12 * 10, dtype=np.uint8).reshape((12, 10))
+        self.img = Image.fromarray(self.data)
+
+    def test_encode_png_lossless(self):
+        for level in (0, 1, 9):
+            png_bytes = encoding.encode_image(self.img, SliceEncoding(ImageFormat.PNG, compress_level=level))
+            np.testing.assert_array_equal(np.asarray(Image.open(BytesIO(png_bytes))), self.data)
+
+    def test_encode_jpeg(self):
+        jpeg_bytes = encoding.encode_image(self.img, SliceEncoding(ImageFormat.JPEG, quality=50))
+        decoded = Image.open(BytesIO(jpeg_bytes))
+
+        self.assertEqual(decoded.format, 'JPEG')
+        self.assertEqual(decoded.size, (10, 12))
+
+    def test_encode_raw(self):
+        raw_bytes = encoding.encode_image(self.img, SliceEncoding(ImageFormat.RAW))
+        np.testing.assert_array_equal(np.frombuffer(raw_bytes, dtype=np.uint8).reshape((12, 10)), self.data)
@@ -68,6 +68,34 @@ class TestSampling(TestCase, TestCaseMixin):
         self.assertEqual(element_label.label_value, 'l1')
         self.assertEqual(element_label.milliseconds, 1000)
 
+    def test_set_label_current_label(self):
+        dataset = backend.get_dataset('dataset1')
+        sessions.create_categorical_image_session(db.session, 'session1', 'prompt', dataset, ['l1', 'l2', 'l3'])
+        label_session = sessions.get_session_by_id(db.session, 1)
+
+        labels.set_label(db.session, label_session.elements[0], 'l1', 1000)
+        labels.set_label(db.session, label_session.elements[0], 'l2', 250)
+        labels.set_label(db.session, label_session.elements[1], 'l3', 0)
+
+        self.assertEqual(label_session.elements[0].current_label_value, 'l2')
+        self.assertEqual(label_session.elements[0].current_label_id, label_session.elements[0].labels[-1].id)
+        self.assertIsNone(label_session.elements[2].current_label_value)
+        self.assertEqual(label_session.labeled_count, 2)
+
+    def test_get_resume_point(self):
+        dataset = backend.get_dataset('dataset1')
+        sessions.create_categorical_image_session(db.session, 'session1', 'prompt', dataset, ['l1', 'l2', 'l3'])
+        label_session = sessions.get_session_by_id(db.session, 1)
+
+        self.assertEqual(labels.get_resume_point(db.session, label_session), 0)
+
+        labels.set_label(db.session, label_session.elements[0], 'l1', 1000)
+        self.assertEqual(labels.get_resume_point(db.session, label_session), 1)
+
+        labels.set_label(db.session, label_session.elements[1], 'l1', 1000)
+        labels.set_label(db.session, label_session.elements[2], 'l1', 1000)
+        self.assertIsNone(labels.get_resume_point(db.session, label_session))
+
     def test_get_all_labels_elements_length(self):
         dataset = backend.get_dataset('dataset1')
         sessions.create_categorical_image_session(db.session, 'session1', 'prompt', dataset, ['l1', 'l2', 'l3'])
@@ -0,0 +1,53 @@
+import unittest
+
+from sqlalchemy import create_engine, inspect
+
+import migrations
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        # Schema from before the current label columns were added
+        self.engine = create_engine('sqlite://')
+        with self.engine.begin() as conn:
+            conn.execute('CREATE TABLE label_sessions (id INTEGER PRIMARY KEY, dataset VARCHAR(100) NOT NULL, '
+                         'session_type VARCHAR(100) NOT NULL, element_count INTEGER NOT NULL)')
+            conn.execute('CREATE TABLE session_elements '
+                         '(id INTEGER PRIMARY KEY, session_id INTEGER NOT NULL, element_index INTEGER NOT NULL, '
+                         'slice_1_index INTEGER, slice_2_index INTEGER)')
+            conn.execute('CREATE TABLE element_labels '
+                         '(id INTEGER PRIMARY KEY, element_id INTEGER NOT NULL, label_value VARCHAR(100) NOT NULL)')
+
+            conn.execute("INSERT INTO label_sessions VALUES (1, 'dataset1', 'CATEGORICAL_IMAGE', 3)")
+            conn.execute('INSERT INTO session_elements (id, session_id, element_index) '
+                         'VALUES (1, 1, 0), (2, 1, 1), (3, 1, 2)')
+            conn.execute("INSERT INTO element_labels VALUES (1, 1, 'l1'), (2, 2, 'l2'), (3, 1, 'l3')")
+
+    def test_upgrade_database_backfills(self):
+        migrations.upgrade_database(self.engine)
+
+        with self.engine.connect() as conn:
+            elements = conn.execute('SELECT id, current_label_id, current_label_value FROM session_elements '
+                                    'ORDER BY id').fetchall()
+            labeled_count = conn.execute('SELECT labeled_count FROM label_sessions').scalar()
+
+        self.assertEqual([tuple(el) for el in elements], [(1, 3, 'l3'), (2, 2, 'l2'), (3, None, None)])
+        self.assertEqual(labeled_count, 2)
+
+        session_columns = [c['name'] for c in inspect(self.engine).get_columns('label_sessions')]
+        self.assertIn('sort_strategy', session_columns)
+        self.assertIn('sort_state', session_columns)
+        self.assertIn('sort_state_label_id', session_columns)
+
+        element_columns = [c['name'] for c in inspect(self.engine).get_columns('session_elements')]
+        self.assertIn('lease_labeler_id', element_columns)
+        self.assertIn('lease_expires', element_columns)
+
+    def test_upgrade_database_twice(self):
+        migrations.upgrade_database(self.engine)
+        migrations.upgrade_database(self.engine)
+
+        index_names = [ix['name'] for ix in inspect(self.engine).get_indexes('session_elements')]
+        self.assertIn('ix_session_elements_session_element_index', index_names)
+        self.assertIn('ix_session_elements_session_current_label', index_names)
+        self.assertIn('ix_session_elements_session_slice_indices', index_names)
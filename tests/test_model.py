@@ -0,0 +1,25 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+import model
+
+
+class TestModel(unittest.TestCase):
+    def test_set_sqlite_pragmas(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            engine = create_engine('sqlite:///' + os.path.join(temp_dir, 'test.db'), **model.SQLITE_ENGINE_OPTIONS)
+            model.set_sqlite_pragmas(engine, model.SQLITE_PRAGMAS)
+
+            with engine.connect() as conn:
+                self.assertEqual(conn.execute('PRAGMA journal_mode').scalar(), 'wal')
+                self.assertEqual(conn.execute('PRAGMA synchronous').scalar(), 1)  # NORMAL
+                self.assertEqual(conn.execute('PRAGMA busy_timeout').scalar(), model.SQLITE_PRAGMAS['busy_timeout'])
+            engine.dispose()
+
+    def test_is_sqlite_uri(self):
+        self.assertTrue(model.is_sqlite_uri('sqlite:///db/label_database.db'))
+        self.assertTrue(model.is_sqlite_uri('sqlite://'))
+        self.assertFalse(model.is_sqlite_uri('postgresql://labeler@localhost/labels'))
@@ -1,10 +1,13 @@
 import os
 
+import numpy as np
 from flask import Flask
 from flask_testing import TestCase
+from sqlalchemy import event
 from pyfakefs.fake_filesystem_unittest import TestCaseMixin
 
 import backend
+import labels
 import ranking
 import sampling
 from backend import ImageSlice, SliceType
@@ -57,3 +60,112 @@ class TestSampling(TestCase, TestCaseMixin):
 
         ranked_slices = [t[0] for t in rank_results]
         self.assertEqual(set(ranked_slices), set(check_slices))
+
+    def test_rank_slices_query_count(self):
+        dataset = backend.get_dataset('dataset1')
+        comparisons = [(ImageSlice('img1.nii.gz', i, SliceType.SAGITTAL),
+                        ImageSlice('img2.nii', i, SliceType.SAGITTAL)) for i in range(20)]
+        sessions.create_comparison_slice_session(db.session, 'session1', 'prompt', dataset,
+                                                 ['l1', 'l2'], comparisons)
+        for el in sessions.get_session_by_id(db.session, 1).elements:
+            labels.set_label(db.session, el, 'First', 100)
+        db.session.expire_all()
+
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute', count_statement)
+
+        label_session = sessions.get_session_by_id(db.session, 1, load_labels=True)
+        rank_results = ranking.rank_slices(label_session)
+
+        # The session, its elements and their labels, however many elements there are
+        self.assertEqual(len(statements), 3)
+        self.assertEqual(rank_results[0][1].win_count, 1)
+
+    def create_labeled_session(self, comparison_count: int, seed: int = 0):
+        """
+        Creates a session comparing 20 slices whose labels follow a Bradley-Terry model with strengths increasing with
+        the slice index.
+        """
+        rand = np.random.RandomState(seed)
+        slices = [ImageSlice('img1.nii.gz', i, SliceType.AXIAL) for i in range(20)]
+        pairs = [rand.choice(len(slices), 2, replace=False) for _ in range(comparison_count)]
+
+        dataset = backend.get_dataset('dataset1')
+        sessions.create_comparison_slice_session(db.session, 'session1', 'prompt', dataset, ['l1', 'l2'],
+                                                 [(slices[i], slices[j]) for i, j in pairs])
+        label_session = sessions.get_session_by_id(db.session, 1)
+        for el, (i, j) in zip(label_session.elements, pairs):
+            first_wins = rand.random_sample() < 1 / (1 + np.exp((j - i) / 4))
+            labels.set_label(db.session, el, 'First' if first_wins else 'Second', 100)
+
+        db.session.expire_all()
+        return sessions.get_session_by_id(db.session, 1)
+
+    def test_rank_slices_methods_order(self):
+        label_session = self.create_labeled_session(800)
+
+        for method in ranking.RankingMethod:
+            ranked_indices = [sl.slice_index for sl, _ in ranking.rank_slices(label_session, method)]
+            correlation = np.corrcoef(ranked_indices, np.arange(20)[::-1])[0, 1]
+            self.assertGreater(correlation, 0.9, method)
+
+    def test_rank_slices_confidence_intervals(self):
+        label_session = self.create_labeled_session(200)
+
+        for method in (ranking.RankingMethod.WIN_RATE, ranking.RankingMethod.BRADLEY_TERRY):
+            for _, result in ranking.rank_slices(label_session, method):
+                self.assertLess(result.ci_low, result.score)
+                self.assertGreater(result.ci_high, result.score)
+
+    def test_get_comparison_arrays(self):
+        dataset = backend.get_dataset('dataset1')
+        sl1, sl2, sl3 = [ImageSlice('img1.nii.gz', i, SliceType.AXIAL) for i in range(3)]
+        sessions.create_comparison_slice_session(db.session, 'session1', 'prompt', dataset, ['No Difference'],
+                                                 [(sl2, sl1), (sl1, sl3), (sl3, sl2)])
+        label_session = sessions.get_session_by_id(db.session, 1)
+        labels.set_label(db.session, label_session.elements[0], 'First', 100)
+        labels.set_label(db.session, label_session.elements[1], 'No Difference', 100)
+
+        arrays = ranking.get_comparison_arrays(sessions.get_session_by_id(db.session, 1))
+
+        self.assertEqual(arrays.slices, [sl1, sl2, sl3])
+        self.assertEqual(arrays.first.tolist(), [1, 0])
+        self.assertEqual(arrays.second.tolist(), [0, 2])
+        self.assertEqual(arrays.outcome.tolist(), [1.0, 0.5])
+
+        # Same arrays from elements which are already loaded
+        label_session = sessions.get_session_by_id(db.session, 1)
+        self.assertEqual(len(label_session.elements), 3)
+        loaded_arrays = ranking.get_comparison_arrays(label_session)
+        self.assertEqual(loaded_arrays.slices, arrays.slices)
+        for name in ('first', 'second', 'outcome'):
+            self.assertEqual(getattr(loaded_arrays, name).tolist(), getattr(arrays, name).tolist(), name)
+
+    def test_bradley_terry_penalized_maximum_likelihood(self):
+        arrays = ranking.get_comparison_arrays(self.create_labeled_session(200))
+        log_strength = ranking.bradley_terry(arrays)[0]
+        self.assertAlmostEqual(np.mean(log_strength), 0)
+
+        # The log-strengths are centered after fitting, so find the shift at which the prior's gradient is 0 (the
+        # likelihood's gradient always sums to 0)
+        def prior_gradient(shift: float) -> np.ndarray:
+            strength = np.exp(log_strength + shift)
+            return ranking.BRADLEY_TERRY_PRIOR * (1 - 2 * strength / (strength + 1))
+
+        low, high = -10.0, 10.0
+        for _ in range(100):
+            middle = (low + high) / 2
+            low, high = (middle, high) if np.sum(prior_gradient(middle)) > 0 else (low, middle)
+        strength = np.exp(log_strength + low)
+
+        # Gradient of the penalized log-likelihood with respect to the log-strengths: actual minus expected wins
+        a, b, outcome = arrays.first, arrays.second, arrays.outcome
+        expected = strength[a] / (strength[a] + strength[b])
+        n = len(arrays.slices)
+        gradient = np.bincount(a, weights=outcome - expected, minlength=n) - \
+            np.bincount(b, weights=outcome - expected, minlength=n) + prior_gradient(low)
+        self.assertLess(np.max(np.abs(gradient)), 1e-4)
@@ -365,3 +365,16 @@ class TestSessions(TestCase, TestCaseMixin):
         self.assertIsNone(session_elements[0].image_2_name)
         self.assertIsNone(session_elements[0].slice_2_index)
         self.assertIsNone(session_elements[0].slice_2_type)
+
+    def test_export_import_sort_session_strategy(self):
+        dataset = backend.get_dataset('dataset1')
+        slices = [ImageSlice('img1.nii.gz', 0, SliceType.AXIAL), ImageSlice('img2.nii', 0, SliceType.AXIAL)]
+        sessions.create_sort_slice_session(db.session, 'session1', 'prompt', dataset, slices,
+                                           sessions.SortStrategy.MERGE_INSERTION)
+        session_json = sessions.export_session_json(sessions.get_session_by_id(db.session, 1))
+
+        sessions.import_session_json(db.session, dataset, 'session2', session_json)
+        label_session = sessions.get_session_by_id(db.session, 2)
+
+        self.assertEqual(session_json['sort_strategy'], 'MERGE_INSERTION')
+        self.assertEqual(label_session.sort_strategy, 'MERGE_INSERTION')
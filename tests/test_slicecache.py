@@ -0,0 +1,66 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import slicecache
+from slicecache import MemorySliceCache, DiskSliceCache, TieredSliceCache
+
+
+class TestDiskSliceCache(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.temp_dir.name, 'slice_cache')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_put_get(self):
+        cache = DiskSliceCache(self.cache_path, 100)
+        cache.put('abc', b'12345')
+
+        self.assertEqual(cache.get('abc'), b'12345')
+        self.assertIsNone(cache.get('def'))
+
+    def test_evicts_by_bytes(self):
+        cache = DiskSliceCache(self.cache_path, 12)
+        cache.put('aa', b'12345')
+        cache.put('bb', b'12345')
+        cache.put('cc', b'12345')
+
+        self.assertIsNone(cache.get('aa'))
+        self.assertEqual(cache.get('cc'), b'12345')
+        self.assertEqual(cache.stats().evictions, 1)
+        self.assertEqual(cache.stats().current_bytes, 10)
+
+    def test_existing_files_loaded(self):
+        DiskSliceCache(self.cache_path, 100).put('abc', b'12345')
+        cache = DiskSliceCache(self.cache_path, 100)
+
+        self.assertEqual(cache.get('abc'), b'12345')
+        self.assertEqual(cache.stats().current_bytes, 5)
+
+
+class TestTieredSliceCache(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.temp_dir.name, 'slice_cache')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_promotes_to_memory(self):
+        memory = MemorySliceCache(100)
+        disk = DiskSliceCache(self.cache_path, 100)
+        disk.put('abc', b'12345')
+
+        cache = TieredSliceCache([memory, disk])
+
+        self.assertEqual(cache.get('abc'), b'12345')
+        self.assertEqual(memory.get('abc'), b'12345')
+
+    def test_create_slice_cache_disk_disabled(self):
+        cache = slicecache.create_slice_cache(100, self.cache_path, 0)
+        cache.put('abc', b'12345')
+
+        self.assertEqual(list(cache.tier_stats().keys()), ['memory'])
+        self.assertFalse(os.path.exists(self.cache_path))
@@ -0,0 +1,86 @@
+import os
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import nibabel
+import numpy as np
+
+import backend
+import thumbnails
+from backend import ImageSlice, SliceType
+from model import LabelSession
+from temp_data import use_temp_data_paths
+
+
+class TestThumbnails(unittest.TestCase):
+    def setUp(self):
+        use_temp_data_paths(self, 'thumbnails.THUMBS_PATH')
+        backend.volume_cache.clear()
+
+        for image_name in ('img1.nii.gz', 'img2.nii.gz'):
+            image_path = os.path.join(backend.DATASETS_PATH, 'dataset1', image_name)
+            os.makedirs(os.path.dirname(image_path), exist_ok=True)
+            data = np.arange(4 * 5 * 6, dtype=np.uint8).reshape((4, 5, 6))
+            nibabel.save(nibabel.Nifti1Image(data, np.eye(4)), image_path)
+
+        self.slices = [ImageSlice('img1.nii.gz', 1, SliceType.AXIAL),
+                       ImageSlice('img1.nii.gz', 2, SliceType.SAGITTAL),
+                       ImageSlice('img2.nii.gz', 3, SliceType.CORONAL)]
+        self.slices_patch = patch('sampling.get_slices_from_session', return_value=self.slices)
+        self.slices_patch.start()
+
+        self.label_session = LabelSession(id=1, dataset='dataset1', session_name='session1')
+
+    def tearDown(self):
+        backend.volume_cache.clear()
+        thumbnails.thumbnail_jobs.clear()
+        self.slices_patch.stop()
+
+    def test_group_slices_by_image(self):
+        dataset = backend.get_dataset('dataset1')
+        slices_by_image = backend.group_slices_by_image(dataset, self.slices[::-1])
+
+        self.assertEqual([(d_img.name, image_slices) for d_img, image_slices in slices_by_image],
+                         [('img2.nii.gz', self.slices[2:]), ('img1.nii.gz', self.slices[1::-1])])
+
+    def test_create_image_thumbnails_skips_existing(self):
+        d_img = backend.get_image(backend.get_dataset('dataset1'), 'img1.nii.gz')
+        thumbs_path = thumbnails.get_dataset_thumbnails_path(d_img.dataset)
+
+        self.assertEqual(thumbnails.create_image_thumbnails(d_img, self.slices[:2], thumbs_path), 2)
+        self.assertEqual(thumbnails.create_image_thumbnails(d_img, self.slices[:2], thumbs_path), 0)
+
+    def test_thumbnail_job(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            job = thumbnails.start_thumbnail_job(self.label_session, executor)
+
+        self.assertIs(thumbnails.get_thumbnail_job(1), job)
+        self.assertEqual(job.status, thumbnails.ThumbnailJobStatus.COMPLETE)
+        self.assertEqual(job.to_json()['created_count'], 3)
+        self.assertTrue(all(d.exists for d in thumbnails.get_thumbnails(self.label_session).values()))
+
+    def test_thumbnail_job_process_pool(self):
+        with patch('thumbnails.THUMB_JOB_WORKERS', 2):
+            job = thumbnails.start_thumbnail_job(self.label_session)
+            try:
+                deadline = time.monotonic() + 60
+                while job.status == thumbnails.ThumbnailJobStatus.RUNNING and time.monotonic() < deadline:
+                    time.sleep(0.05)
+            finally:
+                thumbnails.job_executor.shutdown()
+                thumbnails.job_executor = None
+
+        self.assertEqual(job.status, thumbnails.ThumbnailJobStatus.COMPLETE, job.errors)
+        self.assertEqual(job.to_json()['created_count'], 3)
+        self.assertTrue(all(d.exists for d in thumbnails.get_thumbnails(self.label_session).values()))
+
+    def test_thumbnail_job_rerun(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            thumbnails.start_thumbnail_job(self.label_session, executor)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            job = thumbnails.start_thumbnail_job(self.label_session, executor)
+
+        self.assertEqual(job.status, thumbnails.ThumbnailJobStatus.COMPLETE)
+        self.assertEqual(job.slice_count, 0)
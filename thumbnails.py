@@ -1,13 +1,23 @@
+import multiprocessing
 import os
-from typing import List, NamedTuple, Dict
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from enum import Enum
+from typing import List, NamedTuple, Dict, Optional
 
 import backend
+import encoding
 import sampling
+from encoding import ImageFormat, SliceEncoding
 from model import LabelSession
 
 THUMBS_PATH = os.path.join('static', 'thumbnails')
-THUMB_EXTENSION = '.jpg'
+THUMB_ENCODING = SliceEncoding(ImageFormat.JPEG, quality=75)
+THUMB_EXTENSION = encoding.FORMAT_EXTENSIONS[THUMB_ENCODING.image_format]
 THUMB_MAX_PERCENTILE = 99
+THUMB_SIZE = 256  # Thumbnails are rendered from the smallest pyramid level with at least this many pixels per side
+
+THUMB_JOB_WORKERS = 4  # Processes used by background thumbnail jobs
 
 
 class ThumbData(NamedTuple):
@@ -15,6 +25,63 @@ class ThumbData(NamedTuple):
     exists: bool
 
 
+class ThumbnailJobStatus(Enum):
+    RUNNING = 0
+    COMPLETE = 1
+    FAILED = 2
+
+
+class ThumbnailJob:
+    """
+    Progress of creating a session's missing thumbnails in the background. Slices are grouped by image and each image
+    is handled by one task, so its volume is only loaded once.
+    """
+
+    def __init__(self, session_id: int, slice_count: int, image_count: int):
+        self.session_id = session_id
+        self.slice_count = slice_count
+        self.image_count = image_count
+
+        self.images_done = 0
+        self.slices_done = 0
+        self.created_count = 0
+        self.errors: List[str] = []
+
+        self._lock = threading.Lock()
+
+    @property
+    def status(self) -> ThumbnailJobStatus:
+        with self._lock:
+            if self.images_done < self.image_count:
+                return ThumbnailJobStatus.RUNNING
+            return ThumbnailJobStatus.FAILED if self.errors else ThumbnailJobStatus.COMPLETE
+
+    def to_json(self) -> Dict:
+        status = self.status
+        with self._lock:
+            return {
+                'status': status.name,
+                'slice_count': self.slice_count,
+                'slices_done': self.slices_done,
+                'created_count': self.created_count,
+                'errors': list(self.errors)
+            }
+
+    def image_done(self, future: Future, slice_count: int):
+        with self._lock:
+            self.images_done += 1
+            self.slices_done += slice_count
+            try:
+                self.created_count += future.result()
+            except Exception as e:
+                self.errors.append(repr(e))
+
+
+thumbnail_jobs: Dict[int, ThumbnailJob] = {}
+thumbnail_jobs_lock = threading.Lock()
+job_executor: Optional[Executor] = None
+
+
 def get_dataset_thumbnails_path(dataset: backend.Dataset) -> str:
     return os.path.join(THUMBS_PATH, dataset.name)
 
@@ -34,22 +101,105 @@ def get_thumbnails(label_session: LabelSession) -> Dict[backend.ImageSlice, Thum
     return thumbs_data
 
 
+def create_image_thumbnails(d_img: backend.DataImage, slices: List[backend.ImageSlice],
+                            dataset_thumbs_path: str) -> int:
+    """
+    Creates the thumbnails of slices from one image, skipping thumbnails which already exist. The image's volume is
+    read at most once.
+
+    :return: The number of thumbnails created.
+    """
+    os.makedirs(dataset_thumbs_path, exist_ok=True)
+
+    created = 0
+    volume = None  # Loaded on first use, so the volume isn't read if every thumbnail exists
+    for sl in slices:
+        slice_thumb_path = os.path.join(dataset_thumbs_path, get_thumbnail_name(sl))
+        if os.path.exists(slice_thumb_path):
+            continue
+
+        if volume is None:
+            volume = backend.get_volume(d_img)
+        level = backend.get_pyramid_level(d_img, sl.slice_type, THUMB_SIZE)
+        img = backend.get_slice(d_img, sl.slice_index, sl.slice_type, 0, None, THUMB_MAX_PERCENTILE, level, volume)
+
+        # Write to a temporary file first so an interrupted job never leaves a partial thumbnail behind
+        temp_path = slice_thumb_path + '.tmp.{}'.format(os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(encoding.encode_image(img, THUMB_ENCODING))
+        os.replace(temp_path, slice_thumb_path)
+        created += 1
+    return created
+
+
 def create_thumbnails(label_session: LabelSession):
     dataset = backend.get_dataset(label_session.dataset)
     slices = sampling.get_slices_from_session(label_session)
 
     dataset_thumbs_path = get_dataset_thumbnails_path(dataset)
-    os.makedirs(dataset_thumbs_path, exist_ok=True)
 
     created = 0
-    for sl in slices:
-        d_img = backend.get_image(dataset, sl.image_name)
-        slice_thumb_path = os.path.join(dataset_thumbs_path, get_thumbnail_name(sl))
-        if not os.path.exists(slice_thumb_path):
-            img = backend.get_slice(d_img, sl.slice_index, sl.slice_type, 0, None, THUMB_MAX_PERCENTILE)
-            img.save(slice_thumb_path)
-            created += 1
+    for d_img, image_slices in backend.group_slices_by_image(dataset, slices):
+        created += create_image_thumbnails(d_img, image_slices, dataset_thumbs_path)
 
     print('Created {} thumbnails for session {} (skipped {}, total {})'.format(
         created, label_session.session_name, len(slices) - created, len(slices)
     ))
+
+
+def _init_job_worker(prepared_path: str, volume_dtype: Optional[str]):
+    # Workers are spawned, so they start from a fresh import and need the settings the app changed. They only write
+    # their own thumbnail files; shared state such as the stats index is only written by the app process.
+    backend.PREPARED_PATH = prepared_path
+    backend.volume_dtype = volume_dtype
+
+
+def get_job_executor() -> Executor:
+    """
+    Gets the process pool of thumbnail jobs. Its workers are spawned rather than forked, since forking the
+    multithreaded app process can copy locks held by other threads (e.g. the volume cache's or the database pool's)
+    into the workers, where they would never be released.
+    """
+    global job_executor
+    if job_executor is None:
+        job_executor = ProcessPoolExecutor(max_workers=THUMB_JOB_WORKERS,
+                                           mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_init_job_worker,
+                                           initargs=(backend.PREPARED_PATH, backend.volume_dtype))
+    return job_executor
+
+
+def get_thumbnail_job(session_id: int) -> Optional[ThumbnailJob]:
+    with thumbnail_jobs_lock:
+        return thumbnail_jobs.get(session_id)
+
+
+def start_thumbnail_job(label_session: LabelSession, executor: Executor = None) -> ThumbnailJob:
+    """
+    Starts creating a session's missing thumbnails in the background. If a job is already running for the session,
+    that job is returned instead of starting another one. Jobs only create missing thumbnails, so they can safely be
+    started again after being interrupted or failing.
+
+    :param executor: Executor to run the job on (default: a shared process pool with THUMB_JOB_WORKERS processes).
+    """
+    with thumbnail_jobs_lock:
+        job = thumbnail_jobs.get(label_session.id)
+        if job is not None and job.status == ThumbnailJobStatus.RUNNING:
+            return job
+
+        dataset = backend.get_dataset(label_session.dataset)
+        dataset_thumbs_path = get_dataset_thumbnails_path(dataset)
+
+        missing_slices = [sl for sl, thumb_data in get_thumbnails(label_session).items() if not thumb_data.exists]
+        slices_by_image = backend.group_slices_by_image(dataset, missing_slices)
+
+        job = ThumbnailJob(label_session.id, len(missing_slices), len(slices_by_image))
+        thumbnail_jobs[label_session.id] = job
+
+        if executor is None:
+            executor = get_job_executor()
+        for d_img, image_slices in slices_by_image:
+            future = executor.submit(create_image_thumbnails, d_img, image_slices, dataset_thumbs_path)
+            future.add_done_callback(lambda f, slice_count=len(image_slices): job.image_done(f, slice_count))
+
+    return job